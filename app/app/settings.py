@@ -38,6 +38,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'rest_framework',
     'rest_framework.authtoken',
     'core',
@@ -90,6 +91,37 @@ DATABASES = {
 }
 
 
+# Caches
+# https://docs.djangoproject.com/en/2.1/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # responses of the recipe list endpoints and the data version of
+    # each user (see recipe.cache). With more than one worker process,
+    # use a backend shared by all of them, e.g.
+    # django.core.cache.backends.filebased.FileBasedCache
+    'recipe': {
+        'BACKEND': os.environ.get(
+            'RECIPE_CACHE_BACKEND',
+            'django.core.cache.backends.locmem.LocMemCache'
+        ),
+        'LOCATION': os.environ.get('RECIPE_CACHE_LOCATION', 'recipe'),
+        'TIMEOUT': 300,
+    },
+}
+
+RECIPE_CACHE = 'recipe'
+# a LocMemCache is only used for responses and data versions when a
+# single process serves requests, as runserver and the tests do
+RECIPE_CACHE_SINGLE_PROCESS = DEBUG
+# seconds a data version is kept. The management commands bump the
+# versions in their own process, so with a per process cache the API
+# sees their writes once the versions expire
+RECIPE_CACHE_VERSION_TIMEOUT = 60
+
+
 # Password validation
 # https://docs.djangoproject.com/en/2.1/ref/settings/#auth-password-validators
 
@@ -135,4 +167,50 @@ MEDIA_URL = '/media/'
 MEDIA_ROOT = '/vol/web/media'
 STATIC_ROOT = '/vol/web/static'
 
+# media files are sent by the front-end server when this names one:
+# 'x-accel-redirect' (nginx, with MEDIA_ACCEL_PREFIX as an internal
+# location aliased to MEDIA_ROOT) or 'x-sendfile' (Apache, lighttpd).
+# Empty sends them from Django (see core.media)
+MEDIA_SENDFILE = os.environ.get('MEDIA_SENDFILE', '')
+MEDIA_ACCEL_PREFIX = '/protected-media/'
+# seconds media files may be cached, images named by their content are
+# cached for a year
+MEDIA_MAX_AGE = 60 * 60
+
 AUTH_USER_MODEL = 'core.User'
+
+# Raise instead of logging when a view runs more queries than
+# its query_budget allows (see recipe.budget)
+QUERY_BUDGET_STRICT = False
+
+# tokens kept in memory by user.authentication.CachedTokenAuthentication,
+# and for how many seconds
+TOKEN_CACHE_SIZE = 10000
+TOKEN_CACHE_TTL = 60
+
+# threads hashing login passwords, logins allowed to wait for one,
+# and seconds a login waits before it is answered with 503
+# (see user.passwords)
+PASSWORD_WORKERS = int(os.environ.get('PASSWORD_WORKERS', 4))
+PASSWORD_QUEUE_SIZE = int(os.environ.get('PASSWORD_QUEUE_SIZE', 16))
+PASSWORD_VERIFY_TIMEOUT = 10
+
+# resized copies of recipe images, by name, with their largest side in
+# pixels, the JPEG quality they are saved with, the threads generating
+# them after an upload and how many images may wait for them
+# (see core.images)
+RECIPE_IMAGE_SIZES = {
+    'thumbnail': 160,
+    'card': 640,
+    'full': 1600,
+}
+RECIPE_IMAGE_QUALITY = 85
+IMAGE_WORKERS = int(os.environ.get('IMAGE_WORKERS', 2))
+IMAGE_QUEUE_SIZE = int(os.environ.get('IMAGE_QUEUE_SIZE', 32))
+
+# largest recipe image upload in bytes, largest width * height, and the
+# Pillow formats accepted. Checked while streaming and from the image
+# header (see recipe.uploads)
+RECIPE_IMAGE_MAX_SIZE = 10 * 1024 * 1024
+RECIPE_IMAGE_MAX_PIXELS = 40 * 1000 * 1000
+RECIPE_IMAGE_FORMATS = ('JPEG', 'PNG', 'GIF', 'WEBP')
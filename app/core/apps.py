@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class CoreConfig(AppConfig):
     name = 'core'
+
+    # connect the signal handlers once the models are loaded
+    def ready(self):
+        from core import signals  # noqa: F401
@@ -0,0 +1,352 @@
+import hashlib
+import io
+import logging
+import math
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F
+from PIL import Image
+
+from core.models import Recipe, StoredImage
+
+
+logger = logging.getLogger(__name__)
+
+
+# Uploads are stored once per content, named by their SHA-256, which the
+# upload handler computes while the file streams in (recipe.uploads).
+# StoredImage counts the recipes using each file: uploading an image that
+# is stored already only adds a reference, and the files are deleted
+# after the last one is dropped and committed.
+#
+# Lists only need a small copy of the images. The copies listed in
+# settings.RECIPE_IMAGE_SIZES are generated after the upload is
+# committed, on a few threads of the process (Pillow releases the GIL
+# while decoding and resizing), and recorded in Recipe.image_derivatives.
+# Until then the serializers answer null for them and clients show the
+# original. Copies are named after the image, so they are shared too.
+# At most IMAGE_QUEUE_SIZE images wait for a thread. Past that the
+# generation is deferred to the build_image_derivatives command, which
+# handles the images that have no copies yet.
+
+IMAGES_DIR = 'uploads/recipe/sha256'
+DERIVATIVES_DIR = 'derivatives/recipe'
+
+
+def image_storage():
+    return Recipe._meta.get_field('image').storage
+
+
+def content_path(digest, filename):
+    """return the storage path of an image from its SHA-256"""
+    ext = os.path.splitext(filename)[1].lower()
+    # two levels of directories keep them small
+    return f'{IMAGES_DIR}/{digest[:2]}/{digest[2:4]}/{digest}{ext}'
+
+
+def file_digest(file):
+    """return the SHA-256 of a file, for files not hashed on upload"""
+    sha256 = hashlib.sha256()
+    for chunk in file.chunks():
+        sha256.update(chunk)
+    file.seek(0)
+    return sha256.hexdigest()
+
+
+def _take_reference(digest):
+    return StoredImage.objects.filter(sha256=digest) \
+        .update(ref_count=F('ref_count') + 1) == 1
+
+
+def store_image(file):
+    """store an uploaded image unless the same content is stored
+    already, and return its StoredImage with one more reference"""
+    # recipe.uploads hashes the uploads while they stream in
+    digest = getattr(file, 'sha256', None) or file_digest(file)
+    storage = image_storage()
+    with transaction.atomic():
+        if not _take_reference(digest):
+            try:
+                with transaction.atomic():
+                    StoredImage.objects.create(
+                        sha256=digest, name=content_path(digest, file.name),
+                        size=file.size, ref_count=1
+                    )
+            except IntegrityError:
+                # created meanwhile by a concurrent upload
+                _take_reference(digest)
+        stored = StoredImage.objects.get(sha256=digest)
+        # the file of a new image, or of one whose deletion was rolled
+        # back, is written while the row is locked
+        if not storage.exists(stored.name):
+            storage.save(stored.name, file)
+    return stored
+
+
+def release_image(recipe):
+    """drop the reference of a recipe to its image
+
+    The image and its derivatives are deleted once the transaction that
+    dropped the last reference commits, see delete_unused_image
+    """
+    release(recipe.image.name, recipe.image_derivatives)
+
+
+def release(name, derivatives):
+    """drop a reference to the image name, derivatives are those of the
+    recipe that used it"""
+    if not name:
+        return
+    with transaction.atomic():
+        stored = StoredImage.objects.select_for_update() \
+            .filter(name=name).first()
+        if stored is None:
+            # stored before images were shared, only this recipe uses it
+            transaction.on_commit(
+                lambda: delete_files(name, derivatives)
+            )
+            return
+        stored.ref_count -= 1
+        stored.save(update_fields=['ref_count'])
+        if stored.ref_count == 0:
+            transaction.on_commit(lambda: delete_unused_image(name))
+
+
+def image_changed(recipe):
+    """return True if the image of a recipe differs from the stored one"""
+    # deferred and never set
+    if 'image' not in recipe.__dict__:
+        return False
+    image = recipe.image
+    if image and not image._committed:
+        return True
+    return (image.name or '') != (getattr(recipe, '_loaded_image', None)
+                                  or '')
+
+
+def image_saving(recipe):
+    """store the new image of a recipe that is being saved and release
+    the previous one, in the transaction of the save
+
+    Returns True if the derivatives of the new image must be generated
+    """
+    previous = None
+    if not recipe._state.adding:
+        previous = Recipe.objects.filter(pk=recipe.pk) \
+            .values_list('image', 'image_derivatives').first()
+
+    image = recipe.image
+    generate = False
+    if image and not image._committed:
+        stored = store_image(image.file)
+        image.name = stored.name
+        image._committed = True
+        recipe.image_derivatives = stored.derivatives
+        generate = not stored.derivatives
+    elif image:
+        # the name of a stored file was assigned
+        if _take_reference_by_name(image.name):
+            recipe.image_derivatives = StoredImage.objects \
+                .filter(name=image.name) \
+                .values_list('derivatives', flat=True).get()
+        else:
+            recipe.image_derivatives = {}
+    else:
+        recipe.image_derivatives = {}
+
+    if previous is not None:
+        release(*previous)
+    return generate
+
+
+def _take_reference_by_name(name):
+    return StoredImage.objects.filter(name=name) \
+        .update(ref_count=F('ref_count') + 1) == 1
+
+
+def delete_files(name, derivatives):
+    image_storage().delete(name)
+    delete_derivatives(derivatives)
+
+
+def delete_unused_image(name):
+    """delete an image and its derivatives, unless an upload referenced
+    it again after its last reference was dropped"""
+    with transaction.atomic():
+        stored = StoredImage.objects.select_for_update() \
+            .filter(name=name, ref_count=0).first()
+        if stored is None:
+            return
+        stored.delete()
+        # deleted while the row is locked, so that a concurrent upload of
+        # the same image writes it again
+        delete_files(name, stored.derivatives)
+
+
+def derivative_path(image_name, size_name):
+    """return the storage path of a derivative of an image"""
+    stem = os.path.splitext(os.path.basename(image_name))[0]
+    return f'{DERIVATIVES_DIR}/{stem}/{size_name}.jpg'
+
+
+def render(source, sizes):
+    """return {size name: JPEG bytes} of an image file
+
+    sizes maps names to the largest side of the derivative, in pixels
+    """
+    image = Image.open(source)
+    # JPEG can be decoded at 1/2, 1/4 or 1/8 of its size. draft picks
+    # the smallest scale still larger than the largest derivative, so a
+    # large photo is never decoded in full. Other formats ignore it
+    scale = min(max(sizes.values()) / max(image.size), 1)
+    image.draft('RGB', (math.ceil(image.width * scale),
+                        math.ceil(image.height * scale)))
+    image = image.convert('RGB')
+
+    rendered = {}
+    # each derivative is scaled down from the previous, larger one
+    for name, side in sorted(sizes.items(), key=lambda item: -item[1]):
+        image.thumbnail((side, side), Image.LANCZOS)
+        output = io.BytesIO()
+        image.save(output, 'JPEG', quality=settings.RECIPE_IMAGE_QUALITY,
+                   optimize=True)
+        rendered[name] = output.getvalue()
+    return rendered
+
+
+def delete_derivatives(paths):
+    """delete the files of {size name: path}"""
+    storage = image_storage()
+    for path in paths.values():
+        storage.delete(path)
+
+
+def write_derivatives(image_name):
+    """render the derivatives of an image, return their paths"""
+    storage = image_storage()
+    with storage.open(image_name) as source:
+        rendered = render(source, settings.RECIPE_IMAGE_SIZES)
+
+    paths = {}
+    for name, data in rendered.items():
+        path = derivative_path(image_name, name)
+        # the storage would pick another name for an existing file
+        storage.delete(path)
+        paths[name] = storage.save(path, ContentFile(data))
+    StoredImage.objects.filter(name=image_name).update(derivatives=paths)
+    return paths
+
+
+def generate(recipe_id, image_name, reuse=True):
+    """record the derivatives of an image on its recipe
+
+    The derivatives of a shared image are only rendered once, unless
+    reuse is False. Returns the paths, or None when the image of the
+    recipe changed meanwhile
+    """
+    paths = None
+    if reuse:
+        paths = StoredImage.objects.filter(name=image_name) \
+            .values_list('derivatives', flat=True).first()
+    if not paths:
+        paths = write_derivatives(image_name)
+
+    with transaction.atomic():
+        recipe = Recipe.objects.select_for_update() \
+            .filter(pk=recipe_id, image=image_name).first()
+        if recipe is not None:
+            stale = {name: path for name, path
+                     in recipe.image_derivatives.items()
+                     if path not in paths.values()}
+            recipe.image_derivatives = paths
+            # updated_at changes the ETag, and post_save drops the
+            # cached responses of the user
+            recipe.save(update_fields=['image_derivatives', 'updated_at'])
+
+    if recipe is None:
+        # the files are shared while the image is stored
+        if not StoredImage.objects.filter(name=image_name).exists():
+            delete_derivatives(paths)
+        return None
+    delete_derivatives(stale)
+    return paths
+
+
+class DerivativeGenerator:
+    """Generate image derivatives on a pool of threads"""
+
+    def __init__(self, workers, queue_size):
+        self.workers = workers
+        self.queue_size = queue_size
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix='images'
+        )
+        self._slots = threading.BoundedSemaphore(workers + queue_size)
+        self._lock = threading.Lock()
+        self.pending = 0
+        self.generated = 0
+        self.failed = 0
+        self.deferred = 0
+
+    def submit(self, recipe_id, image_name):
+        """generate the derivatives of an image, returns a future, or
+        None when the queue is full and the generation is deferred"""
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.deferred += 1
+            logger.warning('deferred the derivatives of recipe %s, run '
+                           'build_image_derivatives', recipe_id)
+            return None
+        with self._lock:
+            self.pending += 1
+        return self._executor.submit(self._generate, recipe_id, image_name)
+
+    def _generate(self, recipe_id, image_name):
+        try:
+            paths = generate(recipe_id, image_name)
+        except Exception:
+            logger.exception('generating the derivatives of recipe %s '
+                             'failed', recipe_id)
+            with self._lock:
+                self.failed += 1
+            return None
+        finally:
+            # the thread opened its own connection
+            connection.close()
+            with self._lock:
+                self.pending -= 1
+            self._slots.release()
+        if paths is not None:
+            with self._lock:
+                self.generated += 1
+        return paths
+
+
+_generator = None
+_generator_lock = threading.Lock()
+
+
+def get_generator():
+    """return the generator of this process, created on first use so
+    that forked worker processes do not share its threads"""
+    global _generator
+    with _generator_lock:
+        if _generator is None:
+            _generator = DerivativeGenerator(settings.IMAGE_WORKERS,
+                                             settings.IMAGE_QUEUE_SIZE)
+        return _generator
+
+
+def schedule(recipe):
+    """generate the derivatives of the image of a recipe once the
+    current transaction commits"""
+    recipe_id, image_name = recipe.pk, recipe.image.name
+    if image_name:
+        transaction.on_commit(
+            lambda: get_generator().submit(recipe_id, image_name)
+        )
@@ -0,0 +1,94 @@
+import time
+from multiprocessing import Pool
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from core import images
+from core.models import Recipe
+
+
+def generate_one(row):
+    """generate the derivatives of (recipe id, image name, reuse)
+
+    runs in worker processes too, returns an error message or None.
+    Saving the derivatives bumps the data version of the user in the
+    cache of the process, see RECIPE_CACHE_VERSION_TIMEOUT
+    """
+    recipe_id, image_name, reuse = row
+    try:
+        images.generate(recipe_id, image_name, reuse)
+    except Exception as exc:
+        return f'recipe {recipe_id}: {image_name}: {exc}'
+    return None
+
+
+class Command(BaseCommand):
+    """Django command to generate the derivatives of recipe images"""
+
+    help = ('Generate the resized copies of recipe images listed in '
+            'RECIPE_IMAGE_SIZES, for the images that have none yet.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help='email of a single user')
+        parser.add_argument('--all', action='store_true',
+                            help='generate them again for every image')
+        parser.add_argument('--workers', type=int, default=1,
+                            help='processes resizing images')
+
+    def handle(self, *args, **options):
+        if options['workers'] < 1:
+            raise CommandError('--workers must be positive')
+
+        recipes = Recipe.objects.exclude(image__isnull=True) \
+            .exclude(image='')
+        if options['user']:
+            try:
+                user = get_user_model().objects.get_by_natural_key(
+                    options['user'])
+            except get_user_model().DoesNotExist:
+                raise CommandError(f'unknown user {options["user"]}')
+            recipes = recipes.filter(user=user)
+        if not options['all']:
+            recipes = recipes.filter(image_derivatives={})
+        # with --all, a shared image is rendered again for its first
+        # recipe, the others reuse that
+        rows = []
+        rendered = set()
+        for recipe_id, image_name in recipes.order_by('id') \
+                .values_list('id', 'image'):
+            reuse = not options['all'] or image_name in rendered
+            rendered.add(image_name)
+            rows.append((recipe_id, image_name, reuse))
+
+        self.done = 0
+        self.failed = 0
+        self.started = time.monotonic()
+        if options['workers'] == 1:
+            for row in rows:
+                self.report(generate_one(row))
+        else:
+            # forked workers must not share the connection of this process
+            connections.close_all()
+            with Pool(options['workers']) as pool:
+                for error in pool.imap_unordered(generate_one, rows):
+                    self.report(error)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'generated the derivatives of {self.done - self.failed} '
+            f'images, {self.failed} failed ({self.rate():.1f} images/s)'
+        ))
+
+    def rate(self):
+        elapsed = time.monotonic() - self.started
+        return self.done / elapsed if elapsed else 0
+
+    def report(self, error):
+        self.done += 1
+        if error is not None:
+            self.failed += 1
+            self.stderr.write(error)
+        if self.done % 100 == 0:
+            self.stdout.write(f'{self.done} images '
+                              f'({self.rate():.1f} images/s)')
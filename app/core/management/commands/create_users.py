@@ -0,0 +1,191 @@
+import csv
+import time
+from multiprocessing import Pool
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError, transaction
+from django.db.models.functions import Upper
+from rest_framework.authtoken.models import Token
+
+from core.utils import batches
+
+
+# create_user() hashes one password and inserts one row per call. Here
+# the users are read in batches: the emails that already exist are
+# found with one query per batch, the passwords of the others are
+# hashed in worker processes, and the users and their tokens are
+# inserted with one statement per table. The workers only hash, every
+# query runs in this process. A batch that meets users created meanwhile
+# by someone else is inserted again without them.
+
+USER_FIELDS = ('email', 'name')
+
+
+def read_users(stream):
+    """yield (line number, email, name, password) for every CSV row"""
+    user_model = get_user_model()
+    reader = csv.DictReader(stream)
+    if 'email' not in (reader.fieldnames or ()):
+        raise CommandError('the CSV has no email column')
+    for record in reader:
+        values = {}
+        for name in USER_FIELDS:
+            field = user_model._meta.get_field(name)
+            try:
+                values[name] = field.clean((record.get(name) or '').strip(),
+                                           None)
+            except ValidationError as exc:
+                raise CommandError(f'line {reader.line_num}: {name}: '
+                                   f'{" ".join(exc.messages)}')
+        email = user_model.objects.normalize_email(values['email'])
+        # users without a password cannot log in until they reset it
+        password = record.get('password') or None
+        yield reader.line_num, email, values['name'], password
+
+
+def hash_passwords(passwords):
+    """return the hashes of passwords, runs in worker processes"""
+    return [make_password(password) for password in passwords]
+
+
+def new_token(user):
+    """return an unsaved token with its key"""
+    # bulk_create skips Token.save(), which makes the key
+    token = Token(user=user)
+    token.key = token.generate_key()
+    return token
+
+
+class Command(BaseCommand):
+    """Django command to create users from a CSV file"""
+
+    help = ('Create users from CSV files with email, name and password '
+            'columns, with an auth token each. Emails that exist already, '
+            'in any case, are skipped.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='+')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--workers', type=int, default=1,
+                            help='processes hashing passwords')
+        parser.add_argument('--no-tokens', action='store_false',
+                            dest='tokens', help='do not create auth tokens')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1 or options['workers'] < 1:
+            raise CommandError('--batch-size and --workers must be positive')
+
+        self.tokens = options['tokens']
+        # upper case emails read so far, duplicates in the files are
+        # skipped like existing users
+        self.seen = set()
+        self.created = 0
+        self.skipped = 0
+        self.started = time.monotonic()
+
+        pool = Pool(options['workers']) if options['workers'] > 1 else None
+        try:
+            for path in options['paths']:
+                with open(path, newline='', encoding='utf-8') as stream:
+                    self.create_batches(
+                        batches(read_users(stream), options['batch_size']),
+                        pool, options['workers']
+                    )
+        finally:
+            if pool is not None:
+                pool.terminate()
+
+        self.stdout.write(self.style.SUCCESS(
+            f'created {self.created} users, skipped {self.skipped} '
+            f'({self.rate():.0f} users/s)'
+        ))
+
+    def taken_emails(self, rows):
+        """return the upper case emails of rows that belong to users"""
+        emails = {email.upper() for number, email, name, password in rows}
+        # UPPER(email) IN (...) is served by the unique index of
+        # migration 0013
+        return set(get_user_model().objects
+                   .annotate(upper_email=Upper('email'))
+                   .filter(upper_email__in=emails)
+                   .values_list('upper_email', flat=True))
+
+    def new_users(self, batch):
+        """return the rows of a batch whose email is not taken"""
+        taken = self.taken_emails(batch)
+        rows = []
+        for row in batch:
+            upper = row[1].upper()
+            if upper in taken or upper in self.seen:
+                self.skipped += 1
+                continue
+            self.seen.add(upper)
+            rows.append(row)
+        return rows
+
+    def create_batches(self, batches, pool, workers):
+        if pool is None:
+            for batch in batches:
+                rows = self.new_users(batch)
+                passwords = [row[3] for row in rows]
+                self.report(self.insert(rows, hash_passwords(passwords)))
+            return
+
+        pending = []
+        for batch in batches:
+            rows = self.new_users(batch)
+            passwords = [row[3] for row in rows]
+            pending.append((rows, pool.apply_async(hash_passwords,
+                                                   (passwords,))))
+            # keep at most two batches per worker in memory
+            while len(pending) >= 2 * workers:
+                rows, result = pending.pop(0)
+                self.report(self.insert(rows, result.get()))
+        for rows, result in pending:
+            self.report(self.insert(rows, result.get()))
+
+    def insert(self, rows, hashes):
+        """insert the users of a batch and their tokens
+
+        the users that another process created since new_users() are
+        skipped
+        """
+        while rows:
+            try:
+                return self.insert_rows(rows, hashes)
+            except IntegrityError:
+                taken = self.taken_emails(rows)
+                kept = [(row, encoded) for row, encoded in zip(rows, hashes)
+                        if row[1].upper() not in taken]
+                # the conflict was not on an email
+                if len(kept) == len(rows):
+                    raise
+                self.skipped += len(rows) - len(kept)
+                rows = [row for row, encoded in kept]
+                hashes = [encoded for row, encoded in kept]
+        return 0
+
+    def insert_rows(self, rows, hashes):
+        user_model = get_user_model()
+        with transaction.atomic():
+            # Postgres returns the ids of the inserted rows
+            users = user_model.objects.bulk_create([
+                user_model(email=email, name=name, password=encoded)
+                for (number, email, name, password), encoded
+                in zip(rows, hashes)
+            ])
+            if self.tokens:
+                Token.objects.bulk_create([new_token(user) for user in users])
+        return len(users)
+
+    def rate(self):
+        elapsed = time.monotonic() - self.started
+        return (self.created + self.skipped) / elapsed if elapsed else 0
+
+    def report(self, count):
+        self.created += count
+        self.stdout.write(f'{self.created} users created '
+                          f'({self.rate():.0f} users/s)')
@@ -0,0 +1,239 @@
+import csv
+import json
+import time
+from multiprocessing import Pool
+
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+
+from core.models import Ingredient, Recipe, Tag
+from core.signals import recipes_bulk_changed
+from core.utils import batches
+
+
+# Recipes are read in batches. For every batch the tag and ingredient
+# names are resolved to ids with one query per model, and the missing
+# ones are created with one bulk insert. The recipes and their relation
+# rows are then inserted with one statement per table, either here or in
+# a worker process. Names are always resolved here, so two workers never
+# create the same tag.
+
+RECIPE_FIELDS = ('title', 'time_miniutes', 'price', 'link')
+RELATIONS = (('tags', Tag), ('ingredients', Ingredient))
+
+# separates the names of a CSV cell, e.g. "Vegan|Dessert"
+CSV_LIST_SEPARATOR = '|'
+
+
+def read_ndjson(stream):
+    """yield (line number, record) for every non empty line"""
+    for number, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as exc:
+            raise CommandError(f'line {number}: {exc}')
+        if not isinstance(record, dict):
+            raise CommandError(f'line {number}: expected an object')
+        yield number, record
+
+
+def read_csv(stream):
+    """yield (line number, record) for every row after the header"""
+    reader = csv.DictReader(stream)
+    for record in reader:
+        for relation, model in RELATIONS:
+            names = record.get(relation) or ''
+            record[relation] = [name for name in
+                                names.split(CSV_LIST_SEPARATOR) if name]
+        yield reader.line_num, record
+
+
+READERS = {
+    'ndjson': read_ndjson,
+    'jsonl': read_ndjson,
+    'csv': read_csv,
+}
+
+
+def clean_record(number, record):
+    """return the recipe values and relation names of a record"""
+    values = {}
+    for name in RECIPE_FIELDS:
+        field = Recipe._meta.get_field(name)
+        value = record.get(name)
+        if value in (None, '') and field.blank:
+            value = field.get_default()
+        if name == 'price' and isinstance(value, float):
+            # floats would carry their binary rounding into the Decimal
+            value = str(value)
+        try:
+            values[name] = field.clean(value, None)
+        except ValidationError as exc:
+            raise CommandError(f'line {number}: {name}: '
+                               f'{" ".join(exc.messages)}')
+
+    names = {}
+    for relation, model in RELATIONS:
+        value = record.get(relation) or []
+        if isinstance(value, str) or not isinstance(value, list):
+            raise CommandError(f'line {number}: {relation}: '
+                               'expected a list of names')
+        names[relation] = [str(name).strip() for name in value
+                           if str(name).strip()]
+    return values, names
+
+
+class NameResolver:
+    """Map the tag or ingredient names of a user to ids"""
+
+    def __init__(self, model, user):
+        self.model = model
+        self.user = user
+        self.ids = {}
+
+    def resolve(self, names):
+        """return {name: id}, creating the objects that do not exist
+
+        meant for all the names of a batch at once, each call makes a
+        query for the names it has not seen yet
+        """
+        missing = {name for name in names if name not in self.ids}
+        if missing:
+            existing = self.model.objects \
+                .filter(user=self.user, name__in=missing) \
+                .order_by('id').values_list('name', 'id')
+            for name, pk in existing:
+                # duplicated names map to the oldest object
+                self.ids.setdefault(name, pk)
+            new = [self.model(user=self.user, name=name)
+                   for name in sorted(missing) if name not in self.ids]
+            # Postgres returns the ids of the inserted rows
+            self.model.objects.bulk_create(new)
+            self.ids.update({obj.name: obj.pk for obj in new})
+        return {name: self.ids[name] for name in names}
+
+
+def insert_batch(user_id, rows):
+    """insert (recipe values, {relation: [ids]}) rows of one user
+
+    runs in worker processes too, so it only takes plain values
+    """
+    with transaction.atomic():
+        recipes = Recipe.objects.bulk_create(
+            [Recipe(user_id=user_id, **values) for values, related in rows]
+        )
+        for relation, model in RELATIONS:
+            field = Recipe._meta.get_field(relation)
+            through = field.remote_field.through
+            recipe_column = f'{field.m2m_field_name()}_id'
+            related_column = f'{field.m2m_reverse_field_name()}_id'
+            through.objects.bulk_create([
+                through(**{recipe_column: recipe.pk, related_column: pk})
+                for recipe, (values, related) in zip(recipes, rows)
+                for pk in sorted(set(related[relation]))
+            ])
+
+        recipe_ids = [recipe.pk for recipe in recipes]
+        # recipe.signals bumps the data version of the user in the cache
+        # of this process, the API processes see it with a shared cache
+        # or once their version expires (RECIPE_CACHE_VERSION_TIMEOUT)
+        recipes_bulk_changed.send(sender=Recipe, user_id=user_id,
+                                  recipe_ids=recipe_ids, created=True)
+    return len(recipes)
+
+
+class Command(BaseCommand):
+    """Django command to import recipes from NDJSON or CSV files"""
+
+    help = ('Import recipes of a user from NDJSON or CSV files. '
+            'Each record has title, time_miniutes, price, link, and the '
+            'names of its tags and ingredients: a list in NDJSON, '
+            f'separated by "{CSV_LIST_SEPARATOR}" in CSV.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='+')
+        parser.add_argument('--user', required=True,
+                            help='email of the owner of the recipes')
+        parser.add_argument('--format', choices=sorted(READERS),
+                            help='file format, by default the extension')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--workers', type=int, default=1,
+                            help='processes inserting batches')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1 or options['workers'] < 1:
+            raise CommandError('--batch-size and --workers must be positive')
+        try:
+            user = get_user_model().objects.get_by_natural_key(
+                options['user'])
+        except get_user_model().DoesNotExist:
+            raise CommandError(f'unknown user {options["user"]}')
+
+        self.user = user
+        self.resolvers = {relation: NameResolver(model, user)
+                          for relation, model in RELATIONS}
+        self.imported = 0
+        self.started = time.monotonic()
+
+        for path in options['paths']:
+            reader = READERS.get(options['format'] or
+                                 path.rsplit('.', 1)[-1].lower())
+            if reader is None:
+                raise CommandError(f'{path}: unknown format, use --format')
+            with open(path, newline='', encoding='utf-8') as stream:
+                records = (clean_record(number, record)
+                           for number, record in reader(stream))
+                self.import_batches(batches(records, options['batch_size']),
+                                    options['workers'])
+
+        self.stdout.write(self.style.SUCCESS(
+            f'imported {self.imported} recipes ({self.rate():.0f} rows/s)'
+        ))
+
+    def resolve(self, batch):
+        """replace the relation names of a batch with ids"""
+        ids = {
+            relation: self.resolvers[relation].resolve({
+                name for values, names in batch for name in names[relation]
+            })
+            for relation, model in RELATIONS
+        }
+        return [
+            (values, {relation: [ids[relation][name]
+                                 for name in names[relation]]
+                      for relation, model in RELATIONS})
+            for values, names in batch
+        ]
+
+    def import_batches(self, batches, workers):
+        if workers == 1:
+            for batch in batches:
+                self.report(insert_batch(self.user.pk, self.resolve(batch)))
+            return
+
+        # forked workers must not share the connection of this process
+        connections.close_all()
+        with Pool(workers) as pool:
+            pending = []
+            for batch in batches:
+                rows = self.resolve(batch)
+                pending.append(pool.apply_async(insert_batch,
+                                                (self.user.pk, rows)))
+                # keep at most two batches per worker in memory
+                while len(pending) >= 2 * workers:
+                    self.report(pending.pop(0).get())
+            for result in pending:
+                self.report(result.get())
+
+    def rate(self):
+        elapsed = time.monotonic() - self.started
+        return self.imported / elapsed if elapsed else 0
+
+    def report(self, count):
+        self.imported += count
+        self.stdout.write(f'{self.imported} recipes '
+                          f'({self.rate():.0f} rows/s)')
@@ -0,0 +1,51 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from core import stats
+from core.models import RecipeStats
+
+
+class Command(BaseCommand):
+    """Django command to recompute the recipe statistics of users"""
+
+    help = ('Compare the recipe statistics of users with the recipe '
+            'tables and rebuild them from scratch. Only users whose '
+            'statistics were already built are handled, unless --user '
+            'is given.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help='email of a single user')
+        parser.add_argument('--check', action='store_true',
+                            help='report the drift without rebuilding, '
+                                 'and fail if there is any')
+
+    def handle(self, *args, **options):
+        if options['user']:
+            try:
+                user = get_user_model().objects.get_by_natural_key(
+                    options['user'])
+            except get_user_model().DoesNotExist:
+                raise CommandError(f'unknown user {options["user"]}')
+            users = [(user.pk, user.email)]
+        else:
+            users = RecipeStats.objects.order_by('user_id') \
+                .values_list('user_id', 'user__email')
+
+        drifted = 0
+        for user_id, email in users:
+            drift = stats.stats_drift(user_id)
+            if drift:
+                drifted += 1
+                self.stdout.write(f'{email}: {", ".join(drift)}')
+            if not options['check']:
+                stats.build_stats(user_id)
+
+        if options['check']:
+            if drifted:
+                raise CommandError(f'{drifted} users have drifted')
+            self.stdout.write(self.style.SUCCESS('no drift'))
+        else:
+            self.stdout.write(self.style.SUCCESS(
+                f'rebuilt the statistics of {len(users)} users, '
+                f'{drifted} had drifted'
+            ))
@@ -0,0 +1,164 @@
+import mimetypes
+import os
+import re
+import stat
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured, \
+    SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+from django.views.decorators.http import require_safe
+
+from core.images import IMAGES_DIR
+
+
+# static() serves MEDIA_ROOT only with DEBUG, reads the files in Python
+# and sends no cache headers. This view answers conditional requests
+# from a stat() of the file, and hands the bytes over to the front-end
+# server when settings.MEDIA_SENDFILE names one:
+#   'x-accel-redirect'  nginx, with MEDIA_ACCEL_PREFIX as an internal
+#                       location aliased to MEDIA_ROOT
+#   'x-sendfile'        Apache mod_xsendfile, lighttpd
+# The front-end server then also answers Range requests. Otherwise the
+# file is sent from here with FileResponse, which WSGI servers pass to
+# os.sendfile through wsgi.file_wrapper, and byte ranges are read here.
+
+# images named by their SHA-256 never change (see core.images)
+IMMUTABLE_PREFIXES = (f'{IMAGES_DIR}/',)
+
+# one year, the longest max-age caches are expected to honour
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+class FileRange:
+    """Read only length bytes of a file, from start
+
+    Has no fileno(), so servers read it instead of calling sendfile
+    on the whole file
+    """
+
+    def __init__(self, file, start, length):
+        file.seek(start)
+        self.file = file
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+def requested_range(request, size, etag, last_modified):
+    """return the (first, last) byte asked by a Range header, or None
+    for the whole file
+
+    Raises RangeNotSatisfiable when the range starts after the file
+    """
+    header = request.META.get('HTTP_RANGE')
+    if not header:
+        return None
+    # If-Range asks for the whole file when the client copy is outdated
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if if_range and if_range != etag and \
+            parse_http_date_safe(if_range) != last_modified:
+        return None
+    # several ranges are answered with the whole file, as allowed
+    match = RANGE_RE.match(header.strip())
+    if match is None or match.groups() == ('', ''):
+        return None
+
+    first, last = match.groups()
+    if first == '':
+        # bytes=-500 is the last 500 bytes
+        first, last = max(size - int(last), 0), size - 1
+    else:
+        first = int(first)
+        last = min(int(last), size - 1) if last else size - 1
+    if first >= size or size == 0:
+        raise RangeNotSatisfiable()
+    if first > last:
+        return None
+    return first, last
+
+
+def file_response(request, fullpath, path, size, etag, last_modified):
+    """return a response sending a file"""
+    content_type = mimetypes.guess_type(path)[0] or \
+        'application/octet-stream'
+    backend = settings.MEDIA_SENDFILE
+    if backend == 'x-accel-redirect':
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = \
+            f'{settings.MEDIA_ACCEL_PREFIX}{quote(path)}'
+        return response
+    if backend == 'x-sendfile':
+        response = HttpResponse(content_type=content_type)
+        response['X-Sendfile'] = fullpath
+        return response
+    if backend:
+        raise ImproperlyConfigured(f'unknown MEDIA_SENDFILE {backend!r}')
+
+    try:
+        byte_range = requested_range(request, size, etag, last_modified)
+    except RangeNotSatisfiable:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+
+    file = open(fullpath, 'rb')
+    if byte_range is None:
+        return FileResponse(file, content_type=content_type)
+
+    first, last = byte_range
+    response = FileResponse(FileRange(file, first, last - first + 1),
+                            status=206, content_type=content_type)
+    response['Content-Range'] = f'bytes {first}-{last}/{size}'
+    response['Content-Length'] = last - first + 1
+    return response
+
+
+@require_safe
+def serve(request, path):
+    """serve a file of MEDIA_ROOT"""
+    try:
+        fullpath = safe_join(settings.MEDIA_ROOT, path)
+        info = os.stat(fullpath)
+    except (SuspiciousFileOperation, OSError):
+        raise Http404()
+    if not stat.S_ISREG(info.st_mode):
+        raise Http404()
+
+    etag = quote_etag(f'{info.st_mtime_ns:x}-{info.st_size:x}')
+    last_modified = int(info.st_mtime)
+    response = get_conditional_response(request, etag=etag,
+                                        last_modified=last_modified)
+    if response is None:
+        response = file_response(request, fullpath, path, info.st_size,
+                                 etag, last_modified)
+
+    # 304 responses carry the validators and cache headers too
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    response['Accept-Ranges'] = 'bytes'
+    if path.startswith(IMMUTABLE_PREFIXES):
+        response['Cache-Control'] = \
+            f'public, max-age={IMMUTABLE_MAX_AGE}, immutable'
+    else:
+        response['Cache-Control'] = \
+            f'public, max-age={settings.MEDIA_MAX_AGE}'
+    return response
@@ -0,0 +1,26 @@
+from django.db import migrations
+
+
+# The through tables of Recipe.tags and Recipe.ingredients only have
+# a unique index on (recipe_id, related_id) and a single column index
+# on each foreign key. Filtering recipes by tag or ingredient starts
+# from the related id, so an index in that order lets Postgres answer
+# the filter subqueries with index only scans.
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_recipe_image'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            'CREATE INDEX core_recipe_tags_tag_recipe_idx '
+            'ON core_recipe_tags (tag_id, recipe_id);',
+            'DROP INDEX core_recipe_tags_tag_recipe_idx;',
+        ),
+        migrations.RunSQL(
+            'CREATE INDEX core_recipe_ingredients_ingredient_recipe_idx '
+            'ON core_recipe_ingredients (ingredient_id, recipe_id);',
+            'DROP INDEX core_recipe_ingredients_ingredient_recipe_idx;',
+        ),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 2.1.15 on 2026-10-17 10:21
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations, transaction
+
+import core.models
+
+
+BATCH_SIZE = 1000
+
+
+def backfill_search_vector(apps, schema_editor):
+    """compute the search vector of existing recipes in batches of ids"""
+    Recipe = apps.get_model('core', 'Recipe')
+    Tag = apps.get_model('core', 'Tag')
+    Ingredient = apps.get_model('core', 'Ingredient')
+    vector = core.models.recipe_search_vector(Tag, Ingredient)
+
+    last_id = 0
+    while True:
+        ids = list(
+            Recipe.objects.filter(id__gt=last_id)
+            .order_by('id')
+            .values_list('id', flat=True)[:BATCH_SIZE]
+        )
+        if not ids:
+            break
+        # each batch is committed on its own to keep row locks short
+        with transaction.atomic():
+            Recipe.objects.filter(id__in=ids).update(search_vector=vector)
+        last_id = ids[-1]
+
+
+class Migration(migrations.Migration):
+
+    # the backfill commits batch by batch
+    atomic = False
+
+    dependencies = [
+        ('core', '0007_recipe_m2m_reverse_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(backfill_search_vector,
+                             migrations.RunPython.noop),
+        # the index is built once, after the backfill
+        migrations.AddIndex(
+            model_name='recipe',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='core_recipe_search_gin'),
+        ),
+    ]
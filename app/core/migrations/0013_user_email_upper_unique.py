@@ -0,0 +1,85 @@
+from django.db import migrations
+
+
+BATCH_SIZE = 1000
+
+# examples of colliding emails listed in the error
+MAX_REPORTED = 20
+
+
+def find_email_collisions(apps, schema_editor):
+    """fail if two users have the same email but for its case
+
+    The users are read in batches, in UPPER(email) order from the scan
+    index, so colliding emails are next to each other
+    """
+    table = schema_editor.quote_name(apps.get_model('core', 'User')
+                                     ._meta.db_table)
+    collisions = {}
+    last = None
+    with schema_editor.connection.cursor() as cursor:
+        while True:
+            if last is None:
+                cursor.execute(
+                    f'SELECT UPPER(email), id FROM {table} '
+                    f'ORDER BY UPPER(email), id LIMIT %s', [BATCH_SIZE]
+                )
+            else:
+                cursor.execute(
+                    f'SELECT UPPER(email), id FROM {table} '
+                    f'WHERE (UPPER(email), id) > (%s, %s) '
+                    f'ORDER BY UPPER(email), id LIMIT %s',
+                    [*last, BATCH_SIZE]
+                )
+            rows = cursor.fetchall()
+            if not rows:
+                break
+            for email, pk in rows:
+                if last is not None and last[0] == email:
+                    collisions.setdefault(email, [last[1]]).append(pk)
+                last = (email, pk)
+
+    if collisions:
+        examples = '; '.join(
+            f'{email}: users {", ".join(map(str, ids))}'
+            for email, ids in list(collisions.items())[:MAX_REPORTED]
+        )
+        raise RuntimeError(
+            f'{len(collisions)} emails are used by several users with '
+            f'different cases, merge or rename them first. {examples}'
+        )
+
+
+# Emails are unique whatever their case. Django 2.1 cannot declare an
+# index on an expression, so it is created here. The unique index also
+# serves the email__iexact lookups, which compare UPPER(email).
+# A plain index is built first so that the collision check reads the
+# users in order without sorting the table.
+class Migration(migrations.Migration):
+
+    # each step commits, the scan index is built before it is read.
+    # After a collision the scan index is kept for the next attempt
+    atomic = False
+
+    dependencies = [
+        ('core', '0012_recipe_ordering_indexes'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            'CREATE INDEX IF NOT EXISTS core_user_email_upper_scan '
+            'ON core_user (UPPER(email), id);',
+            'DROP INDEX IF EXISTS core_user_email_upper_scan;',
+        ),
+        migrations.RunPython(find_email_collisions,
+                             migrations.RunPython.noop),
+        migrations.RunSQL(
+            'CREATE UNIQUE INDEX core_user_email_upper_uniq '
+            'ON core_user (UPPER(email));',
+            'DROP INDEX core_user_email_upper_uniq;',
+        ),
+        migrations.RunSQL(
+            'DROP INDEX core_user_email_upper_scan;',
+            migrations.RunSQL.noop,
+        ),
+    ]
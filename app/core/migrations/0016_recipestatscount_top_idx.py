@@ -0,0 +1,17 @@
+# Generated by Django 2.1.15 on 2026-10-17 11:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_stored_image'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='recipestatscount',
+            index=models.Index(fields=['user', 'kind', '-count', 'key'], name='core_statscount_top_idx'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 2.1.15 on 2026-10-17 11:51
+
+import core.models
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0016_recipestatscount_top_idx'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='recipe',
+            name='image',
+            field=core.models.RecipeImageField(null=True, upload_to=core.models.recipe_image_file_path),
+        ),
+    ]
@@ -1,23 +1,54 @@
-from django.db import models
+import threading
+from contextlib import contextmanager
+
+from django.db import models, transaction
+from django.db.models.fields.files import ImageFieldFile
+from django.contrib.auth.hashers import check_password
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager, \
                                             PermissionsMixin
 # recommended way to retrieve settings from settings.py
 from django.conf import settings
-# to create unique id for files
-import uuid
-import os
+from django.contrib.postgres.aggregates import StringAgg
+from django.contrib.postgres.fields import JSONField
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVector, SearchVectorField
 
 
 def recipe_image_file_path(instance, filename):
-    """ generate filepath for new image"""
-    ext = filename.split('.')[-1]
-    filename = f'{uuid.uuid4()}.{ext}'
+    """ generate filepath for new image, named by its content"""
+    # core.images imports this module
+    from core.images import content_path, file_digest
+    return content_path(file_digest(instance.image), filename)
+
+
+_rehash = threading.local()
+
+
+@contextmanager
+def rehash_deferred():
+    """keep outdated password hashes when passwords are checked in the
+    block. Used by the login pool, which stores them again after the
+    response (see user.passwords)
+    """
+    _rehash.deferred = True
+    try:
+        yield
+    finally:
+        _rehash.deferred = False
+
+
+class UserQuerySet(models.QuerySet):
 
-    return os.path.join('uploads/recipe/', filename)
+    # see User.delete
+    def delete(self):
+        # core.stats imports this module
+        from core import stats
+        with stats.paused():
+            return super().delete()
 
 
 # Creating CUSTOM USER MODEL
-class UserManager(BaseUserManager):
+class UserManager(BaseUserManager.from_queryset(UserQuerySet)):
     """Default User model requires mandatory username field
     But we dont want it that way. So we create custom User model"""
 
@@ -35,6 +66,18 @@ class UserManager(BaseUserManager):
 
         return user
 
+    # emails are unique whatever their case, see migration 0013.
+    # email__iexact compares UPPER(email), which that unique index serves
+    def get_by_natural_key(self, email):
+        return self.get(**{f'{self.model.USERNAME_FIELD}__iexact': email})
+
+    def email_taken(self, email, exclude_pk=None):
+        """return True if another user has this email, in any case"""
+        users = self.filter(email__iexact=email)
+        if exclude_pk is not None:
+            users = users.exclude(pk=exclude_pk)
+        return users.exists()
+
     def create_superuser(self, email, password):
         user = self.create_user(email, password)
         user.is_staff = True
@@ -58,6 +101,20 @@ class User(AbstractBaseUser, PermissionsMixin):
     # map the username field
     USERNAME_FIELD = 'email'
 
+    # the statistics of the user are deleted with the recipes, applying
+    # the delta of every recipe deleted by the cascade would be wasted
+    def delete(self, *args, **kwargs):
+        # core.stats imports this module
+        from core import stats
+        with stats.paused():
+            return super().delete(*args, **kwargs)
+
+    def check_password(self, raw_password):
+        if getattr(_rehash, 'deferred', False):
+            # without setter, an outdated hash is not saved again
+            return check_password(raw_password, self.password)
+        return super().check_password(raw_password)
+
 
 class Tag(models.Model):
     """ Tag to be set for a recipe"""
@@ -66,6 +123,15 @@ class Tag(models.Model):
         settings.AUTH_USER_MODEL,
         on_delete=models.CASCADE
     )
+    updated_at = models.DateTimeField(auto_now=True)
+
+    # tags are listed per user by name, with the id breaking ties.
+    # The index returns them in that order without sorting
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'name', 'id'],
+                         name='core_tag_user_name_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -78,11 +144,103 @@ class Ingredient(models.Model):
         settings.AUTH_USER_MODEL,
         on_delete=models.CASCADE
     )
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'name', 'id'],
+                         name='core_ingredient_user_name_idx'),
+        ]
 
     def __str__(self):
         return self.name
 
 
+# Recipes are searched on their title and on the names of their
+# tags and ingredients. The names are aggregated by correlated subqueries
+# so the vector of many recipes can be computed by a single UPDATE.
+# The models are passed in so migrations can use their historical models
+SEARCH_CONFIG = 'english'
+
+
+def recipe_search_vector(tag_model, ingredient_model):
+    """return the expression computing the search vector of a recipe"""
+    def names(model):
+        return models.Subquery(
+            model.objects.filter(recipe=models.OuterRef('pk'))
+            .values('recipe')
+            .annotate(names=StringAgg('name', delimiter=' '))
+            .values('names')
+        )
+
+    return (
+        SearchVector('title', weight='A', config=SEARCH_CONFIG) +
+        SearchVector(names(tag_model), weight='B', config=SEARCH_CONFIG) +
+        SearchVector(names(ingredient_model), weight='C',
+                     config=SEARCH_CONFIG)
+    )
+
+
+# Recipe images are stored once per content, under their SHA-256, and
+# shared by every recipe with the same image (see core.images)
+class StoredImage(models.Model):
+    """Image file with the number of recipes using it"""
+    sha256 = models.CharField(max_length=64, primary_key=True)
+    # storage path, the value of Recipe.image
+    name = models.CharField(max_length=255, unique=True)
+    size = models.BigIntegerField()
+    ref_count = models.IntegerField(default=0)
+    # size name -> storage path, copied to the recipes using the image
+    derivatives = JSONField(default=dict, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f'{self.name}: {self.ref_count} recipes'
+
+
+class RecipeImageFieldFile(ImageFieldFile):
+    """Recipe image whose file is stored by Recipe.save"""
+
+    # like assigning the file: Recipe.save stores it once per content
+    def save(self, name, content, save=True):
+        if getattr(content, 'name', None) is None:
+            content.name = name
+        setattr(self.instance, self.field.name, content)
+        if save:
+            self.instance.save()
+    save.alters_data = True
+
+
+class RecipeImageField(models.ImageField):
+    attr_class = RecipeImageFieldFile
+
+
+class RecipeQuerySet(models.QuerySet):
+
+    # the statistics are rebuilt once per user instead of applying the
+    # delta of every deleted recipe. Callers that already paused them,
+    # like recipe.bulk, rebuild them themselves
+    def delete(self):
+        # core.stats imports this module
+        from core import stats
+        if stats.is_paused():
+            return super().delete()
+        with transaction.atomic():
+            user_ids = set(self.values_list('user_id', flat=True))
+            with stats.paused():
+                result = super().delete()
+            for user_id in sorted(user_ids):
+                stats.rebuild_if_tracked(user_id)
+        return result
+
+    def update_search_vector(self, **fields):
+        """recompute the search vector of every recipe in the queryset,
+        along with any other fields given"""
+        return self.update(
+            search_vector=recipe_search_vector(Tag, Ingredient), **fields
+        )
+
+
 class Recipe(models.Model):
     """ Ingredient to be used in a recipe"""
     # one to many: one user for many recipies
@@ -104,9 +262,117 @@ class Recipe(models.Model):
     tags = models.ManyToManyField('Tag')
 
     # Image field
-    # calls a function to find the file path
-    # Input to this field is a file object
-    image = models.ImageField(null=True, upload_to=recipe_image_file_path)
+    # Input to this field is a file object. save() stores it once per
+    # content and counts the recipes using it, see core.images.
+    # upload_to is only used by writes that skip save(), like bulk_create
+    image = RecipeImageField(null=True, upload_to=recipe_image_file_path)
+
+    # size name -> storage path of the resized copies of the image,
+    # written by core.images once they are generated
+    image_derivatives = JSONField(default=dict, blank=True, editable=False)
+
+    # also set when the tags or ingredients of the recipe change,
+    # see core.signals
+    updated_at = models.DateTimeField(auto_now=True)
+
+    # full text search document, maintained by core.signals
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    objects = RecipeQuerySet.as_manager()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        recipe = super().from_db(db, field_names, values)
+        # save() compares the image with the loaded one
+        recipe._loaded_image = recipe.__dict__.get('image')
+        return recipe
+
+    def save(self, *args, **kwargs):
+        # core.images imports this module
+        from core import images
+        update_fields = kwargs.get('update_fields')
+        if (update_fields is not None and 'image' not in update_fields) \
+                or not images.image_changed(self):
+            return super().save(*args, **kwargs)
+
+        if update_fields is not None:
+            kwargs['update_fields'] = {*update_fields, 'image_derivatives'}
+        # the references change with the row
+        with transaction.atomic():
+            generate = images.image_saving(self)
+            super().save(*args, **kwargs)
+            if generate:
+                images.schedule(self)
+        self._loaded_image = self.image.name
+
+    # recipes are listed per user, newest first by default
+    class Meta:
+        indexes = [
+            GinIndex(fields=['search_vector'], name='core_recipe_search_gin'),
+            models.Index(fields=['user', 'id'],
+                         name='core_recipe_user_id_idx'),
+            # ?ordering= and the range filters of the recipe list
+            models.Index(fields=['user', 'price', 'id'],
+                         name='core_recipe_user_price_idx'),
+            models.Index(fields=['user', 'time_miniutes', 'id'],
+                         name='core_recipe_user_time_idx'),
+            models.Index(fields=['user', 'title', 'id'],
+                         name='core_recipe_user_title_idx'),
+        ]
 
     def __str__(self):
         return self.title
+
+
+# Summary of the recipes of a user read by /api/recipe/stats/.
+# core.stats keeps it up to date on every write instead of aggregating
+# all the recipes of the user on every read
+class RecipeStats(models.Model):
+    """Recipe count and price range of a user"""
+    user = models.OneToOneField(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='recipe_stats'
+    )
+    recipe_count = models.IntegerField(default=0)
+    price_total = models.DecimalField(max_digits=12, decimal_places=2,
+                                      default=0)
+    price_min = models.DecimalField(max_digits=5, decimal_places=2,
+                                    null=True)
+    price_max = models.DecimalField(max_digits=5, decimal_places=2,
+                                    null=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'{self.user_id}: {self.recipe_count} recipes'
+
+
+class RecipeStatsCount(models.Model):
+    """Number of recipes of a user in a time bucket, or with a tag
+    or an ingredient"""
+    TIME = 'time'
+    TAG = 'tag'
+    INGREDIENT = 'ingredient'
+    KINDS = ((TIME, 'time bucket'), (TAG, 'tag'), (INGREDIENT, 'ingredient'))
+
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE
+    )
+    kind = models.CharField(max_length=10, choices=KINDS)
+    # index of the time bucket, or id of the tag or ingredient
+    key = models.IntegerField()
+    count = models.IntegerField(default=0)
+
+    # the stats view reads the most used tags and ingredients of a
+    # user from the start of the index
+    class Meta:
+        unique_together = (('user', 'kind', 'key'),)
+        indexes = [
+            models.Index(fields=['user', 'kind', '-count', 'key'],
+                         name='core_statscount_top_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.user_id} {self.kind} {self.key}: {self.count}'
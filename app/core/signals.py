@@ -0,0 +1,214 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save, \
+                                     pre_delete, pre_save
+from django.dispatch import receiver, Signal
+from django.utils import timezone
+
+from core import images, stats
+from core.models import Tag, Ingredient, Recipe, RecipeStatsCount
+
+
+# bulk_create, queryset updates and through table inserts do not send
+# the model signals. Code writing recipes in bulk sends this one instead,
+# with the ids of the recipes it created, updated or deleted.
+# created is True when all of them were just created with their relations.
+# Updates may send the previous values of the recipes too:
+# old_values {recipe id: (price, time_miniutes)} and old_related
+# {relation: {recipe id: [ids]}} for the relations they replaced
+recipes_bulk_changed = Signal(providing_args=['user_id', 'recipe_ids',
+                                              'created', 'old_values',
+                                              'old_related'])
+
+
+# The search vector of a recipe depends on its title and on the names of
+# its tags and ingredients, so it is recomputed whenever one of them changes.
+# The representation of a recipe depends on them as well, so the changes
+# of its tags and ingredients also set its updated_at
+
+@receiver(post_save, sender=Recipe)
+def recipe_saved(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and 'title' not in update_fields:
+        return
+    Recipe.objects.filter(pk=instance.pk).update_search_vector()
+
+
+def recipe_relation_changed(sender, instance, action, reverse, pk_set,
+                            **kwargs):
+    # for recipe.tags.clear() from the related side, the affected recipes
+    # are only known before the rows are deleted
+    if action == 'pre_clear' and reverse:
+        instance._cleared_recipe_ids = list(
+            instance.recipe_set.values_list('pk', flat=True)
+        )
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+
+    if not reverse:
+        recipe_ids = [instance.pk]
+    elif action == 'post_clear':
+        recipe_ids = getattr(instance, '_cleared_recipe_ids', [])
+    else:
+        recipe_ids = pk_set
+    if recipe_ids:
+        Recipe.objects.filter(pk__in=recipe_ids).update_search_vector(
+            updated_at=timezone.now()
+        )
+
+
+m2m_changed.connect(recipe_relation_changed, sender=Recipe.tags.through)
+m2m_changed.connect(recipe_relation_changed,
+                    sender=Recipe.ingredients.through)
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_save, sender=Ingredient)
+def recipe_attr_saved(sender, instance, created, **kwargs):
+    # a new tag or ingredient is not used by any recipe yet
+    if not created:
+        instance.recipe_set.all().update_search_vector(
+            updated_at=timezone.now()
+        )
+
+
+# deleting a tag or ingredient removes its through rows by cascade,
+# which does not send m2m_changed
+@receiver(pre_delete, sender=Tag)
+@receiver(pre_delete, sender=Ingredient)
+def recipe_attr_deleting(sender, instance, **kwargs):
+    instance._deleted_recipe_ids = list(
+        instance.recipe_set.values_list('pk', flat=True)
+    )
+
+
+@receiver(post_delete, sender=Tag)
+@receiver(post_delete, sender=Ingredient)
+def recipe_attr_deleted(sender, instance, **kwargs):
+    recipe_ids = getattr(instance, '_deleted_recipe_ids', None)
+    if recipe_ids:
+        Recipe.objects.filter(pk__in=recipe_ids).update_search_vector(
+            updated_at=timezone.now()
+        )
+
+
+@receiver(recipes_bulk_changed)
+def recipes_bulk_written(sender, recipe_ids, **kwargs):
+    if recipe_ids:
+        Recipe.objects.filter(pk__in=recipe_ids).update_search_vector()
+
+
+# Per user statistics, see core.stats. Each write applies its delta
+# to the summary of the user
+
+RELATION_STATS = {
+    Recipe.tags.through: ('tags', RecipeStatsCount.TAG),
+    Recipe.ingredients.through: ('ingredients', RecipeStatsCount.INGREDIENT),
+}
+
+
+@receiver(pre_save, sender=Recipe)
+def recipe_stats_saving(sender, instance, update_fields=None, **kwargs):
+    # the old values are needed to move the recipe between buckets
+    instance._stats_old = None
+    if instance._state.adding or instance.pk is None or stats.is_paused():
+        return
+    if update_fields is not None and \
+            not {'price', 'time_miniutes'} & set(update_fields):
+        return
+    instance._stats_old = Recipe.objects.filter(pk=instance.pk) \
+        .values_list('price', 'time_miniutes').first()
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_stats_saved(sender, instance, created, **kwargs):
+    if created:
+        stats.recipe_added(instance)
+    elif getattr(instance, '_stats_old', None):
+        stats.recipe_changed(instance, *instance._stats_old)
+
+
+# the through rows of a recipe are deleted by cascade
+# before post_delete is sent
+@receiver(pre_delete, sender=Recipe)
+def recipe_stats_deleting(sender, instance, **kwargs):
+    if stats.is_paused():
+        return
+    instance._stats_related = {
+        kind: list(getattr(instance, relation).values_list('pk', flat=True))
+        for relation, kind in stats.RELATION_KINDS
+    }
+
+
+@receiver(post_delete, sender=Recipe)
+def recipe_stats_deleted(sender, instance, **kwargs):
+    related = getattr(instance, '_stats_related', None)
+    if related is not None:
+        stats.recipe_removed(instance, related)
+
+
+def recipe_stats_relation_changed(sender, instance, action, reverse,
+                                  pk_set, **kwargs):
+    if stats.is_paused():
+        return
+    relation, kind = RELATION_STATS[sender]
+    if reverse:
+        # instance is a tag or an ingredient, pk_set holds recipe ids
+        related = instance.recipe_set
+    else:
+        related = getattr(instance, relation)
+
+    # remove() reports every given id, clear() none of them:
+    # the rows actually deleted are read before they go
+    if action == 'pre_remove':
+        instance._stats_removed = set(
+            related.filter(pk__in=pk_set).values_list('pk', flat=True)
+        )
+        return
+    if action == 'pre_clear':
+        instance._stats_removed = set(related.values_list('pk', flat=True))
+        return
+    if action == 'post_add':
+        sign, ids = 1, pk_set
+    elif action in ('post_remove', 'post_clear'):
+        sign, ids = -1, getattr(instance, '_stats_removed', ())
+    else:
+        return
+    if not ids:
+        return
+
+    if reverse:
+        deltas = {instance.pk: sign * len(ids)}
+    else:
+        deltas = {pk: sign for pk in ids}
+    stats.relation_changed(instance.user_id, kind, deltas)
+
+
+m2m_changed.connect(recipe_stats_relation_changed,
+                    sender=Recipe.tags.through)
+m2m_changed.connect(recipe_stats_relation_changed,
+                    sender=Recipe.ingredients.through)
+
+
+@receiver(post_delete, sender=Tag)
+@receiver(post_delete, sender=Ingredient)
+def recipe_attr_stats_deleted(sender, instance, **kwargs):
+    kind = {Tag: RecipeStatsCount.TAG,
+            Ingredient: RecipeStatsCount.INGREDIENT}[sender]
+    stats.related_removed(instance.user_id, kind, instance.pk)
+
+
+@receiver(recipes_bulk_changed)
+def recipes_bulk_stats(sender, user_id, recipe_ids, created=False,
+                       old_values=None, old_related=None, **kwargs):
+    if created:
+        stats.recipes_added(user_id, recipe_ids)
+    elif old_values is not None:
+        stats.recipes_changed(user_id, old_values, old_related or {})
+    else:
+        # the previous values of the recipes are gone
+        stats.rebuild_if_tracked(user_id)
+
+
+# the image file of a deleted recipe loses a reference, see core.images
+@receiver(post_delete, sender=Recipe)
+def recipe_image_released(sender, instance, **kwargs):
+    images.release_image(instance)
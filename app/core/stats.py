@@ -0,0 +1,360 @@
+import threading
+from collections import Counter
+from bisect import bisect_right
+from contextlib import contextmanager
+from decimal import Decimal
+
+from django.db import connection, transaction
+from django.db.models import Case, Count, F, IntegerField, Max, Min, Q, \
+    Sum, Value, When
+from django.db.models.functions import Greatest, Least
+from django.utils import timezone
+
+from core.models import Recipe, RecipeStats, RecipeStatsCount
+
+
+# The statistics of a user are kept in RecipeStats and RecipeStatsCount
+# and changed by deltas on every write (see core.signals). The rows of a
+# user are created by build_stats the first time they are read. Until
+# then the writes of the user are not tracked, so a partial delta is
+# never mistaken for a full count.
+
+# lower bounds, in minutes, of the time_miniutes buckets
+TIME_BUCKETS = (0, 10, 20, 30, 45, 60, 90, 120)
+
+RELATION_KINDS = (
+    ('tags', RecipeStatsCount.TAG),
+    ('ingredients', RecipeStatsCount.INGREDIENT),
+)
+
+_paused = threading.local()
+
+
+def time_bucket(minutes):
+    """return the index of the bucket of a time_miniutes value"""
+    return max(bisect_right(TIME_BUCKETS, minutes) - 1, 0)
+
+
+def time_bucket_expression():
+    """return the SQL equivalent of time_bucket"""
+    return Case(
+        *[When(time_miniutes__gte=bound, then=Value(index))
+          for index, bound in reversed(list(enumerate(TIME_BUCKETS)))
+          if index],
+        default=Value(0),
+        output_field=IntegerField(),
+    )
+
+
+@contextmanager
+def paused():
+    """skip the deltas of writes made in the block
+
+    Used by bulk writes, which rebuild the statistics afterwards
+    """
+    # blocks may nest, e.g. a bulk delete of recipes
+    previous = is_paused()
+    _paused.value = True
+    try:
+        yield
+    finally:
+        _paused.value = previous
+
+
+def is_paused():
+    return getattr(_paused, 'value', False)
+
+
+def update_stats(user_id, **fields):
+    """apply changes to the stats row of a user
+
+    returns False if the user has no stats row, in which case the
+    counters must not be changed either
+    """
+    if is_paused():
+        return False
+    return bool(RecipeStats.objects.filter(user_id=user_id).update(
+        updated_at=timezone.now(), **fields
+    ))
+
+
+def add_counts(user_id, kind, deltas):
+    """add {key: delta} to the counters of a user"""
+    rows = [(user_id, kind, key, delta)
+            for key, delta in deltas.items() if delta]
+    if not rows:
+        return
+    table = connection.ops.quote_name(RecipeStatsCount._meta.db_table)
+    key = connection.ops.quote_name('key')
+    values = ', '.join(['(%s, %s, %s, %s)'] * len(rows))
+    # concurrent writers add to the same row without losing updates
+    sql = (
+        f'INSERT INTO {table} (user_id, kind, {key}, count) '
+        f'VALUES {values} '
+        f'ON CONFLICT (user_id, kind, {key}) '
+        f'DO UPDATE SET count = {table}.count + EXCLUDED.count'
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [value for row in rows for value in row])
+
+
+def refresh_price_range(user_id):
+    """recompute the price range of a user, after its minimum or
+    maximum recipe changed or was deleted"""
+    prices = Recipe.objects.filter(user_id=user_id) \
+        .aggregate(price_min=Min('price'), price_max=Max('price'))
+    RecipeStats.objects.filter(user_id=user_id).update(**prices)
+
+
+def _price(value):
+    """return a price as stored, instances may hold floats or strings"""
+    field = Recipe._meta.get_field('price')
+    return field.to_python(value).quantize(Decimal('0.01'))
+
+
+def _price_value(price):
+    return Value(price, output_field=Recipe._meta.get_field('price'))
+
+
+def _is_price_bound(user_id, price):
+    return RecipeStats.objects.filter(user_id=user_id).filter(
+        Q(price_min=price) | Q(price_max=price)
+    ).exists()
+
+
+def recipe_added(recipe):
+    price = _price_value(_price(recipe.price))
+    # LEAST and GREATEST ignore the NULL range of a user without recipes
+    if not update_stats(recipe.user_id,
+                        recipe_count=F('recipe_count') + 1,
+                        price_total=F('price_total') + price,
+                        price_min=Least('price_min', price),
+                        price_max=Greatest('price_max', price)):
+        return
+    add_counts(recipe.user_id, RecipeStatsCount.TIME,
+               {time_bucket(recipe.time_miniutes): 1})
+
+
+def recipe_changed(recipe, old_price, old_minutes):
+    price = _price(recipe.price)
+    old_price = _price(old_price)
+    value = _price_value(price)
+    removed_bound = (price != old_price and
+                     _is_price_bound(recipe.user_id, old_price))
+    if not update_stats(recipe.user_id,
+                        price_total=F('price_total') + price - old_price,
+                        price_min=Least('price_min', value),
+                        price_max=Greatest('price_max', value)):
+        return
+    if removed_bound:
+        refresh_price_range(recipe.user_id)
+    old_bucket = time_bucket(old_minutes)
+    bucket = time_bucket(recipe.time_miniutes)
+    if bucket != old_bucket:
+        add_counts(recipe.user_id, RecipeStatsCount.TIME,
+                   {old_bucket: -1, bucket: 1})
+
+
+def recipe_removed(recipe, related_ids):
+    """related_ids maps each counter kind to the ids the recipe used"""
+    price = _price(recipe.price)
+    removed_bound = _is_price_bound(recipe.user_id, price)
+    if not update_stats(recipe.user_id,
+                        recipe_count=F('recipe_count') - 1,
+                        price_total=F('price_total') - price):
+        return
+    if removed_bound:
+        refresh_price_range(recipe.user_id)
+    add_counts(recipe.user_id, RecipeStatsCount.TIME,
+               {time_bucket(recipe.time_miniutes): -1})
+    for kind, ids in related_ids.items():
+        add_counts(recipe.user_id, kind, {pk: -1 for pk in ids})
+
+
+def relation_changed(user_id, kind, deltas):
+    """add {tag or ingredient id: delta} to the counters of a user"""
+    if update_stats(user_id):
+        add_counts(user_id, kind, deltas)
+
+
+def related_removed(user_id, kind, pk):
+    """drop the counter of a deleted tag or ingredient"""
+    if update_stats(user_id):
+        RecipeStatsCount.objects.filter(user_id=user_id, kind=kind,
+                                        key=pk).delete()
+
+
+def aggregate_stats(recipes):
+    """aggregate the statistics of a queryset of recipes
+
+    returns (stats fields, {(kind, key): count})
+    """
+    fields = recipes.order_by().aggregate(
+        recipe_count=Count('pk'),
+        price_total=Sum('price'),
+        price_min=Min('price'),
+        price_max=Max('price'),
+    )
+    fields['price_total'] = fields['price_total'] or Decimal('0.00')
+
+    counts = {}
+    buckets = recipes.order_by() \
+        .annotate(bucket=time_bucket_expression()) \
+        .values('bucket').annotate(count=Count('pk')) \
+        .values_list('bucket', 'count')
+    for bucket, count in buckets:
+        counts[(RecipeStatsCount.TIME, bucket)] = count
+    for relation, kind in RELATION_KINDS:
+        field = Recipe._meta.get_field(relation)
+        through = field.remote_field.through
+        recipe_column = f'{field.m2m_field_name()}_id'
+        related_column = f'{field.m2m_reverse_field_name()}_id'
+        rows = through.objects \
+            .filter(**{f'{recipe_column}__in': recipes.values('pk')}) \
+            .order_by().values(related_column) \
+            .annotate(count=Count(recipe_column)) \
+            .values_list(related_column, 'count')
+        for pk, count in rows:
+            counts[(kind, pk)] = count
+    return fields, counts
+
+
+def compute_stats(user_id):
+    """aggregate the statistics of a user from the recipe tables"""
+    return aggregate_stats(Recipe.objects.filter(user_id=user_id))
+
+
+def recipes_added(user_id, recipe_ids):
+    """add recipes created in bulk, with their relations"""
+    if is_paused() or not recipe_ids:
+        return
+    fields, counts = aggregate_stats(
+        Recipe.objects.filter(pk__in=recipe_ids)
+    )
+    if not update_stats(
+            user_id,
+            recipe_count=F('recipe_count') + fields['recipe_count'],
+            price_total=F('price_total') + fields['price_total'],
+            price_min=Least('price_min', _price_value(fields['price_min'])),
+            price_max=Greatest('price_max',
+                               _price_value(fields['price_max']))):
+        return
+    by_kind = {}
+    for (kind, key), count in counts.items():
+        by_kind.setdefault(kind, {})[key] = count
+    for kind, deltas in by_kind.items():
+        add_counts(user_id, kind, deltas)
+
+
+def recipes_changed(user_id, old_values, old_related):
+    """apply the changes of recipes updated in bulk
+
+    old_values maps recipe ids to their (price, time_miniutes) before
+    the update, old_related maps relations to {recipe id: [ids]} for the
+    recipes whose objects were replaced
+    """
+    if is_paused() or not old_values:
+        return
+    bounds = RecipeStats.objects.filter(user_id=user_id) \
+        .values_list('price_min', 'price_max').first()
+    if bounds is None:
+        return
+
+    price_delta = Decimal('0.00')
+    removed_bound = False
+    buckets = Counter()
+    new_values = list(Recipe.objects.filter(pk__in=list(old_values))
+                      .values_list('pk', 'price', 'time_miniutes'))
+    for pk, price, minutes in new_values:
+        old_price, old_minutes = old_values[pk]
+        old_price = _price(old_price)
+        price_delta += price - old_price
+        if price != old_price and old_price in bounds:
+            removed_bound = True
+        buckets[time_bucket(old_minutes)] -= 1
+        buckets[time_bucket(minutes)] += 1
+    prices = [price for pk, price, minutes in new_values]
+    if not prices:
+        return
+
+    # LEAST and GREATEST ignore the NULL range of a user without recipes
+    update_stats(user_id,
+                 price_total=F('price_total') + price_delta,
+                 price_min=Least('price_min', _price_value(min(prices))),
+                 price_max=Greatest('price_max', _price_value(max(prices))))
+    if removed_bound:
+        refresh_price_range(user_id)
+    add_counts(user_id, RecipeStatsCount.TIME, buckets)
+    for relation, kind in RELATION_KINDS:
+        related = old_related.get(relation)
+        if not related:
+            continue
+        field = Recipe._meta.get_field(relation)
+        through = field.remote_field.through
+        recipe_column = f'{field.m2m_field_name()}_id'
+        related_column = f'{field.m2m_reverse_field_name()}_id'
+        current = through.objects \
+            .filter(**{f'{recipe_column}__in': list(related)}) \
+            .values_list(related_column, flat=True)
+        deltas = Counter(current)
+        deltas.subtract(pk for ids in related.values() for pk in ids)
+        add_counts(user_id, kind, deltas)
+
+
+def stored_stats(user_id):
+    """return the stored statistics of a user like compute_stats,
+    or None if the user has no stats row"""
+    stats = RecipeStats.objects.filter(user_id=user_id) \
+        .values('recipe_count', 'price_total', 'price_min', 'price_max') \
+        .first()
+    if stats is None:
+        return None
+    counts = RecipeStatsCount.objects.filter(user_id=user_id) \
+        .exclude(count=0).values_list('kind', 'key', 'count')
+    return stats, {(kind, key): count for kind, key, count in counts}
+
+
+def stats_drift(user_id):
+    """return the names of the stored statistics that differ from the
+    recipe tables, empty if the user has no stats row"""
+    stored = stored_stats(user_id)
+    if stored is None:
+        return []
+    fields, counts = compute_stats(user_id)
+    drift = [name for name, value in fields.items()
+             if stored[0][name] != value]
+    for kind, key in sorted(set(counts) | set(stored[1])):
+        if counts.get((kind, key)) != stored[1].get((kind, key)):
+            drift.append(f'{kind} {key}')
+    return drift
+
+
+@transaction.atomic
+def build_stats(user_id):
+    """store the statistics of a user computed from scratch"""
+    # the lock orders the rebuild with the deltas of concurrent writes
+    RecipeStats.objects.select_for_update().get_or_create(user_id=user_id)
+    fields, counts = compute_stats(user_id)
+    RecipeStats.objects.filter(user_id=user_id).update(
+        updated_at=timezone.now(), **fields
+    )
+    RecipeStatsCount.objects.filter(user_id=user_id).delete()
+    RecipeStatsCount.objects.bulk_create([
+        RecipeStatsCount(user_id=user_id, kind=kind, key=key, count=count)
+        for (kind, key), count in counts.items()
+    ])
+
+
+def rebuild_if_tracked(user_id):
+    """rebuild the statistics of a user after writes of unknown deltas"""
+    if RecipeStats.objects.filter(user_id=user_id).exists():
+        build_stats(user_id)
+
+
+def get_stats(user_id):
+    """return the stats row of a user, building it on first use"""
+    stats = RecipeStats.objects.filter(user_id=user_id).first()
+    if stats is None:
+        build_stats(user_id)
+        stats = RecipeStats.objects.get(user_id=user_id)
+    return stats
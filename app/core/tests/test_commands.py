@@ -1,7 +1,24 @@
+import io
+import json
+import os
+import shutil
+import tempfile
+from decimal import Decimal
+from io import StringIO
 from unittest.mock import patch
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
 from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
 from django.db.utils import OperationalError
-from django.test import TestCase
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from PIL import Image
+from rest_framework.authtoken.models import Token
+
+from core.management.commands.create_users import Command
+from core.models import Recipe, RecipeStats, Tag
 
 
 class CommandTests(TestCase):
@@ -26,3 +43,280 @@ class CommandTests(TestCase):
             gi.side_effect = [OperationalError]*5 + [True]
             call_command('wait_for_db')
             self.assertEqual(gi.call_count, 6)
+
+
+class ImportRecipesTests(TestCase):
+    """Test the import_recipes command"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('test@test.com',
+                                                         'testpass')
+        self.tag = Tag.objects.create(user=self.user, name='Vegan')
+
+    def write(self, suffix, content):
+        """return the path of a temporary file holding content"""
+        handle = tempfile.NamedTemporaryFile('w', suffix=suffix,
+                                             delete=False)
+        with handle:
+            handle.write(content)
+        self.addCleanup(os.remove, handle.name)
+        return handle.name
+
+    def import_recipes(self, *paths, **options):
+        out = StringIO()
+        call_command('import_recipes', *paths, user='test@test.com',
+                     stdout=out, **options)
+        return out.getvalue()
+
+    def test_import_ndjson(self):
+        path = self.write('.ndjson', '\n'.join([
+            json.dumps({'title': 'Soup', 'time_miniutes': 5, 'price': 1.1,
+                        'tags': ['Vegan', 'Quick'],
+                        'ingredients': ['Kale']}),
+            '',
+            json.dumps({'title': 'Stew', 'time_miniutes': 50,
+                        'price': '12.50', 'link': 'https://example.com',
+                        'tags': ['Quick']}),
+        ]))
+
+        output = self.import_recipes(path, batch_size=1)
+
+        self.assertIn('imported 2 recipes', output)
+        soup = Recipe.objects.get(title='Soup')
+        self.assertEqual(soup.price, Decimal('1.10'))
+        self.assertEqual(sorted(soup.tags.values_list('name', flat=True)),
+                         ['Quick', 'Vegan'])
+        # existing tags are reused, new ones are created once
+        self.assertEqual(Tag.objects.count(), 2)
+        self.assertEqual(soup.tags.get(name='Vegan'), self.tag)
+        stew = Recipe.objects.get(title='Stew')
+        self.assertEqual(stew.link, 'https://example.com')
+        self.assertEqual(list(stew.ingredients.all()), [])
+
+    def test_import_csv(self):
+        path = self.write('.csv', 'title,time_miniutes,price,tags,'
+                                  'ingredients\n'
+                                  'Soup,5,1.00,Vegan|Quick,Kale|Salt\n')
+
+        self.import_recipes(path)
+
+        soup = Recipe.objects.get(title='Soup', user=self.user)
+        self.assertEqual(soup.tags.count(), 2)
+        self.assertEqual(soup.ingredients.count(), 2)
+
+    def test_import_updates_search_vector(self):
+        path = self.write('.ndjson', json.dumps(
+            {'title': 'Soup', 'time_miniutes': 5, 'price': 1,
+             'ingredients': ['Kale']}
+        ))
+
+        self.import_recipes(path)
+
+        self.assertTrue(Recipe.objects.filter(search_vector='kale').exists())
+
+    # names are resolved for the whole batch, not for every record
+    def test_import_queries_per_batch(self):
+        def path(count):
+            return self.write('.ndjson', '\n'.join(
+                json.dumps({'title': f'Soup {i}', 'time_miniutes': 5,
+                            'price': 1, 'tags': [f'tag {count} {i}'],
+                            'ingredients': [f'ing {count} {i}']})
+                for i in range(count)
+            ))
+
+        small, large = path(2), path(20)
+        with CaptureQueriesContext(connection) as queries:
+            self.import_recipes(small)
+        with self.assertNumQueries(len(queries.captured_queries)):
+            self.import_recipes(large)
+
+        self.assertEqual(Recipe.objects.count(), 22)
+
+    def test_import_invalid_record(self):
+        path = self.write('.ndjson', json.dumps(
+            {'title': 'Soup', 'time_miniutes': 'long', 'price': 1}
+        ))
+
+        with self.assertRaisesRegex(CommandError, 'line 1: time_miniutes'):
+            self.import_recipes(path)
+        self.assertFalse(Recipe.objects.exists())
+
+    # emails are matched whatever their case, like at login
+    def test_import_user_email_case(self):
+        path = self.write('.ndjson', json.dumps(
+            {'title': 'Soup', 'time_miniutes': 5, 'price': 1}
+        ))
+
+        call_command('import_recipes', path, user='Test@TEST.com',
+                     stdout=StringIO())
+
+        self.assertEqual(Recipe.objects.get().user, self.user)
+
+    def test_import_unknown_user(self):
+        path = self.write('.ndjson', '')
+
+        with self.assertRaises(CommandError):
+            call_command('import_recipes', path, user='other@test.com',
+                         stdout=StringIO())
+
+
+class CreateUsersTests(TestCase):
+    """Test the create_users command"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('taken@test.com',
+                                                         'testpass')
+
+    def write(self, content):
+        handle = tempfile.NamedTemporaryFile('w', suffix='.csv',
+                                             delete=False)
+        with handle:
+            handle.write(content)
+        self.addCleanup(os.remove, handle.name)
+        return handle.name
+
+    def create_users(self, *paths, **options):
+        out = StringIO()
+        call_command('create_users', *paths, stdout=out, **options)
+        return out.getvalue()
+
+    def test_create_users(self):
+        path = self.write('email,name,password\n'
+                          'one@Test.com,One,pass1\n'
+                          'TAKEN@test.com,Taken,pass2\n'
+                          'ONE@test.com,Again,pass3\n'
+                          'two@test.com,,\n')
+
+        output = self.create_users(path, batch_size=2)
+
+        self.assertIn('created 2 users, skipped 2', output)
+        # the domain is lower cased like in create_user()
+        one = get_user_model().objects.get(email='one@test.com')
+        self.assertEqual(one.name, 'One')
+        self.assertTrue(one.check_password('pass1'))
+        two = get_user_model().objects.get(email='two@test.com')
+        self.assertFalse(two.has_usable_password())
+        self.assertEqual(Token.objects.filter(user__in=[one, two]).count(),
+                         2)
+        self.assertFalse(Token.objects.filter(user=self.user).exists())
+
+    def test_create_users_in_workers(self):
+        path = self.write('email,password\n' + ''.join(
+            f'user{i}@test.com,pass{i}\n' for i in range(6)
+        ))
+
+        self.create_users(path, batch_size=2, workers=2, tokens=False)
+
+        user = get_user_model().objects.get(email='user5@test.com')
+        self.assertTrue(user.check_password('pass5'))
+        self.assertEqual(get_user_model().objects.count(), 7)
+        self.assertFalse(Token.objects.exists())
+
+    # one query finds the existing emails of a batch
+    def test_create_users_queries(self):
+        path = self.write('email,password\n' + ''.join(
+            f'user{i}@test.com,pass{i}\n' for i in range(5)
+        ))
+
+        # lookup, savepoint, users, tokens, release
+        with self.assertNumQueries(5):
+            self.create_users(path)
+
+    # another process created a user after the emails were looked up
+    def test_create_users_insert_race(self):
+        path = self.write('email,password\n'
+                          'new@test.com,pass1\n'
+                          'taken@test.com,pass2\n')
+        # the first lookup misses taken@test.com, the retry finds it
+        with patch.object(Command, 'taken_emails',
+                          side_effect=[set(), {'TAKEN@TEST.COM'}]):
+            output = self.create_users(path)
+
+        self.assertIn('created 1 users, skipped 1', output)
+        self.assertTrue(get_user_model().objects
+                        .filter(email='new@test.com').exists())
+        self.assertEqual(get_user_model().objects.count(), 2)
+
+    def test_invalid_email(self):
+        path = self.write('email,password\nnot an email,pass\n')
+
+        with self.assertRaisesRegex(CommandError, 'line 2: email'):
+            self.create_users(path)
+
+
+class BuildImageDerivativesTests(TestCase):
+    """Test the build_image_derivatives command"""
+
+    def setUp(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media)
+        settings = override_settings(MEDIA_ROOT=media)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+        user = get_user_model().objects.create_user('test@test.com')
+        self.recipes = [
+            Recipe.objects.create(user=user, title=title, time_miniutes=5,
+                                  price=1)
+            for title in ('Soup', 'Stew', 'Salad')
+        ]
+        for recipe, color in zip(self.recipes[:2], ('red', 'blue')):
+            output = io.BytesIO()
+            Image.new('RGB', (50, 50), color).save(output, 'JPEG')
+            recipe.image.save('photo.jpg', ContentFile(output.getvalue()))
+
+    def test_backfill(self):
+        out = StringIO()
+        call_command('build_image_derivatives', stdout=out)
+
+        self.assertIn('derivatives of 2 images, 0 failed', out.getvalue())
+        for recipe in self.recipes:
+            recipe.refresh_from_db()
+        self.assertEqual(set(self.recipes[0].image_derivatives),
+                         {'thumbnail', 'card', 'full'})
+        self.assertEqual(self.recipes[2].image_derivatives, {})
+
+        # only the images without derivatives are handled again
+        out = StringIO()
+        call_command('build_image_derivatives', stdout=out)
+        self.assertIn('derivatives of 0 images', out.getvalue())
+
+    def test_backfill_reports_failures(self):
+        self.recipes[0].image.storage.delete(self.recipes[0].image.name)
+        out, err = StringIO(), StringIO()
+
+        call_command('build_image_derivatives', stdout=out, stderr=err)
+
+        self.assertIn('1 images, 1 failed', out.getvalue())
+        self.assertIn(f'recipe {self.recipes[0].pk}', err.getvalue())
+
+
+class RebuildRecipeStatsTests(TestCase):
+    """Test the rebuild_recipe_stats command"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('test@test.com',
+                                                         'testpass')
+        Recipe.objects.create(user=self.user, title='Soup',
+                              time_miniutes=5, price=1)
+        call_command('rebuild_recipe_stats', user='test@test.com',
+                     stdout=StringIO())
+
+    def test_check_without_drift(self):
+        out = StringIO()
+        call_command('rebuild_recipe_stats', check=True, stdout=out)
+
+        self.assertIn('no drift', out.getvalue())
+
+    def test_drift_reported_and_fixed(self):
+        RecipeStats.objects.filter(user=self.user).update(recipe_count=7)
+
+        out = StringIO()
+        with self.assertRaises(CommandError):
+            call_command('rebuild_recipe_stats', check=True, stdout=out)
+        self.assertIn('test@test.com: recipe_count', out.getvalue())
+
+        call_command('rebuild_recipe_stats', stdout=StringIO())
+
+        self.assertEqual(RecipeStats.objects.get(user=self.user)
+                         .recipe_count, 1)
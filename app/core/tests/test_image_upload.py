@@ -1,18 +1,19 @@
-from unittest.mock import patch
+import hashlib
+
+from django.core.files.base import ContentFile
 from django.test import TestCase
 from core import models
 
 
 class ImageManagerTest(TestCase):
 
-    # change image name with uuid for unique identification
-    @patch('uuid.uuid4')
-    def test_image_filename_uuid(self, mock_uuid):
-        # mock the generated uuid with test uuid
-        uuid = 'test-uuid'
-        mock_uuid.return_value = uuid
-        original_filename = 'myimage.jpg'
-        file_path = models.recipe_image_file_path(None, original_filename)
-        expected_path = f'uploads/recipe/{uuid}.jpg'
+    # images are named by their content, so each is stored once
+    def test_image_filename_sha256(self):
+        recipe = models.Recipe(image=ContentFile(b'image', name='a.jpg'))
+        original_filename = 'myimage.JPG'
+        file_path = models.recipe_image_file_path(recipe, original_filename)
+        digest = hashlib.sha256(b'image').hexdigest()
+        expected_path = (f'uploads/recipe/sha256/{digest[:2]}/{digest[2:4]}/'
+                         f'{digest}.jpg')
 
         self.assertEqual(file_path, expected_path)
@@ -0,0 +1,262 @@
+import io
+import shutil
+import tempfile
+import threading
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.test import TransactionTestCase, override_settings
+from PIL import Image
+
+from core import images
+from core.models import Recipe, StoredImage
+
+
+SIZES = {'thumbnail': 100, 'card': 400}
+
+
+def jpeg(width, height):
+    """return the bytes of a JPEG image"""
+    output = io.BytesIO()
+    Image.new('RGB', (width, height), 'orange').save(output, 'JPEG')
+    return output.getvalue()
+
+
+# files are deleted when the release of their last reference commits
+@override_settings(RECIPE_IMAGE_SIZES=SIZES)
+class ImageDerivativesTests(TransactionTestCase):
+    """Test the generation of resized copies of recipe images"""
+
+    def setUp(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media)
+        settings = override_settings(MEDIA_ROOT=media)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        # the tests generate the derivatives themselves
+        schedule = patch('core.images.schedule')
+        self.schedule = schedule.start()
+        self.addCleanup(schedule.stop)
+
+        user = get_user_model().objects.create_user('test@test.com')
+        self.recipe = Recipe.objects.create(user=user, title='Soup',
+                                            time_miniutes=5, price=1)
+        self.recipe.image.save('photo.jpg', ContentFile(jpeg(2000, 1000)))
+
+    def test_render_sizes(self):
+        rendered = images.render(io.BytesIO(jpeg(2000, 1000)), SIZES)
+
+        sizes = {name: Image.open(io.BytesIO(data)).size
+                 for name, data in rendered.items()}
+        self.assertEqual(sizes, {'thumbnail': (100, 50), 'card': (400, 200)})
+
+    # a JPEG is decoded at the smallest scale above the largest size
+    def test_render_uses_draft(self):
+        with patch.object(Image.Image, 'convert',
+                          autospec=True,
+                          side_effect=Image.Image.convert) as convert:
+            images.render(io.BytesIO(jpeg(2000, 1000)), SIZES)
+
+        self.assertEqual(convert.call_args[0][0].size, (500, 250))
+
+    def test_generate(self):
+        paths = images.generate(self.recipe.pk, self.recipe.image.name)
+
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.image_derivatives, paths)
+        storage = images.image_storage()
+        with storage.open(paths['thumbnail']) as thumbnail:
+            self.assertEqual(Image.open(thumbnail).size, (100, 50))
+
+    # the image was replaced while its derivatives were generated
+    def test_generate_for_replaced_image(self):
+        name = self.recipe.image.name
+        Recipe.objects.filter(pk=self.recipe.pk).update(image='other.jpg')
+
+        self.assertIsNone(images.generate(self.recipe.pk, name))
+
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.image_derivatives, {})
+        # the image is still stored, its derivatives are kept with it
+        path = images.derivative_path(name, 'card')
+        self.assertTrue(images.image_storage().exists(path))
+        self.assertEqual(StoredImage.objects.get(name=name).derivatives,
+                         {'thumbnail': images.derivative_path(name,
+                                                              'thumbnail'),
+                          'card': path})
+
+    def recipe_with(self, data):
+        return Recipe.objects.create(user=self.recipe.user, title='Stew',
+                                     time_miniutes=5, price=1,
+                                     image=ContentFile(data, name='a.jpg'))
+
+    def stored(self, recipe):
+        return StoredImage.objects.get(name=recipe.image.name)
+
+    # the same content is written once and referenced twice
+    def test_store_deduplicates(self):
+        data = jpeg(30, 30)
+
+        first = images.store_image(ContentFile(data, name='a.jpg'))
+        with patch.object(images.image_storage(), 'save') as save:
+            second = images.store_image(ContentFile(data, name='b.JPG'))
+
+        save.assert_not_called()
+        self.assertEqual(first.name, second.name)
+        self.assertTrue(first.name.startswith('uploads/recipe/sha256/'))
+        self.assertTrue(first.name.endswith(f'{first.sha256}.jpg'))
+        self.assertEqual(StoredImage.objects.get(name=first.name).ref_count,
+                         2)
+        with images.image_storage().open(first.name) as file:
+            self.assertEqual(file.read(), data)
+
+    def test_save_stores_image(self):
+        recipe = self.recipe_with(jpeg(30, 30))
+
+        self.assertEqual(self.stored(recipe).ref_count, 1)
+        self.assertTrue(recipe.image.name.startswith('uploads/recipe/sha256/'))
+        self.schedule.assert_called_with(recipe)
+
+    # like the admin picking the path of a stored file
+    def test_save_assigned_name(self):
+        paths = images.generate(self.recipe.pk, self.recipe.image.name)
+
+        recipe = Recipe.objects.create(user=self.recipe.user, title='Stew',
+                                       time_miniutes=5, price=1,
+                                       image=self.recipe.image.name)
+
+        self.assertEqual(self.stored(recipe).ref_count, 2)
+        self.assertEqual(recipe.image_derivatives, paths)
+
+    def test_save_unchanged_image(self):
+        recipe = Recipe.objects.get(pk=self.recipe.pk)
+        recipe.title = 'Broth'
+
+        with patch('core.images.image_saving') as saving:
+            recipe.save()
+
+        saving.assert_not_called()
+        self.assertEqual(self.stored(recipe).ref_count, 1)
+
+    def test_save_replaced_image(self):
+        name = self.recipe.image.name
+        paths = images.generate(self.recipe.pk, name)
+        self.recipe.refresh_from_db()
+
+        self.recipe.image = ContentFile(jpeg(20, 20), name='b.jpg')
+        self.recipe.save()
+
+        self.assertEqual(self.recipe.image_derivatives, {})
+        self.assertEqual(self.stored(self.recipe).ref_count, 1)
+        self.assertFalse(StoredImage.objects.filter(name=name).exists())
+        for path in [name, *paths.values()]:
+            self.assertFalse(images.image_storage().exists(path))
+
+    def test_save_cleared_image(self):
+        name = self.recipe.image.name
+
+        self.recipe.image = None
+        self.recipe.save()
+
+        self.assertFalse(StoredImage.objects.exists())
+        self.assertFalse(images.image_storage().exists(name))
+
+    def test_release_deletes_with_last_reference(self):
+        data = jpeg(30, 30)
+        first, second = self.recipe_with(data), self.recipe_with(data)
+        name = first.image.name
+        paths = images.generate(first.pk, name)
+        storage = images.image_storage()
+
+        first.delete()
+
+        self.assertTrue(storage.exists(name))
+        self.assertEqual(self.stored(second).ref_count, 1)
+
+        second.delete()
+
+        self.assertFalse(StoredImage.objects.filter(name=name).exists())
+        for path in [name, *paths.values()]:
+            self.assertFalse(storage.exists(path))
+
+    def test_release_rolled_back(self):
+        recipe = self.recipe_with(jpeg(30, 30))
+
+        with self.assertRaises(ValueError), transaction.atomic():
+            recipe.delete()
+            raise ValueError()
+
+        self.assertTrue(images.image_storage().exists(recipe.image.name))
+        self.assertEqual(self.stored(recipe).ref_count, 1)
+
+    # uploaded again before the release committed
+    def test_release_referenced_again(self):
+        data = jpeg(30, 30)
+        recipe = self.recipe_with(data)
+
+        with transaction.atomic():
+            recipe.delete()
+            images.store_image(ContentFile(data, name='b.jpg'))
+
+        self.assertTrue(images.image_storage().exists(recipe.image.name))
+        self.assertEqual(self.stored(recipe).ref_count, 1)
+
+    # images stored before the sharing belong to a single recipe
+    def test_release_unshared_image(self):
+        name = images.image_storage().save('uploads/recipe/old.jpg',
+                                           ContentFile(jpeg(30, 30)))
+        Recipe.objects.filter(pk=self.recipe.pk).update(image=name)
+        paths = images.generate(self.recipe.pk, name)
+        self.recipe.refresh_from_db()
+
+        images.release_image(self.recipe)
+
+        for path in [name, *paths.values()]:
+            self.assertFalse(images.image_storage().exists(path))
+
+    def test_generate_reuses_shared_derivatives(self):
+        data = jpeg(30, 30)
+        first, second = self.recipe_with(data), self.recipe_with(data)
+        name = first.image.name
+        paths = images.generate(first.pk, name)
+
+        with patch('core.images.render') as render:
+            self.assertEqual(images.generate(second.pk, name), paths)
+
+        render.assert_not_called()
+        second.refresh_from_db()
+        self.assertEqual(second.image_derivatives, paths)
+
+    def test_generator_counts_failures(self):
+        generator = images.DerivativeGenerator(workers=1, queue_size=0)
+
+        with patch('core.images.generate', side_effect=OSError), \
+                self.assertLogs('core.images', 'ERROR'):
+            self.assertIsNone(generator.submit(1, 'missing.jpg').result())
+
+        self.assertEqual((generator.failed, generator.pending), (1, 0))
+
+    # past the queue size, build_image_derivatives generates them later
+    def test_generator_defers_when_full(self):
+        generator = images.DerivativeGenerator(workers=1, queue_size=1)
+        started, finish = threading.Event(), threading.Event()
+
+        def generate(recipe_id, image_name):
+            started.set()
+            finish.wait(5)
+            return {}
+
+        with patch('core.images.generate', side_effect=generate), \
+                self.assertLogs('core.images', 'WARNING'):
+            running = generator.submit(1, 'a.jpg')
+            started.wait(5)
+            queued = generator.submit(2, 'b.jpg')
+            self.assertIsNone(generator.submit(3, 'c.jpg'))
+            finish.set()
+            running.result(), queued.result()
+
+            self.assertIsNotNone(generator.submit(4, 'd.jpg').result())
+
+        self.assertEqual((generator.deferred, generator.generated), (1, 3))
@@ -0,0 +1,150 @@
+import os
+import shutil
+import tempfile
+
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils.http import http_date
+
+from core.images import IMAGES_DIR
+
+
+def media_url(path):
+    return reverse('media', args=[path])
+
+
+class MediaServeTests(TestCase):
+    """Test the view serving media files"""
+
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media)
+        settings = override_settings(MEDIA_ROOT=self.media,
+                                     MEDIA_SENDFILE='')
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+        self.path = 'uploads/recipe/photo.jpg'
+        self.content = bytes(range(100))
+        self.write(self.path, self.content)
+
+    def write(self, path, content):
+        fullpath = os.path.join(self.media, path)
+        os.makedirs(os.path.dirname(fullpath), exist_ok=True)
+        with open(fullpath, 'wb') as file:
+            file.write(content)
+
+    def get(self, path, **headers):
+        res = self.client.get(media_url(path), **headers)
+        if res.streaming:
+            res.body = b''.join(res.streaming_content)
+            res.close()
+        return res
+
+    def test_serve_file(self):
+        res = self.get(self.path)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.body, self.content)
+        self.assertEqual(res['Content-Type'], 'image/jpeg')
+        self.assertEqual(res['Content-Length'], '100')
+        self.assertEqual(res['Accept-Ranges'], 'bytes')
+        self.assertEqual(res['Cache-Control'], 'public, max-age=3600')
+        self.assertIn('ETag', res)
+
+    def test_content_named_file_immutable(self):
+        path = f'{IMAGES_DIR}/ab/cd/abcd.jpg'
+        self.write(path, self.content)
+
+        res = self.get(path)
+
+        self.assertEqual(res['Cache-Control'],
+                         'public, max-age=31536000, immutable')
+
+    def test_conditional_get(self):
+        etag = self.get(self.path)['ETag']
+
+        res = self.get(self.path, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(res['ETag'], etag)
+        self.assertEqual(res['Cache-Control'], 'public, max-age=3600')
+
+        mtime = os.path.getmtime(os.path.join(self.media, self.path))
+        res = self.get(self.path, HTTP_IF_MODIFIED_SINCE=http_date(mtime))
+        self.assertEqual(res.status_code, 304)
+
+    def test_range(self):
+        res = self.get(self.path, HTTP_RANGE='bytes=10-19')
+
+        self.assertEqual(res.status_code, 206)
+        self.assertEqual(res.body, self.content[10:20])
+        self.assertEqual(res['Content-Range'], 'bytes 10-19/100')
+        self.assertEqual(res['Content-Length'], '10')
+
+    def test_open_and_suffix_ranges(self):
+        res = self.get(self.path, HTTP_RANGE='bytes=90-')
+        self.assertEqual(res.body, self.content[90:])
+
+        res = self.get(self.path, HTTP_RANGE='bytes=-5')
+        self.assertEqual(res.body, self.content[95:])
+        self.assertEqual(res['Content-Range'], 'bytes 95-99/100')
+
+        # past the end is cut to the end of the file
+        res = self.get(self.path, HTTP_RANGE='bytes=98-200')
+        self.assertEqual(res.body, self.content[98:])
+
+    def test_range_not_satisfiable(self):
+        res = self.get(self.path, HTTP_RANGE='bytes=100-')
+
+        self.assertEqual(res.status_code, 416)
+        self.assertEqual(res['Content-Range'], 'bytes */100')
+
+    # ranges of an outdated copy are answered with the whole file
+    def test_if_range_outdated(self):
+        etag = self.get(self.path)['ETag']
+
+        res = self.get(self.path, HTTP_RANGE='bytes=10-19',
+                       HTTP_IF_RANGE=etag)
+        self.assertEqual(res.status_code, 206)
+
+        res = self.get(self.path, HTTP_RANGE='bytes=10-19',
+                       HTTP_IF_RANGE='"other"')
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.body, self.content)
+
+    def test_several_ranges_serve_whole_file(self):
+        res = self.get(self.path, HTTP_RANGE='bytes=0-1,5-6')
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.body, self.content)
+
+    @override_settings(MEDIA_SENDFILE='x-accel-redirect',
+                       MEDIA_ACCEL_PREFIX='/protected-media/')
+    def test_x_accel_redirect(self):
+        res = self.get(self.path, HTTP_RANGE='bytes=10-19')
+
+        # nginx answers the range
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res['X-Accel-Redirect'],
+                         '/protected-media/uploads/recipe/photo.jpg')
+        self.assertEqual(res.content, b'')
+        self.assertEqual(res['Content-Type'], 'image/jpeg')
+        self.assertIn('ETag', res)
+
+    @override_settings(MEDIA_SENDFILE='x-sendfile')
+    def test_x_sendfile(self):
+        res = self.get(self.path)
+
+        self.assertEqual(res['X-Sendfile'],
+                         os.path.join(self.media, self.path))
+
+    def test_missing_and_outside_files(self):
+        self.assertEqual(self.get('uploads/other.jpg').status_code, 404)
+        self.assertEqual(self.get('uploads/recipe').status_code, 404)
+        self.assertEqual(self.get('../etc/passwd').status_code, 404)
+
+    def test_only_safe_methods(self):
+        res = self.client.post(media_url(self.path))
+
+        self.assertEqual(res.status_code, 405)
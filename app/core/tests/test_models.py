@@ -1,5 +1,6 @@
 from django.test import TestCase
 from django.contrib.auth import get_user_model
+from django.db import IntegrityError, connection, transaction
 
 
 class ModelTests(TestCase):
@@ -46,3 +47,26 @@ class ModelTests(TestCase):
 
         self.assertTrue(user.is_superuser)
         self.assertTrue(user.is_staff)
+
+    # the same email in another case is the same user
+    def test_email_case_insensitive(self):
+        user = get_user_model().objects.create_user('Silent@Retreat.com')
+
+        found = get_user_model().objects.get_by_natural_key(
+            'silent@RETREAT.com'
+        )
+
+        self.assertEqual(found, user)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            get_user_model().objects.create_user('SILENT@retreat.com')
+
+    def test_email_lookup_uses_index(self):
+        users = get_user_model().objects.filter(email__iexact='a@b.com')
+        with connection.cursor() as cursor:
+            cursor.execute('SET enable_seqscan = off')
+            sql, params = users.query.sql_with_params()
+            cursor.execute(f'EXPLAIN {sql}', params)
+            plan = '\n'.join(row[0] for row in cursor.fetchall())
+            cursor.execute('RESET enable_seqscan')
+
+        self.assertIn('core_user_email_upper_uniq', plan)
@@ -0,0 +1,138 @@
+from decimal import Decimal
+from unittest.mock import patch
+
+from django.test import TestCase
+from django.contrib.auth import get_user_model
+from core import models, stats
+from core.signals import recipes_bulk_changed
+
+
+# sample user for the tests
+def sample_user(email="test@test.com", password="testpass"):
+    return get_user_model().objects.create(email=email, password=password)
+
+
+class RecipeStatsTests(TestCase):
+    """Test that the incremental statistics match a full rebuild"""
+
+    def setUp(self):
+        self.user = sample_user()
+        self.vegan = models.Tag.objects.create(user=self.user, name='Vegan')
+        self.quick = models.Tag.objects.create(user=self.user, name='Quick')
+        self.kale = models.Ingredient.objects.create(user=self.user,
+                                                     name='Kale')
+        stats.get_stats(self.user.pk)
+
+    def recipe(self, **kwargs):
+        defaults = {'title': 'Soup', 'time_miniutes': 5, 'price': 5.00}
+        defaults.update(kwargs)
+        return models.Recipe.objects.create(user=self.user, **defaults)
+
+    def assertNoDrift(self):
+        self.assertEqual(stats.stats_drift(self.user.pk), [])
+
+    def test_recipe_writes(self):
+        cheap = self.recipe(price=1.10)
+        dear = self.recipe(price=9.90, time_miniutes=95)
+        self.assertNoDrift()
+        summary = models.RecipeStats.objects.get(user=self.user)
+        self.assertEqual(summary.recipe_count, 2)
+        self.assertEqual(summary.price_min, Decimal('1.10'))
+
+        # moving the cheapest recipe recomputes the range
+        cheap.price = Decimal('4.00')
+        cheap.time_miniutes = 30
+        cheap.save()
+        self.assertNoDrift()
+
+        dear.delete()
+        self.assertNoDrift()
+        cheap.delete()
+        self.assertNoDrift()
+        summary.refresh_from_db()
+        self.assertEqual(summary.recipe_count, 0)
+        self.assertIsNone(summary.price_max)
+
+    def test_relation_writes(self):
+        soup = self.recipe()
+        stew = self.recipe(title='Stew')
+
+        soup.tags.add(self.vegan, self.quick)
+        soup.tags.add(self.vegan)
+        soup.ingredients.add(self.kale)
+        self.assertNoDrift()
+
+        # removing a tag the recipe does not have changes nothing
+        stew.tags.remove(self.vegan)
+        soup.tags.remove(self.quick)
+        self.assertNoDrift()
+
+        self.vegan.recipe_set.add(stew)
+        self.assertNoDrift()
+        self.vegan.recipe_set.clear()
+        self.assertNoDrift()
+
+        stew.ingredients.add(self.kale)
+        soup.ingredients.clear()
+        self.assertNoDrift()
+
+        soup.delete()
+        self.kale.delete()
+        self.assertNoDrift()
+
+    def test_bulk_writes(self):
+        recipes = models.Recipe.objects.bulk_create([
+            models.Recipe(user=self.user, title='Soup', time_miniutes=5,
+                          price=Decimal('2.00')),
+            models.Recipe(user=self.user, title='Stew', time_miniutes=50,
+                          price=Decimal('3.00')),
+        ])
+        models.Recipe.tags.through.objects.create(recipe=recipes[0],
+                                                  tag=self.vegan)
+        recipe_ids = [recipe.pk for recipe in recipes]
+        recipes_bulk_changed.send(sender=models.Recipe, user_id=self.user.pk,
+                                  recipe_ids=recipe_ids, created=True)
+        self.assertNoDrift()
+
+        models.Recipe.objects.filter(pk__in=recipe_ids).update(price=7)
+        recipes_bulk_changed.send(sender=models.Recipe, user_id=self.user.pk,
+                                  recipe_ids=recipe_ids)
+        self.assertNoDrift()
+
+    # the deltas of a cascade are replaced by one rebuild per user
+    def test_recipes_deleted_at_once(self):
+        self.recipe().tags.add(self.vegan)
+        self.recipe(price=9.90).ingredients.add(self.kale)
+
+        with patch('core.stats.build_stats',
+                   wraps=stats.build_stats) as build, \
+                patch('core.stats.recipe_removed') as removed:
+            models.Recipe.objects.filter(user=self.user).delete()
+
+        build.assert_called_once_with(self.user.pk)
+        removed.assert_not_called()
+        self.assertNoDrift()
+
+    def test_user_deleted(self):
+        self.recipe().tags.add(self.vegan)
+        other = sample_user(email='other@test.com')
+        stats.get_stats(other.pk)
+        models.Recipe.objects.create(user=other, title='Stew',
+                                     time_miniutes=5, price=1)
+
+        with patch('core.stats.recipe_removed') as removed:
+            self.user.delete()
+            get_user_model().objects.filter(pk=other.pk).delete()
+
+        removed.assert_not_called()
+        self.assertFalse(models.RecipeStats.objects.exists())
+
+    # statistics are only tracked once they have been built
+    def test_untracked_user(self):
+        other = sample_user(email='other@test.com')
+        models.Recipe.objects.create(user=other, title='Soup',
+                                     time_miniutes=5, price=1)
+
+        self.assertFalse(models.RecipeStats.objects.filter(user=other)
+                         .exists())
+        self.assertEqual(stats.get_stats(other.pk).recipe_count, 1)
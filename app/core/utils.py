@@ -0,0 +1,10 @@
+def batches(records, size):
+    """yield lists of at most size records"""
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
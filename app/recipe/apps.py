@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class RecipeConfig(AppConfig):
     name = 'recipe'
+
+    # connect the signal handlers once the models are loaded
+    def ready(self):
+        from recipe import signals  # noqa: F401
@@ -0,0 +1,66 @@
+import logging
+
+from django.conf import settings
+from django.db import connection
+
+
+logger = logging.getLogger(__name__)
+
+
+class QueryBudgetExceeded(AssertionError):
+    """Raised in strict mode when a view runs more queries than budgeted"""
+
+
+class QueryCounter:
+    """execute_wrapper hook that counts the queries sent to the database"""
+
+    def __init__(self):
+        self.count = 0
+        # queries are only counted while this is set
+        self.counting = False
+
+    def __call__(self, execute, sql, params, many, context):
+        if self.counting:
+            self.count += 1
+        return execute(sql, params, many, context)
+
+
+# Every action of a viewset gets a fixed number of queries.
+# The budget must not depend on the number of rows returned,
+# so a missing prefetch (N+1) shows up as soon as a list grows.
+class QueryBudgetMixin:
+    """Count the queries run by the view handler and compare to budget"""
+
+    # action name -> maximum number of queries. Actions not listed
+    # here are not checked
+    query_budget = {}
+
+    # the wrapper is removed from the connection whatever happens in
+    # the view, even an exception that DRF does not handle
+    def dispatch(self, request, *args, **kwargs):
+        self._query_counter = QueryCounter()
+        with connection.execute_wrapper(self._query_counter):
+            return super().dispatch(request, *args, **kwargs)
+
+    # authentication and permission checks run in initial(),
+    # so the counter is only started after them.
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        self._query_counter.counting = True
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        counter = self._query_counter
+        if counter.counting:
+            counter.counting = False
+            self.check_query_budget(counter.count)
+        return super().finalize_response(request, response, *args, **kwargs)
+
+    def check_query_budget(self, count):
+        budget = self.query_budget.get(self.action)
+        if budget is None or count <= budget:
+            return
+        msg = (f'{self.__class__.__name__}.{self.action} ran {count} '
+               f'queries, budget is {budget}')
+        if getattr(settings, 'QUERY_BUDGET_STRICT', False):
+            raise QueryBudgetExceeded(msg)
+        logger.warning(msg)
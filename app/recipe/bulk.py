@@ -0,0 +1,171 @@
+from django.db import transaction
+from django.db.models import Case, Value, When
+from django.db.models.functions import Cast
+from django.utils import timezone
+
+from core import stats
+from core.models import Recipe
+from core.signals import recipes_bulk_changed
+
+
+# Writing recipes one by one costs an INSERT or UPDATE per recipe plus a
+# DELETE and an INSERT per relation. The functions below write a whole
+# batch with one statement per table instead.
+
+BATCH_SIZE = 500
+
+RELATIONS = ('tags', 'ingredients')
+
+
+def _through_rows(relation, related):
+    """return unsaved through rows for a {recipe_id: [objects]} mapping"""
+    field = Recipe._meta.get_field(relation)
+    through = field.remote_field.through
+    recipe_column = f'{field.m2m_field_name()}_id'
+    related_column = f'{field.m2m_reverse_field_name()}_id'
+    return [
+        through(**{recipe_column: recipe_id, related_column: obj.pk})
+        for recipe_id, objects in related.items()
+        # the same object listed twice is stored once
+        for obj in {obj.pk: obj for obj in objects}.values()
+    ]
+
+
+def _set_relations(relations):
+    """replace the tags and ingredients of recipes
+
+    takes {relation: {recipe_id: [objects]}}, recipes missing from a
+    relation keep their current objects
+    """
+    for relation, related in relations.items():
+        if not related:
+            continue
+        field = Recipe._meta.get_field(relation)
+        through = field.remote_field.through
+        recipe_column = f'{field.m2m_field_name()}_id'
+        through.objects.filter(
+            **{f'{recipe_column}__in': list(related)}
+        ).delete()
+        through.objects.bulk_create(_through_rows(relation, related),
+                                    batch_size=BATCH_SIZE)
+
+
+def _split_relations(validated_data):
+    """pop the many to many values out of validated data"""
+    return {
+        relation: validated_data.pop(relation)
+        for relation in RELATIONS if relation in validated_data
+    }
+
+
+def bulk_create_recipes(user, items):
+    """create recipes from validated serializer data
+
+    returns the created recipes in the order of items
+    """
+    relations = {relation: {} for relation in RELATIONS}
+    recipes, pending = [], []
+    for data in items:
+        data = dict(data)
+        pending.append(_split_relations(data))
+        recipes.append(Recipe(user=user, **data))
+
+    with transaction.atomic():
+        # Postgres returns the ids of the inserted rows
+        Recipe.objects.bulk_create(recipes, batch_size=BATCH_SIZE)
+        for recipe, related in zip(recipes, pending):
+            for relation, objects in related.items():
+                relations[relation][recipe.pk] = objects
+        _set_relations(relations)
+
+        recipe_ids = [recipe.pk for recipe in recipes]
+        recipes_bulk_changed.send(sender=Recipe, user_id=user.pk,
+                                  recipe_ids=recipe_ids, created=True)
+    return recipes
+
+
+def _related_ids(relation, recipe_ids):
+    """return {recipe_id: [ids]} of the objects of recipes"""
+    field = Recipe._meta.get_field(relation)
+    through = field.remote_field.through
+    recipe_column = f'{field.m2m_field_name()}_id'
+    related_column = f'{field.m2m_reverse_field_name()}_id'
+    related = {recipe_id: [] for recipe_id in recipe_ids}
+    rows = through.objects \
+        .filter(**{f'{recipe_column}__in': recipe_ids}) \
+        .values_list(recipe_column, related_column)
+    for recipe_id, pk in rows:
+        related[recipe_id].append(pk)
+    return related
+
+
+def bulk_update_recipes(user, pairs):
+    """update recipes from (recipe, validated serializer data) pairs
+
+    the recipes must hold their current values, the statistics are
+    changed by the difference
+    """
+    relations = {relation: {} for relation in RELATIONS}
+    fields = set()
+    now = timezone.now()
+    old_values = {recipe.pk: (recipe.price, recipe.time_miniutes)
+                  for recipe, data in pairs}
+    for recipe, data in pairs:
+        data = dict(data)
+        for relation, objects in _split_relations(data).items():
+            relations[relation][recipe.pk] = objects
+        for name, value in data.items():
+            setattr(recipe, name, value)
+            fields.add(name)
+        recipe.updated_at = now
+    fields.add('updated_at')
+
+    recipes = [recipe for recipe, data in pairs]
+    with transaction.atomic():
+        for start in range(0, len(recipes), BATCH_SIZE):
+            _case_update(recipes[start:start + BATCH_SIZE], sorted(fields))
+        old_related = {relation: _related_ids(relation, list(related))
+                       for relation, related in relations.items()
+                       if related}
+        _set_relations(relations)
+
+        recipe_ids = [recipe.pk for recipe in recipes]
+        recipes_bulk_changed.send(sender=Recipe, user_id=user.pk,
+                                  recipe_ids=recipe_ids,
+                                  old_values=old_values,
+                                  old_related=old_related)
+    return recipes
+
+
+# UPDATE ... SET field = CASE id WHEN 1 THEN ... END WHERE id IN (...)
+# sets a different value on every row with a single statement
+def _case_update(recipes, fields):
+    updates = {}
+    for name in fields:
+        field = Recipe._meta.get_field(name)
+        # parameters are sent untyped, the cast gives the CASE its type
+        updates[name] = Cast(Case(
+            *[When(pk=recipe.pk,
+                   then=Value(getattr(recipe, field.attname),
+                              output_field=field))
+              for recipe in recipes],
+            output_field=field,
+        ), output_field=field)
+    Recipe.objects.filter(pk__in=[recipe.pk for recipe in recipes]) \
+        .update(**updates)
+
+
+def bulk_delete_recipes(user, ids):
+    """delete the recipes of the user with the given ids
+
+    returns the ids that were deleted
+    """
+    with transaction.atomic():
+        queryset = Recipe.objects.filter(user=user, pk__in=ids)
+        deleted = list(queryset.values_list('pk', flat=True))
+        # the statistics are rebuilt once instead of once per recipe
+        with stats.paused():
+            queryset.delete()
+        recipes_bulk_changed.send(sender=Recipe, user_id=user.pk,
+                                  recipe_ids=deleted)
+    return deleted
@@ -0,0 +1,113 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from rest_framework.response import Response
+
+
+# Every user has a data version. Cached responses are keyed on it, so
+# bumping the version after a write makes all of the user's cached
+# responses unreachable at once, without having to find and delete them.
+# They expire on their own after the cache timeout.
+
+def get_cache():
+    return caches[settings.RECIPE_CACHE]
+
+
+# backends that keep their entries in the memory of each process
+LOCAL_BACKENDS = ('django.core.cache.backends.locmem.LocMemCache',)
+
+
+def is_enabled():
+    """return True if cached responses and data versions can be used
+
+    Other worker processes would not see the bumps of a per process
+    cache, so it is only used when a single process serves requests
+    """
+    backend = settings.CACHES[settings.RECIPE_CACHE]['BACKEND']
+    return backend not in LOCAL_BACKENDS or \
+        settings.RECIPE_CACHE_SINGLE_PROCESS
+
+
+def version_key(user_id):
+    return f'recipe:version:{user_id}'
+
+
+# Versions are microsecond timestamps of the last write, so a version
+# also tells when the user's data last changed (see recipe.conditional).
+# A version lost by eviction or expiry restarts from the clock, so it
+# can not come back to a value that cached responses were stored under.
+# Versions expire after RECIPE_CACHE_VERSION_TIMEOUT: writes the API
+# processes do not hear about, like those of the management commands
+# with a per process cache, are seen after that at the latest.
+def _now_us():
+    return int(time.time() * 1000000)
+
+
+def get_data_version(user_id):
+    """return the current data version of a user"""
+    cache = get_cache()
+    version = cache.get(version_key(user_id))
+    if version is None:
+        cache.add(version_key(user_id), _now_us(),
+                  settings.RECIPE_CACHE_VERSION_TIMEOUT)
+        version = cache.get(version_key(user_id), _now_us())
+    return version
+
+
+def bump_data_version(user_id):
+    """invalidate every cached response of a user once the current
+    transaction commits
+
+    A bump made before the commit would let a concurrent read cache the
+    old data under the new version
+    """
+    transaction.on_commit(lambda: set_data_version(user_id))
+
+
+def set_data_version(user_id):
+    # a plain set, without reading the previous version, so concurrent
+    # bumps can not undo each other
+    get_cache().set(version_key(user_id), _now_us(),
+                    settings.RECIPE_CACHE_VERSION_TIMEOUT)
+
+
+def request_digest(request):
+    """return a digest of the host, path and query params of a request"""
+    # query params are sorted so their order in the url does not matter
+    params = sorted(
+        (key, value)
+        for key, values in request.query_params.lists()
+        for value in values
+    )
+    # next links embed the host, so it is part of the digest
+    raw = repr((request.get_host(), request.path, params))
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+def response_cache_key(request, version):
+    """return the cache key of a GET request for a data version"""
+    digest = request_digest(request)
+    return f'recipe:response:{request.user.pk}:{version}:{digest}'
+
+
+class CachedListMixin:
+    """Serve list responses from the cache until the user's data changes"""
+
+    def list(self, request, *args, **kwargs):
+        if not is_enabled():
+            return super().list(request, *args, **kwargs)
+        version = get_data_version(request.user.pk)
+        key = response_cache_key(request, version)
+        cache = get_cache()
+
+        data = cache.get(key)
+        if data is not None:
+            return Response(data)
+
+        response = super().list(request, *args, **kwargs)
+        if response.status_code == 200:
+            cache.set(key, response.data)
+        return response
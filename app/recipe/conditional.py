@@ -0,0 +1,75 @@
+import hashlib
+from calendar import timegm
+
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from rest_framework.response import Response
+
+from recipe.cache import get_data_version, is_enabled, request_digest
+
+
+# Clients that poll send back the ETag or Last-Modified of the response
+# they hold. The validators below are computed from a timestamp alone,
+# so an unchanged resource is answered with 304 before anything is
+# serialized.
+
+def make_etag(request, *parts):
+    """return an ETag for a representation of a request"""
+    # the browsable API and JSON are different representations
+    raw = repr((request_digest(request), request.accepted_renderer.format,
+                parts))
+    return quote_etag(hashlib.sha1(raw.encode('utf-8')).hexdigest())
+
+
+def not_modified(request, etag, last_modified):
+    """return a 304 response if the client copy is current, else None"""
+    return get_conditional_response(request, etag=etag,
+                                    last_modified=last_modified)
+
+
+def set_validators(response, etag, last_modified):
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    return response
+
+
+class ConditionalGetMixin:
+    """Answer conditional GET requests on list and detail actions
+
+    A list changes whenever the data version of the user changes (see
+    recipe.cache), which also happens on deletions. A detail changes
+    when the updated_at of its object changes.
+    """
+
+    def list(self, request, *args, **kwargs):
+        # without data versions lists have no validators
+        if not is_enabled():
+            return super().list(request, *args, **kwargs)
+        version = get_data_version(request.user.pk)
+        etag = make_etag(request, version)
+        # versions are microsecond timestamps
+        last_modified = version // 1000000
+
+        response = not_modified(request, etag, last_modified)
+        if response is None:
+            response = super().list(request, *args, **kwargs)
+            if response.status_code == 200:
+                set_validators(response, etag, last_modified)
+        return response
+
+    def retrieve(self, request, *args, **kwargs):
+        instance = self.get_object()
+        etag = make_etag(request, instance.updated_at.isoformat())
+        last_modified = timegm(instance.updated_at.utctimetuple())
+
+        response = not_modified(request, etag, last_modified)
+        if response is None:
+            self.load_relations(instance)
+            serializer = self.get_serializer(instance)
+            response = set_validators(Response(serializer.data),
+                                      etag, last_modified)
+        return response
+
+    def load_relations(self, instance):
+        """load what the serializer needs, once the object is known
+        to have changed"""
@@ -0,0 +1,95 @@
+import json
+from collections import OrderedDict, defaultdict
+from itertools import islice
+
+from rest_framework.utils.encoders import JSONEncoder
+
+from recipe import serializers
+from recipe.fast import FastRepresentation
+
+
+# The export streams every recipe of a user with its tags and ingredients
+# inlined, as RecipeDetailSerializer renders them. Recipes are read from a
+# server side cursor and rendered one chunk at a time: only one chunk of
+# rows and its relations is held in memory, whatever the number of recipes.
+
+EXPORT_CHUNK_SIZE = 1000
+
+NDJSON = 'ndjson'
+JSON = 'json'
+CONTENT_TYPES = {
+    NDJSON: 'application/x-ndjson',
+    JSON: 'application/json',
+}
+
+
+class NestedRepresentation(FastRepresentation):
+    """Recipe rows with the id and name of their related objects"""
+
+    # same fields as TagSerializer and IngredientSerializer
+    related_fields = ('id', 'name')
+
+    def __init__(self):
+        super().__init__(serializers.RecipeSerializer())
+
+    # the related objects are inlined instead of their ids
+    def related_ids(self, field, row_ids):
+        through = field.remote_field.through
+        row_column = f'{field.m2m_field_name()}_id'
+        related = field.m2m_reverse_field_name()
+        columns = [f'{related}__{name}' for name in self.related_fields]
+        objects = defaultdict(list)
+        rows = through.objects.filter(**{f'{row_column}__in': row_ids}) \
+            .order_by(f'{related}_id') \
+            .values_list(row_column, *columns)
+        for row_id, *values in rows:
+            objects[row_id].append(
+                OrderedDict(zip(self.related_fields, values))
+            )
+        return objects
+
+
+def chunks(iterable, size):
+    """yield lists of at most size items"""
+    iterator = iter(iterable)
+    chunk = list(islice(iterator, size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(iterator, size))
+
+
+def export_recipes(queryset, chunk_size=EXPORT_CHUNK_SIZE):
+    """yield the representation of every recipe of a queryset"""
+    representation = NestedRepresentation()
+    rows = queryset.prefetch_related(None) \
+        .values(*representation.get_columns()) \
+        .iterator(chunk_size=chunk_size)
+    # iterator() ignores prefetch_related, relations are loaded per chunk
+    for chunk in chunks(rows, chunk_size):
+        yield from representation.render(chunk)
+
+
+def _dumps(item):
+    return json.dumps(item, cls=JSONEncoder, ensure_ascii=False)
+
+
+def ndjson_lines(items):
+    """yield one JSON document per line"""
+    for item in items:
+        yield _dumps(item) + '\n'
+
+
+def json_array(items):
+    """yield a single JSON array, one item at a time"""
+    yield '['
+    separator = ''
+    for item in items:
+        yield separator + _dumps(item)
+        separator = ','
+    yield ']'
+
+
+STREAMS = {
+    NDJSON: ndjson_lines,
+    JSON: json_array,
+}
@@ -0,0 +1,52 @@
+from collections import OrderedDict
+
+from django.db.models import CharField, Count, F, Value
+
+from core.models import Recipe
+
+
+# The filter sidebar shows, for every tag and ingredient, how many of the
+# recipes matching the current filter use it. Both facets are counted by
+# one query: a grouped aggregate over each through table, restricted to
+# the matching recipes, combined with UNION ALL.
+
+FACETS = ('tags', 'ingredients')
+
+
+def facet_rows(relation, recipe_ids):
+    """return (facet, id, name, count) rows of one through table"""
+    field = Recipe._meta.get_field(relation)
+    through = field.remote_field.through
+    recipe_column = f'{field.m2m_field_name()}_id'
+    related = field.m2m_reverse_field_name()
+    return through.objects \
+        .filter(**{f'{recipe_column}__in': recipe_ids}) \
+        .order_by() \
+        .values(facet=Value(relation, output_field=CharField()),
+                related_id=F(f'{related}_id'),
+                name=F(f'{related}__name')) \
+        .annotate(count=Count(recipe_column)) \
+        .values_list('facet', 'related_id', 'name', 'count')
+
+
+def facet_counts(recipes):
+    """return the number of recipes and the counts of every facet
+
+    Objects used by none of the recipes are left out. Facets are sorted
+    by decreasing count, then by name
+    """
+    recipe_ids = recipes.order_by().values('pk')
+    first, *others = [facet_rows(relation, recipe_ids)
+                      for relation in FACETS]
+
+    facets = OrderedDict((relation, []) for relation in FACETS)
+    for facet, pk, name, count in first.union(*others, all=True):
+        facets[facet].append(
+            OrderedDict([('id', pk), ('name', name), ('count', count)])
+        )
+    for items in facets.values():
+        items.sort(key=lambda item: (-item['count'], item['name']))
+
+    data = OrderedDict([('count', recipes.count())])
+    data.update(facets)
+    return data
@@ -0,0 +1,134 @@
+from collections import OrderedDict, defaultdict
+
+from rest_framework import serializers
+from rest_framework.response import Response
+
+
+# A ModelSerializer builds a model instance for every row and then reads
+# every field through its source attributes. For read only lists the rows
+# are fetched with values() instead, and every field is converted with
+# the same DRF field that the serializer would use, so the output is the
+# same as the serializer's. Many relations are read from their through
+# table with one query each and grouped by row id.
+
+# fields whose to_representation returns database values unchanged
+IDENTITY_FIELDS = (serializers.IntegerField, serializers.CharField,
+                   serializers.BooleanField)
+
+
+class Unsupported(Exception):
+    """Raised for serializers that have no fast representation"""
+
+
+class FastRepresentation:
+    """Compiled representation of a serializer for values() rows"""
+
+    def __init__(self, serializer, annotations=()):
+        self.model = serializer.Meta.model
+        opts = self.model._meta
+        concrete = {field.name: field for field in opts.concrete_fields}
+        many_to_many = {field.name: field for field in opts.many_to_many}
+
+        # (output name, column, converter or None)
+        self.columns = []
+        # (output name, many to many model field)
+        self.relations = []
+        self.names = []
+        for name, field in serializer.fields.items():
+            if field.write_only:
+                continue
+            self.names.append(name)
+            if (isinstance(field, serializers.ManyRelatedField) and
+                    isinstance(field.child_relation,
+                               serializers.PrimaryKeyRelatedField) and
+                    field.child_relation.pk_field is None and
+                    field.source in many_to_many):
+                self.relations.append((name, many_to_many[field.source]))
+            elif field.source in annotations or (
+                    field.source in concrete and
+                    not concrete[field.source].is_relation and
+                    not isinstance(field, serializers.RelatedField)):
+                converter = None
+                if not isinstance(field, IDENTITY_FIELDS):
+                    converter = field.to_representation
+                self.columns.append((name, field.source, converter))
+            else:
+                raise Unsupported(f'{name} has no fast representation')
+
+    @classmethod
+    def compile(cls, serializer, annotations=()):
+        """return the fast representation, or None if not supported
+
+        annotations are the names of the annotations of the queryset
+        """
+        try:
+            return cls(serializer, annotations)
+        except Unsupported:
+            return None
+
+    def get_columns(self):
+        return [column for name, column, converter in self.columns]
+
+    def related_ids(self, field, row_ids):
+        """return {row id: [related ids]} for a many to many field"""
+        through = field.remote_field.through
+        row_column = f'{field.m2m_field_name()}_id'
+        related_column = f'{field.m2m_reverse_field_name()}_id'
+        ids = defaultdict(list)
+        pairs = through.objects.filter(**{f'{row_column}__in': row_ids}) \
+            .order_by(related_column) \
+            .values_list(row_column, related_column)
+        for row_id, related_id in pairs:
+            ids[row_id].append(related_id)
+        return ids
+
+    def render(self, rows):
+        """return the representation of a list of values() rows"""
+        pk = self.model._meta.pk.name
+        row_ids = [row[pk] for row in rows]
+        related = {
+            name: self.related_ids(field, row_ids) if row_ids else {}
+            for name, field in self.relations
+        }
+
+        data = []
+        for row in rows:
+            item = {}
+            for name, column, converter in self.columns:
+                value = row[column]
+                if value is not None and converter is not None:
+                    value = converter(value)
+                item[name] = value
+            for name in related:
+                item[name] = related[name].get(row[pk], [])
+            # same field order as the serializer
+            data.append(OrderedDict((name, item[name]) for name in self.names))
+        return data
+
+
+class FastListMixin:
+    """Build list responses from values() rows"""
+
+    # set to False to list through the serializer
+    fast_list = True
+
+    def list(self, request, *args, **kwargs):
+        if not self.fast_list:
+            return super().list(request, *args, **kwargs)
+        queryset = self.filter_queryset(self.get_queryset())
+        representation = FastRepresentation.compile(
+            self.get_serializer(), queryset.query.annotations
+        )
+        if representation is None:
+            return super().list(request, *args, **kwargs)
+
+        # the pagination keys are read from the rows as well
+        columns = representation.get_columns()
+        keys = [key.lstrip('-') for key in self.get_ordering()]
+        columns += [key for key in keys if key not in columns]
+
+        rows = queryset.prefetch_related(None).values(*columns)
+        page = self.paginate_queryset(rows)
+        if page is not None:
+            return self.get_paginated_response(representation.render(page))
+        return Response(representation.render(list(rows)))
@@ -0,0 +1,143 @@
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.utils.translation import gettext_lazy as _
+from rest_framework import serializers
+from rest_framework.relations import MANY_RELATION_KWARGS
+
+from recipe import uploads
+
+
+# PrimaryKeyRelatedField(many=True) resolves every submitted pk with its
+# own query. This field resolves the whole list with a single id__in query
+# and reports every missing pk at once.
+class BatchedManyRelatedField(serializers.ManyRelatedField):
+    """Many relation resolved with a single query"""
+
+    default_error_messages = {
+        'does_not_exist': _('Invalid pks {pk_values} - '
+                            'objects do not exist.'),
+        'incorrect_type': _('Incorrect type. Expected pk value, '
+                            'received {data_type}.'),
+    }
+
+    def to_internal_value(self, data):
+        if isinstance(data, str) or not hasattr(data, '__iter__'):
+            self.fail('not_a_list', input_type=type(data).__name__)
+        if not self.allow_empty and len(data) == 0:
+            self.fail('empty')
+
+        queryset = self.child_relation.get_queryset()
+        pk_field = queryset.model._meta.pk
+        pks = []
+        for item in data:
+            try:
+                pks.append(pk_field.to_python(item))
+            except (DjangoValidationError, TypeError):
+                self.fail('incorrect_type', data_type=type(item).__name__)
+
+        # the objects of a whole bulk request may be resolved already,
+        # see resolve_related
+        objects = self.context.get('related_objects', {}) \
+            .get(self.field_name)
+        if objects is None:
+            objects = queryset.in_bulk(set(pks))
+        missing = [pk for pk in pks if pk not in objects]
+        if missing:
+            self.fail('does_not_exist', pk_values=missing)
+        return [objects[pk] for pk in pks]
+
+
+def resolve_related(fields, items):
+    """resolve the pks that a list of items gives to batched many
+    relations, with one query per relation
+
+    returns {field name: {pk: object}} for the 'related_objects' context
+    of the serializers validating the items
+    """
+    resolved = {}
+    for name, field in fields.items():
+        if not isinstance(field, BatchedManyRelatedField) or \
+                field.read_only:
+            continue
+        queryset = field.child_relation.get_queryset()
+        pk_field = queryset.model._meta.pk
+        pks = set()
+        for item in items:
+            values = item.get(name) if isinstance(item, dict) else None
+            if isinstance(values, str) or \
+                    not hasattr(values, '__iter__'):
+                continue
+            for value in values:
+                # invalid pks are reported by the field
+                try:
+                    pks.add(pk_field.to_python(value))
+                except (DjangoValidationError, TypeError):
+                    pass
+        resolved[name] = queryset.in_bulk(pks)
+    return resolved
+
+
+class UserPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """Primary key relation limited to the objects of the request user"""
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        request = self.context.get('request')
+        if request is None:
+            return queryset
+        return queryset.filter(user=request.user)
+
+    # many=True builds a BatchedManyRelatedField around this field
+    @classmethod
+    def many_init(cls, *args, **kwargs):
+        list_kwargs = {'child_relation': cls(*args, **kwargs)}
+        for key in kwargs:
+            if key in MANY_RELATION_KWARGS:
+                list_kwargs[key] = kwargs[key]
+        return BatchedManyRelatedField(**list_kwargs)
+
+
+# URLs of the resized copies of a recipe image (see core.images). Sizes
+# that are not generated yet are null, clients show the original then.
+class ImageDerivativesField(serializers.Field):
+    """Read only map of size names to the URLs of image derivatives"""
+
+    def __init__(self, **kwargs):
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        storage = self.parent.Meta.model._meta.get_field('image').storage
+        request = self.context.get('request')
+        urls = OrderedDict()
+        for name in settings.RECIPE_IMAGE_SIZES:
+            path = value.get(name)
+            url = None
+            if path is not None:
+                url = storage.url(path)
+                if request is not None:
+                    url = request.build_absolute_uri(url)
+            urls[name] = url
+        return urls
+
+
+# DRF's ImageField opens and verifies the whole image. This field only
+# reads the header of the file, see recipe.uploads
+class HeaderCheckedImageField(serializers.FileField):
+    """Image upload checked from its header only"""
+
+    default_error_messages = {
+        'too_large': _('The file is larger than {max_size} bytes.'),
+    }
+
+    def to_internal_value(self, data):
+        file = super().to_internal_value(data)
+        if file.size > settings.RECIPE_IMAGE_MAX_SIZE:
+            self.fail('too_large', max_size=settings.RECIPE_IMAGE_MAX_SIZE)
+        try:
+            uploads.check_image_header(file)
+        except DjangoValidationError as exc:
+            raise serializers.ValidationError(exc.messages)
+        return file
@@ -0,0 +1,159 @@
+from decimal import Decimal, InvalidOperation
+
+from django.db.models import Count, Exists, IntegerField, OuterRef, \
+    Subquery
+from django.db.models.functions import Coalesce
+from django.utils.translation import gettext_lazy as _
+from rest_framework.exceptions import ValidationError
+
+from core.models import Recipe
+
+
+MATCH_ANY = 'any'
+MATCH_ALL = 'all'
+MATCH_CHOICES = (MATCH_ANY, MATCH_ALL)
+
+
+def params_to_ints(value):
+    """convert a comma separated string of IDs to a set of ints"""
+    try:
+        return {int(str_id) for str_id in value.split(',')}
+    except ValueError:
+        raise ValidationError(_('Expected a comma separated list of ids'))
+
+
+def param_to_decimal(params, name):
+    """return a decimal query param, or None if it is missing"""
+    value = params.get(name)
+    if not value:
+        return None
+    try:
+        number = Decimal(value)
+    except InvalidOperation:
+        raise ValidationError({name: [_('Expected a number')]})
+    if not number.is_finite():
+        raise ValidationError({name: [_('Expected a number')]})
+    return number
+
+
+def param_to_int(params, name):
+    """return an integer query param, or None if it is missing"""
+    value = params.get(name)
+    if not value:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise ValidationError({name: [_('Expected an integer')]})
+
+
+def filter_ranges(queryset, params):
+    """apply the price_min, price_max and time_max params"""
+    price_min = param_to_decimal(params, 'price_min')
+    price_max = param_to_decimal(params, 'price_max')
+    time_max = param_to_int(params, 'time_max')
+    if price_min is not None:
+        queryset = queryset.filter(price__gte=price_min)
+    if price_max is not None:
+        queryset = queryset.filter(price__lte=price_max)
+    if time_max is not None:
+        queryset = queryset.filter(time_miniutes__lte=time_max)
+    return queryset
+
+
+# ?ordering= accepts the keys below only. Each one is served by an index
+# on (user_id, key, id), and id breaks ties in the same direction so the
+# keyset pagination can seek on the pair
+ORDERINGS = {
+    'id': ('id',),
+    'price': ('price', 'id'),
+    'time_miniutes': ('time_miniutes', 'id'),
+    'title': ('title', 'id'),
+}
+
+
+def get_ordering(params, default):
+    """return the ordering keys requested with ?ordering="""
+    value = params.get('ordering')
+    if not value:
+        return default
+    descending = value.startswith('-')
+    keys = ORDERINGS.get(value.lstrip('-'))
+    if keys is None:
+        choices = ', '.join(sorted(ORDERINGS))
+        raise ValidationError({'ordering': [
+            _('Expected one of: {choices}, '
+              'optionally prefixed with -').format(choices=choices)
+        ]})
+    if descending:
+        return tuple(f'-{key}' for key in keys)
+    return keys
+
+
+def get_match(params):
+    """return the match mode requested in the query params"""
+    match = params.get('match', MATCH_ANY)
+    if match not in MATCH_CHOICES:
+        raise ValidationError(
+            {'match': _('Expected one of: any, all')}
+        )
+    return match
+
+
+# Joining the M2M table (tags__id__in) returns a recipe once for every
+# matching row of the through table. Instead, the recipe ids are selected
+# from the through table alone and used as a semi-join, so every recipe
+# is returned once and the outer query stays a plain scan of recipes.
+def related_recipe_ids(relation, ids, match=MATCH_ANY):
+    """return a subquery of ids of recipes related to the given objects
+
+    relation is the name of a many to many field of Recipe.
+    With match='any' a recipe needs one of the ids, with match='all'
+    it needs every one of them
+    """
+    field = Recipe._meta.get_field(relation)
+    through = field.remote_field.through
+    recipe_column = f'{field.m2m_field_name()}_id'
+    related_column = f'{field.m2m_reverse_field_name()}_id'
+
+    rows = through.objects.filter(**{f'{related_column}__in': ids})
+    if match == MATCH_ALL:
+        # GROUP BY recipe HAVING COUNT(related) = number of ids.
+        # through rows are unique per (recipe, related) pair
+        rows = rows.values(recipe_column).annotate(
+            matched=Count(related_column)
+        ).filter(matched=len(ids))
+    return rows.values(recipe_column)
+
+
+def filter_related(queryset, relation, ids, match=MATCH_ANY):
+    """keep the recipes related to the given ids, without duplicates"""
+    return queryset.filter(pk__in=related_recipe_ids(relation, ids, match))
+
+
+# The queries below start from tags or ingredients. They look up the
+# through rows of the object in the outer query with a correlated
+# subquery, answered from the (related_id, recipe_id) index alone.
+def through_rows(relation):
+    """return the through rows of the object in the outer query"""
+    field = Recipe._meta.get_field(relation)
+    through = field.remote_field.through
+    related_column = f'{field.m2m_reverse_field_name()}_id'
+    return through.objects.filter(**{related_column: OuterRef('pk')}) \
+        .order_by(), related_column
+
+
+def filter_assigned(queryset, relation):
+    """keep the objects used by at least one recipe, without duplicates"""
+    rows, related_column = through_rows(relation)
+    return queryset.annotate(assigned=Exists(rows)).filter(assigned=True)
+
+
+def annotate_recipe_count(queryset, relation):
+    """add the number of recipes using each object as recipe_count"""
+    rows, related_column = through_rows(relation)
+    count = rows.values(related_column) \
+        .annotate(count=Count(related_column)).values('count')
+    return queryset.annotate(recipe_count=Coalesce(
+        Subquery(count, output_field=IntegerField()), 0
+    ))
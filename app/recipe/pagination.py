@@ -0,0 +1,138 @@
+import base64
+import binascii
+import json
+import math
+from collections import OrderedDict
+
+from django.core.exceptions import ImproperlyConfigured, \
+    ValidationError as DjangoValidationError
+from django.utils.translation import gettext_lazy as _
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+# Keyset pagination seeks directly to the first row after the cursor
+# with WHERE (key) < (cursor) instead of skipping rows with OFFSET,
+# and it never runs COUNT(*). With an index on the key, every page
+# costs the same whatever its position in the table.
+class KeysetPagination(BasePagination):
+    """Paginate a queryset on the ordering keys of the view"""
+
+    page_size = 100
+    max_page_size = 1000
+    page_size_query_param = 'page_size'
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = _('Invalid cursor')
+
+    def get_ordering(self, view):
+        """return the ordering keys of the view, e.g. ('-name', '-id')
+
+        The last key must be unique so that every row has its own position
+        """
+        ordering = tuple(view.get_ordering())
+        if len({key.startswith('-') for key in ordering}) != 1:
+            raise ImproperlyConfigured(
+                'KeysetPagination needs all ordering keys in one direction'
+            )
+        return ordering
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if size <= 0:
+            return self.page_size
+        return min(size, self.max_page_size)
+
+    # cursors are opaque to clients: base64 of the key values
+    # of the last row on the previous page
+    def encode_cursor(self, values):
+        data = json.dumps(values, default=str).encode('ascii')
+        return base64.urlsafe_b64encode(data).decode('ascii')
+
+    def decode_cursor(self, request, queryset, ordering):
+        """return the key values of the cursor of a request, converted to
+        the types of the ordering keys, or None without a cursor"""
+        token = request.query_params.get(self.cursor_query_param)
+        if not token:
+            return None
+        try:
+            data = base64.urlsafe_b64decode(token.encode('ascii'))
+            values = json.loads(data.decode('ascii'))
+        except (TypeError, ValueError, UnicodeError, binascii.Error):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(values, list) or len(values) != len(ordering):
+            raise NotFound(self.invalid_cursor_message)
+
+        # values go to SQL unchecked, so a wrong type would fail there
+        converted = []
+        for key, value in zip(ordering, values):
+            field = queryset.query.resolve_ref(key.lstrip('-')).output_field
+            if value is None or isinstance(value, (list, dict)):
+                raise NotFound(self.invalid_cursor_message)
+            try:
+                value = field.to_python(value)
+            except (DjangoValidationError, TypeError):
+                raise NotFound(self.invalid_cursor_message)
+            # a search rank is a float, JSON also allows NaN and Infinity
+            if isinstance(value, float) and not math.isfinite(value):
+                raise NotFound(self.invalid_cursor_message)
+            converted.append(value)
+        return converted
+
+    def seek(self, queryset, ordering, values):
+        """filter rows strictly after the cursor with a row comparison"""
+        # keys may be model fields or annotations such as a search rank,
+        # so each one is compiled to its SQL expression
+        compiler = queryset.query.get_compiler(queryset.db)
+        columns, params = [], []
+        for key in ordering:
+            expression = queryset.query.resolve_ref(key.lstrip('-'))
+            sql, expression_params = compiler.compile(expression)
+            columns.append(sql)
+            params.extend(expression_params)
+        placeholders = ', '.join(['%s'] * len(ordering))
+        operator = '<' if ordering[0].startswith('-') else '>'
+        return queryset.extra(
+            where=[f'({", ".join(columns)}) {operator} ({placeholders})'],
+            params=params + list(values),
+        )
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.ordering = self.get_ordering(view)
+        self.page_size = self.get_page_size(request)
+
+        queryset = queryset.order_by(*self.ordering)
+        values = self.decode_cursor(request, queryset, self.ordering)
+        if values is not None:
+            queryset = self.seek(queryset, self.ordering, values)
+
+        # fetch one extra row to know if there is a next page
+        rows = list(queryset[:self.page_size + 1])
+        self.has_next = len(rows) > self.page_size
+        self.page = rows[:self.page_size]
+        return self.page
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        last = self.page[-1]
+        # pages are model instances, or dicts for values() querysets
+        if isinstance(last, dict):
+            values = [last[key.lstrip('-')] for key in self.ordering]
+        else:
+            values = [getattr(last, key.lstrip('-'))
+                      for key in self.ordering]
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param,
+                                   self.encode_cursor(values))
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('results', data),
+        ]))
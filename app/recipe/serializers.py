@@ -1,8 +1,12 @@
 from rest_framework import serializers
 from core.models import Tag, Ingredient, Recipe
+from recipe.fields import HeaderCheckedImageField, ImageDerivativesField, \
+    UserPrimaryKeyRelatedField
+from recipe.sparse import SparseFieldsSerializerMixin
 
 
-class TagSerializer(serializers.ModelSerializer):
+class TagSerializer(SparseFieldsSerializerMixin,
+                    serializers.ModelSerializer):
     """Serializer for tag object"""
 
     class Meta:
@@ -14,7 +18,8 @@ class TagSerializer(serializers.ModelSerializer):
     # the user which is needed to create Tag is not defined here
 
 
-class IngredientSerializer(serializers.ModelSerializer):
+class IngredientSerializer(SparseFieldsSerializerMixin,
+                           serializers.ModelSerializer):
     """ Serializer for ingredient object"""
 
     class Meta:
@@ -23,27 +28,52 @@ class IngredientSerializer(serializers.ModelSerializer):
         read_only_fields = ('id',)
 
 
+# ?with_counts=1 adds the number of recipes using each tag or ingredient.
+# The count is annotated on the queryset by the view
+class TagCountSerializer(TagSerializer):
+    """Serializer for tag object with its number of recipes"""
+
+    recipe_count = serializers.IntegerField(read_only=True)
+
+    class Meta(TagSerializer.Meta):
+        fields = TagSerializer.Meta.fields + ('recipe_count',)
+
+
+class IngredientCountSerializer(IngredientSerializer):
+    """Serializer for ingredient object with its number of recipes"""
+
+    recipe_count = serializers.IntegerField(read_only=True)
+
+    class Meta(IngredientSerializer.Meta):
+        fields = IngredientSerializer.Meta.fields + ('recipe_count',)
+
+
 # This serializer points nested objects to its primary keys
-class RecipeSerializer(serializers.ModelSerializer):
+class RecipeSerializer(SparseFieldsSerializerMixin,
+                       serializers.ModelSerializer):
     """ Serializer for Recipe object """
 
     # specify the pointing fields for nested objects
     # without these fields, CREATE fails. GET however works
-    ingredients = serializers.PrimaryKeyRelatedField(
+    # only the objects of the request user can be referenced,
+    # and all the ids of a field are looked up with one query
+    ingredients = UserPrimaryKeyRelatedField(
         many=True,
         queryset=Ingredient.objects.all()
     )
 
-    tags = serializers.PrimaryKeyRelatedField(
+    tags = UserPrimaryKeyRelatedField(
         many=True,
         queryset=Tag.objects.all()
     )
 
+    image_urls = ImageDerivativesField(source='image_derivatives')
+
     class Meta:
         model = Recipe
         # ingredients and tag by default refer to its primary keys
         fields = ('id', 'title', 'ingredients', 'tags',
-                  'time_miniutes', 'price', 'link')
+                  'time_miniutes', 'price', 'link', 'image_urls')
         read_only_fields = ('id',)
 
 
@@ -59,7 +89,37 @@ class RecipeDetailSerializer(RecipeSerializer):
 # Recipe serializer with image field
 class RecipeImageSerializer(serializers.ModelSerializer):
     """serializer for uploading images to recipes"""
+    image = HeaderCheckedImageField()
+    image_urls = ImageDerivativesField(source='image_derivatives')
+
     class Meta:
         model = Recipe
-        fields = ('id', 'image')
+        fields = ('id', 'image', 'image_urls')
         read_only_fields = ('id',)
+
+
+# serializers for /api/recipe/stats/, built from core.stats summaries
+class TimeBucketSerializer(serializers.Serializer):
+    """Number of recipes in a range of time_miniutes"""
+    # max is None for the last bucket
+    min = serializers.IntegerField()
+    max = serializers.IntegerField(allow_null=True)
+    count = serializers.IntegerField()
+
+
+class StatsCountSerializer(serializers.Serializer):
+    """Number of recipes with a tag or an ingredient"""
+    id = serializers.IntegerField()
+    name = serializers.CharField()
+    count = serializers.IntegerField()
+
+
+class RecipeStatsSerializer(serializers.Serializer):
+    """Serializer for the recipe statistics of a user"""
+    count = serializers.IntegerField()
+    price_min = serializers.DecimalField(max_digits=5, decimal_places=2)
+    price_avg = serializers.DecimalField(max_digits=5, decimal_places=2)
+    price_max = serializers.DecimalField(max_digits=5, decimal_places=2)
+    time_miniutes = TimeBucketSerializer(many=True)
+    top_tags = StatsCountSerializer(many=True)
+    top_ingredients = StatsCountSerializer(many=True)
@@ -0,0 +1,38 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from core.models import Tag, Ingredient, Recipe
+from core.signals import recipes_bulk_changed
+from recipe.cache import bump_data_version
+
+
+# Any write to a user's recipes, tags or ingredients invalidates the
+# cached responses of that user. Handling the model signals covers
+# perform_create, perform_update and perform_destroy of the viewsets
+# as well as writes made from the admin or the shell.
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_save, sender=Tag)
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Recipe)
+@receiver(post_delete, sender=Tag)
+@receiver(post_delete, sender=Ingredient)
+def user_data_changed(sender, instance, **kwargs):
+    bump_data_version(instance.user_id)
+
+
+# the recipe and its tags and ingredients belong to the same user,
+# so the instance tells whose data changed from either side
+def recipe_relation_changed(sender, instance, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        bump_data_version(instance.user_id)
+
+
+m2m_changed.connect(recipe_relation_changed, sender=Recipe.tags.through)
+m2m_changed.connect(recipe_relation_changed,
+                    sender=Recipe.ingredients.through)
+
+
+@receiver(recipes_bulk_changed)
+def recipes_bulk_written(sender, user_id, **kwargs):
+    bump_data_version(user_id)
@@ -0,0 +1,68 @@
+from django.utils.translation import gettext as _
+from rest_framework.exceptions import ValidationError
+
+
+# ?fields=id,title limits a response to the listed fields. The same list
+# limits the columns selected from the database, and relations that are
+# not listed are not loaded at all.
+
+class SparseFieldsSerializerMixin:
+    """Serializer that can be limited to a subset of its fields"""
+
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+
+class SparseFieldsViewMixin:
+    """Pass the fields requested with ?fields= to the serializer"""
+
+    fields_query_param = 'fields'
+    # write actions always answer with the full representation
+    sparse_actions = ('list', 'retrieve')
+
+    def get_requested_fields(self):
+        """return the requested field names, or None for all of them"""
+        if self.action not in self.sparse_actions:
+            return None
+        value = self.request.query_params.get(self.fields_query_param)
+        if not value:
+            return None
+
+        names = [name.strip() for name in value.split(',') if name.strip()]
+        available = self.get_serializer_class().Meta.fields
+        unknown = sorted(set(names) - set(available))
+        if unknown:
+            msg = _('Unknown fields: {names}').format(names=', '.join(unknown))
+            raise ValidationError({self.fields_query_param: [msg]})
+        return names
+
+    def get_serializer(self, *args, **kwargs):
+        fields = self.get_requested_fields()
+        if fields is not None:
+            kwargs.setdefault('fields', fields)
+        return super().get_serializer(*args, **kwargs)
+
+    # fields read by the view whatever the requested fields:
+    # the ordering keys for pagination cursors and updated_at for
+    # conditional requests
+    def get_loaded_keys(self):
+        keys = [key.lstrip('-') for key in self.get_ordering()]
+        return keys + ['updated_at']
+
+    def only_requested_columns(self, queryset):
+        """select only the columns of the requested fields"""
+        fields = self.get_requested_fields()
+        if fields is None:
+            return queryset
+        # a field may read a model field of another name, like image_urls
+        serializer_fields = self.get_serializer_class()().fields
+        sources = [serializer_fields[name].source.split('.')[0]
+                   for name in fields]
+        opts = queryset.model._meta
+        concrete = {field.name for field in opts.concrete_fields}
+        columns = [name for name in sources + self.get_loaded_keys()
+                   if name in concrete]
+        return queryset.only(opts.pk.name, *columns)
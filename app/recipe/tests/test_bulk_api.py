@@ -0,0 +1,257 @@
+from decimal import Decimal
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+from core import stats
+from core.models import Recipe, RecipeStats, Tag, Ingredient
+
+BULK_URL = reverse('recipe:recipe-bulk')
+RECIPES_URL = reverse('recipe:recipe-list')
+
+
+def sample_recipe(user, **kwargs):
+    defaults = {
+        'title': 'Sample recipe',
+        'time_miniutes': 10,
+        'price': 5.00
+    }
+    defaults.update(kwargs)
+    return Recipe.objects.create(user=user, **defaults)
+
+
+class BulkRecipeApiTests(TestCase):
+    """Test creating, updating and deleting recipes in bulk"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'test@test.com',
+            'testpass'
+        )
+        self.client.force_authenticate(self.user)
+        self.tag = Tag.objects.create(user=self.user, name='Vegan')
+        self.ingredient = Ingredient.objects.create(user=self.user,
+                                                    name='Tofu')
+
+    def test_bulk_create(self):
+        payload = [
+            {'title': f'recipe {i}', 'time_miniutes': i, 'price': '1.50',
+             'tags': [self.tag.id], 'ingredients': [self.ingredient.id]}
+            for i in range(20)
+        ]
+
+        res = self.client.post(BULK_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual([r['title'] for r in res.data],
+                         [item['title'] for item in payload])
+        self.assertEqual(Recipe.objects.filter(user=self.user).count(), 20)
+        self.assertEqual(self.tag.recipe_set.count(), 20)
+        self.assertEqual(self.ingredient.recipe_set.count(), 20)
+        self.assertEqual(res.data[0]['tags'], [self.tag.id])
+
+    # the number of queries does not depend on the number of recipes
+    def test_bulk_create_queries_constant(self):
+        tags = [Tag.objects.create(user=self.user, name=f'tag {i}')
+                for i in range(50)]
+        ingredients = [
+            Ingredient.objects.create(user=self.user, name=f'ing {i}')
+            for i in range(50)
+        ]
+
+        def payload(count):
+            return [{'title': f'recipe {i}', 'time_miniutes': i,
+                     'price': '1.50', 'tags': [tags[i].id, self.tag.id],
+                     'ingredients': [ingredients[i].id]}
+                    for i in range(count)]
+
+        with CaptureQueriesContext(connection) as small:
+            self.client.post(BULK_URL, payload(2), format='json')
+        with self.assertNumQueries(len(small.captured_queries)):
+            res = self.client.post(BULK_URL, payload(50), format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+
+    def test_bulk_update_queries_constant(self):
+        recipes = [sample_recipe(self.user) for i in range(50)]
+        for recipe in recipes:
+            recipe.tags.add(self.tag)
+            recipe.ingredients.add(self.ingredient)
+
+        def payload(count):
+            return [{'id': recipe.id, 'tags': [self.tag.id],
+                     'ingredients': [self.ingredient.id]}
+                    for recipe in recipes[:count]]
+
+        with CaptureQueriesContext(connection) as small:
+            self.client.patch(BULK_URL, payload(2), format='json')
+        with self.assertNumQueries(len(small.captured_queries)):
+            res = self.client.patch(BULK_URL, payload(50), format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+    def test_bulk_create_missing_tag(self):
+        payload = [{'title': 'x', 'time_miniutes': 5, 'price': '1.00',
+                    'tags': [self.tag.id, self.tag.id + 100],
+                    'ingredients': []}]
+
+        res = self.client.post(BULK_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('tags', res.data['errors'][0])
+
+    def test_bulk_create_searchable(self):
+        payload = [{'title': 'Banana bread', 'time_miniutes': 5,
+                    'price': '1.00', 'tags': [self.tag.id],
+                    'ingredients': []}]
+        self.client.post(BULK_URL, payload, format='json')
+
+        res = self.client.get(RECIPES_URL, {'search': 'vegan bread'})
+
+        self.assertEqual(len(res.data['results']), 1)
+
+    def test_bulk_create_invalid_item(self):
+        payload = [
+            {'title': 'good', 'time_miniutes': 5, 'price': '1.00',
+             'tags': [], 'ingredients': []},
+            {'title': '', 'time_miniutes': 5, 'price': '1.00',
+             'tags': [], 'ingredients': []},
+        ]
+
+        res = self.client.post(BULK_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(res.data['errors'][0], {})
+        self.assertIn('title', res.data['errors'][1])
+        self.assertFalse(Recipe.objects.exists())
+
+    def test_bulk_update(self):
+        recipe1 = sample_recipe(self.user, title='one')
+        recipe2 = sample_recipe(self.user, title='two')
+        recipe2.tags.add(self.tag)
+
+        payload = [
+            {'id': recipe1.id, 'price': '7.00', 'tags': [self.tag.id]},
+            {'id': recipe2.id, 'title': 'deux', 'tags': []},
+        ]
+        res = self.client.patch(BULK_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        recipe1.refresh_from_db()
+        recipe2.refresh_from_db()
+        self.assertEqual(str(recipe1.price), '7.00')
+        self.assertEqual(recipe1.title, 'one')
+        self.assertEqual(list(recipe1.tags.all()), [self.tag])
+        self.assertEqual(recipe2.title, 'deux')
+        self.assertEqual(recipe2.tags.count(), 0)
+
+    # the statistics change by the difference instead of being rebuilt
+    def test_bulk_update_stats(self):
+        cheap = sample_recipe(self.user, price=1.00)
+        dear = sample_recipe(self.user, price=9.00, time_miniutes=50)
+        cheap.tags.add(self.tag)
+        quick = Tag.objects.create(user=self.user, name='Quick')
+        stats.get_stats(self.user.pk)
+
+        payload = [
+            {'id': cheap.id, 'price': '4.00', 'time_miniutes': 95,
+             'tags': [quick.id, self.tag.id]},
+            {'id': dear.id, 'price': '3.00', 'tags': [],
+             'ingredients': [self.ingredient.id]},
+        ]
+        with patch('core.stats.build_stats') as build_stats:
+            res = self.client.patch(BULK_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        build_stats.assert_not_called()
+        self.assertEqual(stats.stats_drift(self.user.pk), [])
+        summary = RecipeStats.objects.get(user=self.user)
+        self.assertEqual(summary.price_max, Decimal('4.00'))
+
+    def test_bulk_update_other_user_not_found(self):
+        other = get_user_model().objects.create_user(
+            'other@test.com',
+            'testpass'
+        )
+        recipe = sample_recipe(other, title='theirs')
+
+        res = self.client.patch(BULK_URL, [{'id': recipe.id, 'title': 'x'}],
+                                format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('id', res.data['errors'][0])
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.title, 'theirs')
+
+    def test_bulk_update_invalid_ids(self):
+        recipe = sample_recipe(self.user)
+
+        res = self.client.patch(BULK_URL, [
+            {'id': [recipe.id], 'title': 'x'},
+            {'id': True, 'title': 'x'},
+            {'id': {'pk': recipe.id}, 'title': 'x'},
+            [recipe.id],
+        ], format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(res.data['errors'],
+                         [{'id': ['Not found.']}] * 4)
+
+    def test_bulk_update_duplicate_ids(self):
+        recipe = sample_recipe(self.user, title='one')
+
+        res = self.client.patch(BULK_URL, [
+            {'id': recipe.id, 'title': 'two'},
+            {'id': recipe.id, 'title': 'three'},
+        ], format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(res.data['errors'],
+                         [{'id': ['Duplicate id.']}] * 2)
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.title, 'one')
+
+    def test_bulk_delete(self):
+        recipe1 = sample_recipe(self.user)
+        recipe2 = sample_recipe(self.user)
+        kept = sample_recipe(self.user)
+
+        res = self.client.delete(BULK_URL, [recipe1.id, recipe2.id],
+                                 format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(list(Recipe.objects.all()), [kept])
+
+    def test_bulk_delete_missing_id(self):
+        recipe = sample_recipe(self.user)
+
+        res = self.client.delete(BULK_URL, [recipe.id, recipe.id + 100],
+                                 format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(res.data['errors'][0], {})
+        self.assertTrue(Recipe.objects.filter(id=recipe.id).exists())
+
+    def test_bulk_delete_invalid_ids(self):
+        recipe = sample_recipe(self.user)
+
+        res = self.client.delete(BULK_URL, [recipe.id, {'id': recipe.id},
+                                            [recipe.id], None],
+                                 format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(res.data['errors'],
+                         [{}] + [{'id': ['Not found.']}] * 3)
+        self.assertTrue(Recipe.objects.filter(id=recipe.id).exists())
+
+    def test_bulk_not_a_list(self):
+        res = self.client.post(BULK_URL, {'title': 'x'}, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
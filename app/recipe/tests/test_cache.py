@@ -0,0 +1,139 @@
+import time
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.conf import settings
+from django.db import transaction
+from django.test import TransactionTestCase, override_settings
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+from core.models import Recipe, Tag
+from recipe.cache import get_data_version
+
+TAGS_URL = reverse('recipe:tag-list')
+RECIPES_URL = reverse('recipe:recipe-list')
+
+
+def detail_url(recipe_id):
+    return reverse('recipe:recipe-detail', args=[recipe_id])
+
+
+# data versions are bumped when the writes commit
+class ResponseCacheTests(TransactionTestCase):
+    """Test the per user cache of list responses"""
+
+    def setUp(self):
+        caches[settings.RECIPE_CACHE].clear()
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'test@test.com',
+            'testpass'
+        )
+        self.client.force_authenticate(self.user)
+        self.recipe = Recipe.objects.create(user=self.user, title='Soup',
+                                            time_miniutes=5, price=5.00)
+
+    # a repeated read does not touch the database
+    def test_repeat_list_served_from_cache(self):
+        res1 = self.client.get(RECIPES_URL)
+
+        with self.assertNumQueries(0):
+            res2 = self.client.get(RECIPES_URL)
+
+        self.assertEqual(res2.status_code, status.HTTP_200_OK)
+        self.assertEqual(res1.data, res2.data)
+
+    def test_query_params_order_ignored(self):
+        self.client.get(TAGS_URL, {'page_size': 5, 'assigned_only': 1})
+
+        with self.assertNumQueries(0):
+            self.client.get(f'{TAGS_URL}?assigned_only=1&page_size=5')
+
+    def test_update_invalidates(self):
+        self.client.get(RECIPES_URL)
+
+        self.client.patch(detail_url(self.recipe.id), {'title': 'Stew'})
+        res = self.client.get(RECIPES_URL)
+
+        self.assertEqual(res.data['results'][0]['title'], 'Stew')
+
+    def test_create_and_delete_invalidate(self):
+        self.client.get(TAGS_URL)
+
+        self.client.post(TAGS_URL, {'name': 'Vegan'})
+        res = self.client.get(TAGS_URL)
+        self.assertEqual(len(res.data['results']), 1)
+
+        self.client.delete(
+            reverse('recipe:tag-detail', args=[res.data['results'][0]['id']])
+        )
+        res = self.client.get(TAGS_URL)
+        self.assertEqual(len(res.data['results']), 0)
+
+    def test_m2m_change_invalidates(self):
+        tag = Tag.objects.create(user=self.user, name='Vegan')
+        self.client.get(RECIPES_URL)
+
+        self.recipe.tags.add(tag)
+        res = self.client.get(RECIPES_URL)
+
+        self.assertEqual(res.data['results'][0]['tags'], [tag.id])
+
+    # writes of one user keep the cache of the others
+    def test_other_user_cache_kept(self):
+        other = get_user_model().objects.create_user(
+            'other@test.com',
+            'testpass'
+        )
+        self.client.get(RECIPES_URL)
+
+        Recipe.objects.create(user=other, title='Stew',
+                              time_miniutes=5, price=5.00)
+
+        with self.assertNumQueries(0):
+            self.client.get(RECIPES_URL)
+
+    # a read during the write transaction must not cache the old data
+    # under the new version
+    def test_version_bumped_on_commit(self):
+        version = get_data_version(self.user.pk)
+
+        with transaction.atomic():
+            self.recipe.tags.add(Tag.objects.create(user=self.user,
+                                                    name='Vegan'))
+            self.assertEqual(get_data_version(self.user.pk), version)
+
+        self.assertGreater(get_data_version(self.user.pk), version)
+
+    def test_version_kept_on_rollback(self):
+        version = get_data_version(self.user.pk)
+
+        with self.assertRaises(ValueError), transaction.atomic():
+            Tag.objects.create(user=self.user, name='Vegan')
+            raise ValueError()
+
+        self.assertEqual(get_data_version(self.user.pk), version)
+
+    # writes of processes that do not share the cache are seen once
+    # the version expires
+    def test_version_expires(self):
+        now = time.time()
+        with patch('time.time', return_value=now):
+            version = get_data_version(self.user.pk)
+
+        later = now + settings.RECIPE_CACHE_VERSION_TIMEOUT + 1
+        with patch('time.time', return_value=later):
+            self.assertGreater(get_data_version(self.user.pk), version)
+
+    # other processes would not see the bumps of a per process cache
+    @override_settings(RECIPE_CACHE_SINGLE_PROCESS=False)
+    def test_local_cache_not_used_by_several_processes(self):
+        self.client.get(RECIPES_URL)
+
+        with self.assertNumQueries(3):
+            res = self.client.get(RECIPES_URL)
+
+        self.assertNotIn('ETag', res)
@@ -0,0 +1,92 @@
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.conf import settings
+from django.test import TransactionTestCase
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+from core.models import Recipe, Tag
+
+RECIPES_URL = reverse('recipe:recipe-list')
+
+
+def detail_url(recipe_id):
+    return reverse('recipe:recipe-detail', args=[recipe_id])
+
+
+# data versions are bumped when the writes commit
+class ConditionalGetTests(TransactionTestCase):
+    """Test ETag and Last-Modified handling of the recipe endpoints"""
+
+    def setUp(self):
+        caches[settings.RECIPE_CACHE].clear()
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'test@test.com',
+            'testpass'
+        )
+        self.client.force_authenticate(self.user)
+        self.recipe = Recipe.objects.create(user=self.user, title='Soup',
+                                            time_miniutes=5, price=5.00)
+        self.tag = Tag.objects.create(user=self.user, name='Vegan')
+        self.recipe.tags.add(self.tag)
+
+    def test_list_not_modified(self):
+        res = self.client.get(RECIPES_URL)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+        with self.assertNumQueries(0):
+            res = self.client.get(RECIPES_URL,
+                                  HTTP_IF_NONE_MATCH=res['ETag'])
+
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_list_if_modified_since(self):
+        res = self.client.get(RECIPES_URL)
+
+        res = self.client.get(RECIPES_URL,
+                              HTTP_IF_MODIFIED_SINCE=res['Last-Modified'])
+
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_list_modified_after_delete(self):
+        res = self.client.get(RECIPES_URL)
+
+        self.recipe.delete()
+        res = self.client.get(RECIPES_URL, HTTP_IF_NONE_MATCH=res['ETag'])
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['results'], [])
+
+    # the conditional check only fetches the recipe row
+    def test_detail_not_modified(self):
+        res = self.client.get(detail_url(self.recipe.id))
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+        with self.assertNumQueries(1):
+            res = self.client.get(detail_url(self.recipe.id),
+                                  HTTP_IF_NONE_MATCH=res['ETag'])
+
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_detail_modified_by_relation_change(self):
+        res = self.client.get(detail_url(self.recipe.id))
+
+        self.recipe.tags.remove(self.tag)
+        res = self.client.get(detail_url(self.recipe.id),
+                              HTTP_IF_NONE_MATCH=res['ETag'])
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['tags'], [])
+
+    def test_detail_modified_by_tag_rename(self):
+        res = self.client.get(detail_url(self.recipe.id))
+
+        self.tag.name = 'Vegetarian'
+        self.tag.save()
+        res = self.client.get(detail_url(self.recipe.id),
+                              HTTP_IF_NONE_MATCH=res['ETag'])
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['tags'][0]['name'], 'Vegetarian')
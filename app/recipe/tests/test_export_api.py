@@ -0,0 +1,97 @@
+import json
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+from core.models import Ingredient, Recipe, Tag
+from recipe.serializers import RecipeDetailSerializer
+from recipe.views import RecipeViewSet
+
+EXPORT_URL = reverse('recipe:recipe-export')
+
+
+class RecipeExportTests(TestCase):
+    """Test the streaming export of recipes"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'test@test.com',
+            'testpass'
+        )
+        self.client.force_authenticate(self.user)
+
+        self.tag = Tag.objects.create(user=self.user, name='Vegan')
+        self.ingredient = Ingredient.objects.create(user=self.user,
+                                                    name='Kale')
+        self.recipes = []
+        for index in range(5):
+            recipe = Recipe.objects.create(user=self.user,
+                                           title=f'Recipe {index}',
+                                           time_miniutes=index, price=1.5)
+            recipe.tags.add(self.tag)
+            if index % 2:
+                recipe.ingredients.add(self.ingredient)
+            self.recipes.append(recipe)
+
+    def export(self, params=None):
+        res = self.client.get(EXPORT_URL, params)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertTrue(res.streaming)
+        return b''.join(res.streaming_content).decode('utf-8')
+
+    def test_export_ndjson_matches_detail_serializer(self):
+        lines = self.export().splitlines()
+
+        expected = [RecipeDetailSerializer(recipe).data
+                    for recipe in reversed(self.recipes)]
+        self.assertEqual([json.loads(line) for line in lines],
+                         json.loads(json.dumps(expected)))
+
+    def test_export_json_array(self):
+        data = json.loads(self.export({'as': 'json'}))
+
+        self.assertEqual(len(data), 5)
+        self.assertEqual(data[0]['tags'],
+                         [{'id': self.tag.id, 'name': 'Vegan'}])
+
+    def test_export_empty(self):
+        Recipe.objects.all().delete()
+
+        self.assertEqual(self.export(), '')
+        self.assertEqual(json.loads(self.export({'as': 'json'})), [])
+
+    def test_export_unknown_format(self):
+        res = self.client.get(EXPORT_URL, {'as': 'xml'})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_export_limited_to_user_and_filters(self):
+        other = get_user_model().objects.create_user('other@test.com',
+                                                     'testpass')
+        Recipe.objects.create(user=other, title='Other', time_miniutes=1,
+                              price=1)
+
+        lines = self.export({'ingredients': self.ingredient.id})
+
+        self.assertEqual(len(lines.splitlines()), 2)
+
+    # relations are loaded once per chunk, not once per recipe
+    def test_export_queries_per_chunk(self):
+        with patch.object(RecipeViewSet, 'export_chunk_size', 2):
+            res = self.client.get(EXPORT_URL)
+
+        # three chunks of recipes, each with a query per relation
+        with self.assertNumQueries(3 * 2 + 1):
+            lines = b''.join(res.streaming_content).splitlines()
+
+        self.assertEqual(len(lines), 5)
+
+    def test_export_requires_authentication(self):
+        res = APIClient().get(EXPORT_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
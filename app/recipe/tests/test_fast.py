@@ -0,0 +1,100 @@
+from decimal import Decimal
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.conf import settings
+from django.test import TestCase
+from django.urls import reverse
+
+from rest_framework.test import APIClient
+from core.models import Ingredient, Recipe, Tag
+from recipe import serializers
+from recipe.fast import FastRepresentation, Unsupported
+from recipe.views import IngredientViewSet, RecipeViewSet, TagViewSet
+
+TAGS_URL = reverse('recipe:tag-list')
+INGREDIENTS_URL = reverse('recipe:ingredient-list')
+RECIPES_URL = reverse('recipe:recipe-list')
+
+
+class FastListTests(TestCase):
+    """Test that fast lists render exactly like the serializers"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'test@test.com',
+            'testpass'
+        )
+        self.client.force_authenticate(self.user)
+
+        tags = [Tag.objects.create(user=self.user, name=name)
+                for name in ('Vegan', 'Dessert', 'Quick')]
+        ingredients = [Ingredient.objects.create(user=self.user, name=name)
+                       for name in ('Salt', 'Kale', 'Apple')]
+        prices = (Decimal('5.5'), Decimal('10'), Decimal('0.05'))
+        for index, price in enumerate(prices):
+            recipe = Recipe.objects.create(
+                user=self.user, title=f'Kale dish {index}',
+                time_miniutes=index * 10, price=price,
+                link='' if index else 'https://example.com/kale',
+            )
+            # relations added out of id order
+            recipe.tags.add(*reversed(tags[index:]))
+            recipe.ingredients.add(*reversed(ingredients[:index + 1]))
+
+    def get_both(self, view, url, params=None):
+        """return the fast and the serializer list responses"""
+        caches[settings.RECIPE_CACHE].clear()
+        fast = self.client.get(url, params)
+        caches[settings.RECIPE_CACHE].clear()
+        with patch.object(view, 'fast_list', False):
+            slow = self.client.get(url, params)
+        return fast, slow
+
+    def assertSameContent(self, view, url, params=None):
+        fast, slow = self.get_both(view, url, params)
+        self.assertEqual(fast.status_code, slow.status_code)
+        self.assertEqual(fast.content, slow.content)
+        return fast
+
+    def test_recipes_match_serializer(self):
+        res = self.assertSameContent(RecipeViewSet, RECIPES_URL)
+
+        self.assertEqual(len(res.data['results']), 3)
+        self.assertEqual(res.data['results'][2]['price'], '5.50')
+
+    def test_tags_and_ingredients_match_serializer(self):
+        self.assertSameContent(TagViewSet, TAGS_URL)
+        self.assertSameContent(IngredientViewSet, INGREDIENTS_URL)
+        self.assertSameContent(TagViewSet, TAGS_URL, {'assigned_only': 1})
+
+    def test_pages_match_serializer(self):
+        first = self.assertSameContent(RecipeViewSet, RECIPES_URL,
+                                       {'page_size': 2})
+
+        self.assertSameContent(RecipeViewSet, first.data['next'])
+
+    def test_search_and_filters_match_serializer(self):
+        tag = Tag.objects.get(name='Quick')
+        self.assertSameContent(RecipeViewSet, RECIPES_URL,
+                               {'search': 'kale', 'page_size': 1})
+        self.assertSameContent(RecipeViewSet, RECIPES_URL,
+                               {'tags': tag.id})
+
+    def test_sparse_fields_match_serializer(self):
+        self.assertSameContent(RecipeViewSet, RECIPES_URL,
+                               {'fields': 'price,tags'})
+        self.assertSameContent(TagViewSet, TAGS_URL, {'fields': 'name'})
+
+    # the detail serializer nests objects and is never used for lists
+    def test_nested_serializer_not_compiled(self):
+        detail = serializers.RecipeDetailSerializer()
+
+        self.assertIsNone(FastRepresentation.compile(detail))
+        with self.assertRaises(Unsupported):
+            FastRepresentation(detail)
+        self.assertIsNotNone(
+            FastRepresentation.compile(serializers.RecipeSerializer())
+        )
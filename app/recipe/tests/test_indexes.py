@@ -0,0 +1,114 @@
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+from core.models import Ingredient, Recipe, Tag
+
+TAGS_URL = reverse('recipe:tag-list')
+INGREDIENTS_URL = reverse('recipe:ingredient-list')
+RECIPES_URL = reverse('recipe:recipe-list')
+
+# enough rows per user that sorting them costs more than
+# reading them in order from an index
+USERS = 20
+ROWS_PER_USER = 1000
+
+
+class IndexUsageTests(TestCase):
+    """Test that the list queries are answered from the indexes"""
+
+    @classmethod
+    def setUpTestData(cls):
+        users = [
+            get_user_model().objects.create_user(f'user{index}@test.com')
+            for index in range(USERS)
+        ]
+        cls.user = users[0]
+        for model in (Tag, Ingredient):
+            model.objects.bulk_create([
+                model(user=user, name=f'name {index}')
+                for user in users for index in range(ROWS_PER_USER)
+            ])
+        Recipe.objects.bulk_create([
+            Recipe(user=user, title=f'Recipe {index}',
+                   time_miniutes=index % 180, price=index % 500)
+            for user in users for index in range(ROWS_PER_USER)
+        ])
+        through = Recipe.tags.through
+        tags = Tag.objects.order_by('id').values_list('id', flat=True)
+        recipes = Recipe.objects.order_by('id').values_list('id', flat=True)
+        through.objects.bulk_create([
+            through(recipe_id=recipe_id, tag_id=tag_id)
+            for recipe_id, tag_id in zip(recipes, tags)
+        ])
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def explain(self, url, params=None):
+        """return the plans of the queries run by a GET request"""
+        with CaptureQueriesContext(connection) as queries:
+            res = self.client.get(url, params)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+        plans = []
+        with connection.cursor() as cursor:
+            for query in queries.captured_queries:
+                cursor.execute(f'EXPLAIN {query["sql"]}')
+                plans.append('\n'.join(row[0] for row in cursor.fetchall()))
+        return plans
+
+    def assertIndexUsed(self, index, plans):
+        self.assertTrue(any(index in plan for plan in plans),
+                        f'{index} not used by:\n' + '\n\n'.join(plans))
+
+    def test_tags_list_uses_user_name_index(self):
+        plans = self.explain(TAGS_URL)
+
+        self.assertIndexUsed('core_tag_user_name_idx', plans)
+        # rows come out of the index in list order
+        self.assertNotIn('Sort', plans[0])
+
+    def test_ingredients_list_uses_user_name_index(self):
+        plans = self.explain(INGREDIENTS_URL)
+
+        self.assertIndexUsed('core_ingredient_user_name_idx', plans)
+        self.assertNotIn('Sort', plans[0])
+
+    def test_recipes_list_uses_user_id_index(self):
+        plans = self.explain(RECIPES_URL)
+
+        self.assertIndexUsed('core_recipe_user_id_idx', plans)
+        self.assertNotIn('Sort', plans[0])
+
+    def test_tag_filter_uses_reverse_through_index(self):
+        tag = Tag.objects.filter(user=self.user).first()
+
+        plans = self.explain(RECIPES_URL, {'tags': tag.id})
+
+        self.assertIndexUsed('core_recipe_tags_tag_recipe_idx', plans)
+
+    def test_recipes_ordering_uses_indexes(self):
+        plans = self.explain(RECIPES_URL, {'ordering': '-price'})
+
+        self.assertIndexUsed('core_recipe_user_price_idx', plans)
+        self.assertNotIn('Sort', plans[0])
+
+        plans = self.explain(RECIPES_URL, {'ordering': 'time_miniutes'})
+
+        self.assertIndexUsed('core_recipe_user_time_idx', plans)
+        self.assertNotIn('Sort', plans[0])
+
+    def test_price_range_uses_index(self):
+        plans = self.explain(RECIPES_URL, {'ordering': 'price',
+                                           'price_min': 10,
+                                           'price_max': 20})
+
+        self.assertIndexUsed('core_recipe_user_price_idx', plans)
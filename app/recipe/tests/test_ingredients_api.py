@@ -45,7 +45,7 @@ class PrivateIngredientsApiTest(TestCase):
         serializer = IngredientSerializer(ingredients, many=True)
 
         self.assertEqual(res.status_code, status.HTTP_200_OK)
-        self.assertEqual(res.data, serializer.data)
+        self.assertEqual(res.data['results'], serializer.data)
 
     # test if ingredients returned are limited to the auth user
     def test_ingredients_limited_to_user(self):
@@ -60,8 +60,8 @@ class PrivateIngredientsApiTest(TestCase):
         res = self.client.get(INGREDIENT_URL)
 
         self.assertEqual(res.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(res.data), 1)
-        self.assertEqual(res.data[0]['name'], ingred.name)
+        self.assertEqual(len(res.data['results']), 1)
+        self.assertEqual(res.data['results'][0]['name'], ingred.name)
 
     # test ingredient creation api
     def test_create_ingredient_successful(self):
@@ -100,5 +100,17 @@ class PrivateIngredientsApiTest(TestCase):
         serializer1 = IngredientSerializer(ingredient1)
         serializer2 = IngredientSerializer(ingredient2)
 
-        self.assertIn(serializer1.data, res.data)
-        self.assertNotIn(serializer2.data, res.data)
+        self.assertIn(serializer1.data, res.data['results'])
+        self.assertNotIn(serializer2.data, res.data['results'])
+
+    def test_retrieve_ingredient_with_counts(self):
+        ingredient = Ingredient.objects.create(user=self.user, name='Salt')
+        recipe = Recipe.objects.create(title='Soup', time_miniutes=5,
+                                       price=3.00, user=self.user)
+        recipe.ingredients.add(ingredient)
+
+        res = self.client.get(INGREDIENT_URL, {'with_counts': 1})
+
+        self.assertEqual(res.data['results'][0]['recipe_count'], 1)
+        res = self.client.get(INGREDIENT_URL)
+        self.assertNotIn('recipe_count', res.data['results'][0])
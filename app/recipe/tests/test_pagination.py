@@ -0,0 +1,104 @@
+import base64
+import json
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+from core.models import Recipe, Tag
+
+TAGS_URL = reverse('recipe:tag-list')
+RECIPES_URL = reverse('recipe:recipe-list')
+
+
+class KeysetPaginationTests(TestCase):
+    """Test cursor pagination of the list endpoints"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'test@test.com',
+            'testpass'
+        )
+        self.client.force_authenticate(self.user)
+
+    # follow the next links and collect the ids of every page
+    def walk(self, url, page_size):
+        ids = []
+        res = self.client.get(url, {'page_size': page_size})
+        while True:
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+            self.assertLessEqual(len(res.data['results']), page_size)
+            ids.extend(item['id'] for item in res.data['results'])
+            if res.data['next'] is None:
+                return ids
+            res = self.client.get(res.data['next'])
+
+    def test_recipes_pages_cover_all_rows(self):
+        for i in range(7):
+            Recipe.objects.create(user=self.user, title=f'recipe {i}',
+                                  time_miniutes=5, price=5.00)
+
+        ids = self.walk(RECIPES_URL, 3)
+
+        expected = Recipe.objects.order_by('-id').values_list('id', flat=True)
+        self.assertEqual(ids, list(expected))
+
+    # tags with the same name are told apart by their id
+    def test_tags_pages_with_duplicate_names(self):
+        for name in ['Vegan', 'Vegan', 'Vegan', 'Dessert', 'Dessert']:
+            Tag.objects.create(user=self.user, name=name)
+
+        ids = self.walk(TAGS_URL, 2)
+
+        expected = Tag.objects.order_by('-name', '-id')
+        self.assertEqual(ids, [tag.id for tag in expected])
+
+    # a page is a single query: no COUNT(*) and no OFFSET
+    def test_page_runs_single_query(self):
+        for i in range(5):
+            Tag.objects.create(user=self.user, name=f'tag {i}')
+        res = self.client.get(TAGS_URL, {'page_size': 2})
+
+        with self.assertNumQueries(1) as ctx:
+            self.client.get(res.data['next'])
+
+        sql = ctx.captured_queries[0]['sql']
+        self.assertNotIn('COUNT', sql)
+        self.assertNotIn('OFFSET', sql)
+
+    def test_invalid_cursor(self):
+        res = self.client.get(TAGS_URL, {'cursor': 'garbage'})
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    # well formed cursors with values of the wrong type
+    def test_cursor_values_of_wrong_type(self):
+        def cursor(values):
+            data = json.dumps(values).encode('ascii')
+            return base64.urlsafe_b64encode(data).decode('ascii')
+
+        for url, values in [(RECIPES_URL, ['abc']),
+                            (RECIPES_URL, [None]),
+                            (RECIPES_URL, [[1]]),
+                            (TAGS_URL, ['Vegan', {'id': 1}]),
+                            (TAGS_URL, ['Vegan', '1.5'])]:
+            res = self.client.get(url, {'cursor': cursor(values)})
+
+            self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND,
+                             values)
+
+    # ids may come back as strings, they are converted
+    def test_cursor_values_converted(self):
+        tag = Tag.objects.create(user=self.user, name='Vegan')
+        Tag.objects.create(user=self.user, name='Vegan')
+        data = json.dumps(['Vegan', str(tag.id + 1)]).encode('ascii')
+
+        res = self.client.get(TAGS_URL, {
+            'cursor': base64.urlsafe_b64encode(data).decode('ascii')
+        })
+
+        self.assertEqual([item['id'] for item in res.data['results']],
+                         [tag.id])
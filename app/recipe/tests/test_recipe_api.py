@@ -1,16 +1,22 @@
 from django.contrib.auth import get_user_model
-from django.test import TestCase
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, \
+    override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 
 from rest_framework import status
 from rest_framework.test import APIClient
 from core.models import Recipe, Ingredient, Tag
 from recipe.serializers import RecipeSerializer, RecipeDetailSerializer
+from recipe.views import RecipeViewSet
+from recipe.budget import QueryBudgetExceeded
 
 # for image upload tests
 import tempfile
 import os
 from PIL import Image
+from unittest.mock import patch
 
 
 # recipies API for GET/POST list
@@ -97,7 +103,7 @@ class PrivateRecipeApiTest(TestCase):
         # print(serializer.data)
 
         self.assertEqual(res.status_code, status.HTTP_200_OK)
-        self.assertEqual(res.data, serializer.data)
+        self.assertEqual(res.data['results'], serializer.data)
 
     def test_recipes_limited_to_user(self):
         user2 = get_user_model().objects.create_user(
@@ -113,8 +119,8 @@ class PrivateRecipeApiTest(TestCase):
         serializer = RecipeSerializer(recipes, many=True)
 
         self.assertEqual(res.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(res.data), 1)
-        self.assertEqual(res.data, serializer.data)
+        self.assertEqual(len(res.data['results']), 1)
+        self.assertEqual(res.data['results'], serializer.data)
 
     def test_view_recipe_detail(self):
         recipe = sample_recipe(user=self.user)
@@ -273,6 +279,33 @@ class RecipeImageUploadTest(TestCase):
         self.assertIn('image', res.data)
         self.assertTrue(os.path.exists(self.recipe.image.path))
 
+    # derivatives are generated after the commit, null until then
+    @patch('core.images.schedule')
+    def test_upload_image_schedules_derivatives(self, schedule):
+        with tempfile.NamedTemporaryFile(suffix='.jpg') as ntf:
+            Image.new('RGB', (10, 10)).save(ntf, format='JPEG')
+            ntf.seek(0)
+            res = self.client.post(image_upload_url(self.recipe.id),
+                                   {'image': ntf}, format='multipart')
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['image_urls'],
+                         {'thumbnail': None, 'card': None, 'full': None})
+        self.assertEqual(schedule.call_args[0][0].pk, self.recipe.pk)
+
+    def test_image_urls_listed(self):
+        Recipe.objects.filter(pk=self.recipe.pk).update(
+            image_derivatives={'thumbnail': 'derivatives/recipe/a/t.jpg'}
+        )
+
+        res = self.client.get(RECIPES_URL)
+
+        self.assertEqual(res.data['results'][0]['image_urls'], {
+            'thumbnail': 'http://testserver/media/derivatives/recipe/a/t.jpg',
+            'card': None,
+            'full': None,
+        })
+
     # test image upload bad request
     def test_upload_image_bad_request(self):
         res = self.client.post(image_upload_url(self.recipe.id),
@@ -299,9 +332,9 @@ class RecipeImageUploadTest(TestCase):
         serializer2 = RecipeSerializer(recipe2)
         serializer3 = RecipeSerializer(recipe3)
 
-        self.assertIn(serializer1.data, res.data)
-        self.assertIn(serializer2.data, res.data)
-        self.assertNotIn(serializer3.data, res.data)
+        self.assertIn(serializer1.data, res.data['results'])
+        self.assertIn(serializer2.data, res.data['results'])
+        self.assertNotIn(serializer3.data, res.data['results'])
 
     # test filtering tags and ingredients
     def test_filter_recipes_by_tag_and_ingredient(self):
@@ -323,5 +356,497 @@ class RecipeImageUploadTest(TestCase):
         serializer1 = RecipeSerializer(recipe1)
         serializer2 = RecipeSerializer(recipe2)
 
-        self.assertIn(serializer1.data, res.data)
-        self.assertNotIn(serializer2.data, res.data)
+        self.assertIn(serializer1.data, res.data['results'])
+        self.assertNotIn(serializer2.data, res.data['results'])
+
+
+@override_settings(QUERY_BUDGET_STRICT=True)
+# cached lists are invalidated when the writes commit
+class RecipeQueryBudgetTest(TransactionTestCase):
+    """ Test that the number of queries does not grow with the recipes"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'test@test.com',
+            'testpass'
+        )
+        self.client.force_authenticate(self.user)
+
+    def create_recipes(self, count):
+        for i in range(count):
+            recipe = sample_recipe(user=self.user, title=f'recipe {i}')
+            recipe.tags.add(sample_tag(user=self.user, name=f'tag {i}'))
+            recipe.ingredients.add(
+                sample_ingredient(user=self.user, name=f'ing {i}')
+            )
+
+    def test_list_queries_constant(self):
+        budget = RecipeViewSet.query_budget['list']
+
+        self.create_recipes(1)
+        with self.assertNumQueries(budget):
+            self.client.get(RECIPES_URL)
+
+        self.create_recipes(10)
+        with self.assertNumQueries(budget):
+            res = self.client.get(RECIPES_URL)
+
+        self.assertEqual(len(res.data['results']), 11)
+        for recipe in res.data['results']:
+            self.assertEqual(len(recipe['tags']), 1)
+            self.assertEqual(len(recipe['ingredients']), 1)
+
+    def test_retrieve_queries_constant(self):
+        recipe = sample_recipe(user=self.user)
+        for i in range(10):
+            recipe.tags.add(sample_tag(user=self.user, name=f'tag {i}'))
+            recipe.ingredients.add(
+                sample_ingredient(user=self.user, name=f'ing {i}')
+            )
+
+        with self.assertNumQueries(RecipeViewSet.query_budget['retrieve']):
+            res = self.client.get(detail_url(recipe.id))
+
+        self.assertEqual(res.data, RecipeDetailSerializer(recipe).data)
+
+    def test_budget_exceeded_raises(self):
+        self.create_recipes(2)
+
+        with patch.dict(RecipeViewSet.query_budget, {'list': 1}):
+            with self.assertRaises(QueryBudgetExceeded):
+                self.client.get(RECIPES_URL)
+
+    # an exception DRF does not handle leaves no counter on the connection
+    def test_counter_removed_after_unhandled_exception(self):
+        with patch.object(RecipeViewSet, 'list', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.client.get(RECIPES_URL)
+
+        self.assertEqual(connection.execute_wrappers, [])
+
+
+class RecipeFilterMatchTest(TestCase):
+    """ Test any/all matching of tag and ingredient filters"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'test@test.com',
+            'testpass'
+        )
+        self.client.force_authenticate(self.user)
+        self.vegan = sample_tag(user=self.user, name='Vegan')
+        self.quick = sample_tag(user=self.user, name='Quick')
+        self.both = sample_recipe(user=self.user, title='Vegan and quick')
+        self.both.tags.add(self.vegan, self.quick)
+        self.one = sample_recipe(user=self.user, title='Vegan only')
+        self.one.tags.add(self.vegan)
+        sample_recipe(user=self.user, title='No tags')
+
+    def result_ids(self, res):
+        return [recipe['id'] for recipe in res.data['results']]
+
+    # a recipe matching several ids is returned only once
+    def test_match_any_no_duplicates(self):
+        res = self.client.get(
+            RECIPES_URL,
+            {'tags': f'{self.vegan.id},{self.quick.id}'}
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.result_ids(res), [self.one.id, self.both.id])
+
+    def test_match_all(self):
+        res = self.client.get(
+            RECIPES_URL,
+            {'tags': f'{self.vegan.id},{self.quick.id}', 'match': 'all'}
+        )
+
+        self.assertEqual(self.result_ids(res), [self.both.id])
+
+    # repeated ids count once
+    def test_match_all_repeated_ids(self):
+        res = self.client.get(
+            RECIPES_URL,
+            {'tags': f'{self.vegan.id},{self.vegan.id}', 'match': 'all'}
+        )
+
+        self.assertEqual(self.result_ids(res), [self.one.id, self.both.id])
+
+    def test_match_all_tags_and_ingredients(self):
+        ingredient = sample_ingredient(user=self.user, name='Tofu')
+        self.one.ingredients.add(ingredient)
+
+        res = self.client.get(
+            RECIPES_URL,
+            {'tags': f'{self.vegan.id}',
+             'ingredients': f'{ingredient.id}',
+             'match': 'all'}
+        )
+
+        self.assertEqual(self.result_ids(res), [self.one.id])
+
+    def test_invalid_match(self):
+        res = self.client.get(
+            RECIPES_URL,
+            {'tags': f'{self.vegan.id}', 'match': 'some'}
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_invalid_ids(self):
+        res = self.client.get(RECIPES_URL, {'tags': 'one,two'})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class RecipeSearchTest(TransactionTestCase):
+    """ Test full text search of recipes"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'test@test.com',
+            'testpass'
+        )
+        self.client.force_authenticate(self.user)
+
+    def search(self, text, **params):
+        res = self.client.get(RECIPES_URL, {'search': text, **params})
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        return res
+
+    def result_ids(self, res):
+        return [recipe['id'] for recipe in res.data['results']]
+
+    def test_search_title_tags_and_ingredients(self):
+        curry = sample_recipe(user=self.user, title='Thai curries')
+        salad = sample_recipe(user=self.user, title='Green salad')
+        salad.tags.add(sample_tag(user=self.user, name='Curry friendly'))
+        soup = sample_recipe(user=self.user, title='Soup')
+        soup.ingredients.add(sample_ingredient(user=self.user, name='curry'))
+        sample_recipe(user=self.user, title='Pancakes')
+
+        res = self.search('curry')
+
+        # title matches rank above tag matches, above ingredient matches
+        self.assertEqual(self.result_ids(res), [curry.id, salad.id, soup.id])
+
+    def test_search_follows_renamed_tag(self):
+        recipe = sample_recipe(user=self.user, title='Toast')
+        tag = sample_tag(user=self.user, name='Breakfast')
+        recipe.tags.add(tag)
+        self.assertEqual(self.result_ids(self.search('breakfast')),
+                         [recipe.id])
+
+        tag.name = 'Brunch'
+        tag.save()
+
+        self.assertEqual(self.result_ids(self.search('breakfast')), [])
+        self.assertEqual(self.result_ids(self.search('brunch')), [recipe.id])
+
+    def test_search_follows_removed_ingredient(self):
+        recipe = sample_recipe(user=self.user, title='Toast')
+        ingredient = sample_ingredient(user=self.user, name='Butter')
+        recipe.ingredients.add(ingredient)
+
+        ingredient.delete()
+
+        self.assertEqual(self.result_ids(self.search('butter')), [])
+
+    def test_search_pages(self):
+        for i in range(5):
+            sample_recipe(user=self.user, title=f'Pizza {i}')
+        sample_recipe(user=self.user, title='Pizza pizza')
+
+        res = self.search('pizza', page_size=2)
+        ids = self.result_ids(res)
+        while res.data['next']:
+            res = self.client.get(res.data['next'])
+            ids.extend(self.result_ids(res))
+
+        expected = Recipe.objects.order_by('-id').values_list('id', flat=True)
+        # the recipe mentioning pizza twice ranks first
+        self.assertEqual(ids, list(expected))
+
+
+class RecipeRelationValidationTest(TestCase):
+    """ Test validation of the tag and ingredient ids of a recipe"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'test@test.com',
+            'testpass'
+        )
+        self.client.force_authenticate(self.user)
+
+    def payload(self, **kwargs):
+        payload = {
+            'title': 'Salad',
+            'time_miniutes': 5,
+            'price': '5.00',
+            'tags': [],
+            'ingredients': [],
+        }
+        payload.update(kwargs)
+        return payload
+
+    # all the ids of a relation are resolved by one query
+    def test_ids_resolved_in_one_query(self):
+        few = [sample_ingredient(self.user, name=f'a{i}').id for i in range(2)]
+        many = [sample_ingredient(self.user, name=f'b{i}').id
+                for i in range(30)]
+
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.post(RECIPES_URL, self.payload(ingredients=few),
+                             format='json')
+        with self.assertNumQueries(len(ctx.captured_queries)):
+            res = self.client.post(RECIPES_URL,
+                                   self.payload(ingredients=many),
+                                   format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        recipe = Recipe.objects.get(id=res.data['id'])
+        self.assertEqual(recipe.ingredients.count(), 30)
+
+    def test_missing_ids_reported_together(self):
+        tag = sample_tag(self.user)
+
+        res = self.client.post(
+            RECIPES_URL,
+            self.payload(tags=[tag.id, tag.id + 100, tag.id + 200]),
+            format='json'
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        message = str(res.data['tags'][0])
+        self.assertIn(str(tag.id + 100), message)
+        self.assertIn(str(tag.id + 200), message)
+
+    def test_other_user_ids_rejected(self):
+        other = get_user_model().objects.create_user(
+            'other@test.com',
+            'testpass'
+        )
+        tag = sample_tag(other)
+
+        res = self.client.post(RECIPES_URL, self.payload(tags=[tag.id]),
+                               format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Recipe.objects.exists())
+
+    def test_incorrect_type(self):
+        res = self.client.post(RECIPES_URL, self.payload(tags=['one']),
+                               format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class RecipeSparseFieldsTest(TestCase):
+    """ Test limiting recipe responses with ?fields="""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'test@test.com',
+            'testpass'
+        )
+        self.client.force_authenticate(self.user)
+        self.recipe = sample_recipe(user=self.user, link='http://x.com')
+        self.recipe.tags.add(sample_tag(user=self.user))
+
+    # unrequested columns are not selected and relations not loaded
+    def test_list_fields(self):
+        with self.assertNumQueries(1) as ctx:
+            res = self.client.get(RECIPES_URL, {'fields': 'id,title,price'})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['results'], [{
+            'id': self.recipe.id,
+            'title': self.recipe.title,
+            'price': '5.00',
+        }])
+        sql = ctx.captured_queries[0]['sql']
+        self.assertNotIn('"link"', sql)
+        self.assertNotIn('"image"', sql)
+
+    # image_urls reads the image_derivatives column, it is not loaded
+    # by a query of its own
+    def test_detail_fields_by_source(self):
+        Recipe.objects.filter(pk=self.recipe.pk).update(
+            image_derivatives={'card': 'derivatives/recipe/card.jpg'}
+        )
+        url = detail_url(self.recipe.id)
+        with CaptureQueriesContext(connection) as title:
+            self.client.get(url, {'fields': 'title'})
+
+        with CaptureQueriesContext(connection) as image_urls:
+            res = self.client.get(url, {'fields': 'image_urls'})
+
+        self.assertIn('card.jpg', res.data['image_urls']['card'])
+        self.assertEqual(len(image_urls), len(title))
+
+    def test_list_fields_with_relation(self):
+        with self.assertNumQueries(2):
+            res = self.client.get(RECIPES_URL, {'fields': 'id,tags'})
+
+        self.assertEqual(res.data['results'][0]['tags'],
+                         [tag.id for tag in self.recipe.tags.all()])
+        self.assertNotIn('ingredients', res.data['results'][0])
+
+    def test_detail_fields(self):
+        res = self.client.get(detail_url(self.recipe.id),
+                              {'fields': 'title,tags'})
+
+        self.assertEqual(set(res.data), {'title', 'tags'})
+        self.assertEqual(res.data['tags'][0]['name'], 'main course')
+
+    def test_unknown_field(self):
+        res = self.client.get(RECIPES_URL, {'fields': 'id,secret'})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    # cursors still work when the ordering key is not requested
+    def test_fields_paginated(self):
+        sample_recipe(user=self.user)
+
+        res = self.client.get(RECIPES_URL,
+                              {'fields': 'title', 'page_size': 1})
+        res = self.client.get(res.data['next'])
+
+        self.assertEqual(res.data['results'], [{'title': 'Sample recipe'}])
+
+
+# /api/recipe/recipes/facets/
+FACETS_URL = reverse('recipe:recipe-facets')
+
+
+class RecipeFacetsTest(TestCase):
+    """Test the tag and ingredient counts of the filter sidebar"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'test@test.com',
+            'testpass'
+        )
+        self.client.force_authenticate(self.user)
+
+        self.vegan = sample_tag(self.user, name='Vegan')
+        self.quick = sample_tag(self.user, name='Quick')
+        self.kale = sample_ingredient(self.user, name='Kale')
+
+        self.salad = sample_recipe(self.user, title='Kale salad')
+        self.salad.tags.add(self.vegan, self.quick)
+        self.salad.ingredients.add(self.kale)
+        self.soup = sample_recipe(self.user, title='Tomato soup')
+        self.soup.tags.add(self.vegan)
+        sample_recipe(self.user, title='Plain rice')
+
+    def test_facets_of_all_recipes(self):
+        with self.assertNumQueries(2):
+            res = self.client.get(FACETS_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data, {
+            'count': 3,
+            'tags': [
+                {'id': self.vegan.id, 'name': 'Vegan', 'count': 2},
+                {'id': self.quick.id, 'name': 'Quick', 'count': 1},
+            ],
+            'ingredients': [
+                {'id': self.kale.id, 'name': 'Kale', 'count': 1},
+            ],
+        })
+
+    def test_facets_follow_filters(self):
+        res = self.client.get(FACETS_URL, {'tags': self.quick.id})
+
+        self.assertEqual(res.data['count'], 1)
+        self.assertEqual([tag['count'] for tag in res.data['tags']], [1, 1])
+
+        res = self.client.get(FACETS_URL, {'search': 'soup'})
+
+        self.assertEqual(res.data['count'], 1)
+        self.assertEqual(res.data['tags'],
+                         [{'id': self.vegan.id, 'name': 'Vegan',
+                           'count': 1}])
+        self.assertEqual(res.data['ingredients'], [])
+
+    def test_facets_limited_to_user(self):
+        other = get_user_model().objects.create_user('other@test.com',
+                                                     'testpass')
+        recipe = sample_recipe(other)
+        recipe.tags.add(sample_tag(other, name='Other'))
+
+        res = self.client.get(FACETS_URL)
+
+        self.assertEqual(res.data['count'], 3)
+        self.assertEqual(len(res.data['tags']), 2)
+
+
+class RecipeRangeOrderingTest(TestCase):
+    """Test the price and time filters and the ordering param"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'test@test.com',
+            'testpass'
+        )
+        self.client.force_authenticate(self.user)
+        self.soup = sample_recipe(self.user, title='Soup', price=2.50,
+                                  time_miniutes=10)
+        self.stew = sample_recipe(self.user, title='Stew', price=9.00,
+                                  time_miniutes=90)
+        self.rice = sample_recipe(self.user, title='Rice', price=2.50,
+                                  time_miniutes=20)
+
+    def titles(self, params):
+        res = self.client.get(RECIPES_URL, params)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        return [recipe['title'] for recipe in res.data['results']]
+
+    def test_range_filters(self):
+        self.assertEqual(self.titles({'price_min': '3'}), ['Stew'])
+        self.assertEqual(self.titles({'price_max': '2.50'}),
+                         ['Rice', 'Soup'])
+        self.assertEqual(self.titles({'time_max': 20, 'price_max': 5}),
+                         ['Rice', 'Soup'])
+
+    def test_invalid_range_rejected(self):
+        for params in ({'price_min': 'cheap'}, {'price_max': 'NaN'},
+                       {'time_max': '1.5'}):
+            res = self.client.get(RECIPES_URL, params)
+
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_ordering(self):
+        # equal prices are ordered by id in the same direction
+        self.assertEqual(self.titles({'ordering': 'price'}),
+                         ['Soup', 'Rice', 'Stew'])
+        self.assertEqual(self.titles({'ordering': '-price'}),
+                         ['Stew', 'Rice', 'Soup'])
+        self.assertEqual(self.titles({'ordering': '-time_miniutes'}),
+                         ['Stew', 'Rice', 'Soup'])
+        self.assertEqual(self.titles({'ordering': 'title'}),
+                         ['Rice', 'Soup', 'Stew'])
+
+    def test_unknown_ordering_rejected(self):
+        for ordering in ('link', '-user', 'price,title'):
+            res = self.client.get(RECIPES_URL, {'ordering': ordering})
+
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_ordering_pages(self):
+        res = self.client.get(RECIPES_URL, {'ordering': 'price',
+                                            'page_size': 1})
+        titles = [res.data['results'][0]['title']]
+        while res.data['next']:
+            res = self.client.get(res.data['next'])
+            titles += [recipe['title'] for recipe in res.data['results']]
+
+        self.assertEqual(titles, ['Soup', 'Rice', 'Stew'])
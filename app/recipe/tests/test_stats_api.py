@@ -0,0 +1,99 @@
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+from core.models import Ingredient, Recipe, Tag
+
+STATS_URL = reverse('recipe:stats')
+RECIPES_URL = reverse('recipe:recipe-list')
+
+
+def detail_url(recipe_id):
+    return reverse('recipe:recipe-detail', args=[recipe_id])
+
+
+class RecipeStatsApiTests(TestCase):
+    """Test the recipe statistics of the user"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'test@test.com',
+            'testpass'
+        )
+        self.client.force_authenticate(self.user)
+        self.vegan = Tag.objects.create(user=self.user, name='Vegan')
+        self.kale = Ingredient.objects.create(user=self.user, name='Kale')
+
+    def test_login_required(self):
+        res = APIClient().get(STATS_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_no_recipes(self):
+        res = self.client.get(STATS_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['count'], 0)
+        self.assertIsNone(res.data['price_avg'])
+        self.assertEqual(res.data['top_tags'], [])
+        self.assertEqual(sum(bucket['count']
+                             for bucket in res.data['time_miniutes']), 0)
+
+    def test_stats_follow_writes(self):
+        soup = Recipe.objects.create(user=self.user, title='Soup',
+                                     time_miniutes=5, price=2.00)
+        soup.tags.add(self.vegan)
+        self.client.get(STATS_URL)
+
+        payload = {'title': 'Stew', 'time_miniutes': 125, 'price': '4.50',
+                   'tags': [self.vegan.id], 'ingredients': [self.kale.id]}
+        self.client.post(RECIPES_URL, payload, format='json')
+        self.client.patch(detail_url(soup.id), {'price': '1.00'})
+        res = self.client.get(STATS_URL)
+
+        self.assertEqual(res.data['count'], 2)
+        self.assertEqual(res.data['price_min'], '1.00')
+        self.assertEqual(res.data['price_avg'], '2.75')
+        self.assertEqual(res.data['price_max'], '4.50')
+        self.assertEqual(res.data['time_miniutes'][0],
+                         {'min': 0, 'max': 9, 'count': 1})
+        self.assertEqual(res.data['time_miniutes'][-1],
+                         {'min': 120, 'max': None, 'count': 1})
+        self.assertEqual(res.data['top_tags'],
+                         [{'id': self.vegan.id, 'name': 'Vegan',
+                           'count': 2}])
+        self.assertEqual(res.data['top_ingredients'],
+                         [{'id': self.kale.id, 'name': 'Kale',
+                           'count': 1}])
+
+    def test_top_tags_limited(self):
+        tags = [Tag.objects.create(user=self.user, name=f'tag {index}')
+                for index in range(7)]
+        for index in range(7):
+            recipe = Recipe.objects.create(user=self.user, title='Soup',
+                                           time_miniutes=5, price=1)
+            recipe.tags.add(*tags[:index + 1])
+
+        res = self.client.get(STATS_URL)
+
+        # the five most used, by decreasing count
+        self.assertEqual([(tag['id'], tag['count'])
+                          for tag in res.data['top_tags']],
+                         [(tags[index].id, 7 - index) for index in range(5)])
+
+    # reading the summary does not depend on the number of recipes
+    def test_stats_read_summary(self):
+        for index in range(10):
+            recipe = Recipe.objects.create(user=self.user, title='Soup',
+                                           time_miniutes=index, price=1)
+            recipe.tags.add(self.vegan)
+            recipe.ingredients.add(self.kale)
+        self.client.get(STATS_URL)
+
+        with self.assertNumQueries(4):
+            res = self.client.get(STATS_URL)
+
+        self.assertEqual(res.data['count'], 10)
@@ -46,7 +46,7 @@ class PrivateTagsApiTests(TestCase):
         serializer = TagSerializer(tags, many=True)
 
         self.assertEqual(res.status_code, status.HTTP_200_OK)
-        self.assertEqual(res.data, serializer.data)
+        self.assertEqual(res.data['results'], serializer.data)
 
     # test that only tags belonging to authenticated user are returned
     def test_tags_limited_to_user(self):
@@ -60,8 +60,8 @@ class PrivateTagsApiTests(TestCase):
         res = self.client.get(TAGS_URL)
         self.assertEqual(res.status_code, status.HTTP_200_OK)
         # response is an array of dicts.
-        self.assertEqual(len(res.data), 1)
-        self.assertEqual(res.data[0]['name'], tag.name)
+        self.assertEqual(len(res.data['results']), 1)
+        self.assertEqual(res.data['results'][0]['name'], tag.name)
 
     # test tag creation
     def test_create_tag_successful(self):
@@ -100,5 +100,50 @@ class PrivateTagsApiTests(TestCase):
         serializer1 = TagSerializer(tag1)
         serializer2 = TagSerializer(tag2)
 
-        self.assertIn(serializer1.data, res.data)
-        self.assertNotIn(serializer2.data, res.data)
+        self.assertIn(serializer1.data, res.data['results'])
+        self.assertNotIn(serializer2.data, res.data['results'])
+
+    # limit the tag fields returned
+    def test_retrieve_tags_sparse_fields(self):
+        Tag.objects.create(user=self.user, name="Vegan")
+
+        res = self.client.get(TAGS_URL, {'fields': 'name'})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['results'], [{'name': 'Vegan'}])
+
+    # a tag used by several recipes is listed once
+    def test_retrieve_tags_assigned_unique(self):
+        tag = Tag.objects.create(user=self.user, name='Breakfast')
+        Tag.objects.create(user=self.user, name='Lunch')
+        for title in ('Pancakes', 'Porridge'):
+            recipe = Recipe.objects.create(title=title, time_miniutes=5,
+                                           price=3.00, user=self.user)
+            recipe.tags.add(tag)
+
+        res = self.client.get(TAGS_URL, {'assigned_only': 1})
+
+        self.assertEqual(len(res.data['results']), 1)
+
+    # counts are annotated by the list query itself
+    def test_retrieve_tags_with_counts(self):
+        tag1 = Tag.objects.create(user=self.user, name='Breakfast')
+        tag2 = Tag.objects.create(user=self.user, name='Lunch')
+        for title in ('Pancakes', 'Porridge'):
+            recipe = Recipe.objects.create(title=title, time_miniutes=5,
+                                           price=3.00, user=self.user)
+            recipe.tags.add(tag1)
+
+        with self.assertNumQueries(1):
+            res = self.client.get(TAGS_URL, {'with_counts': 1})
+
+        self.assertEqual(res.data['results'], [
+            {'id': tag2.id, 'name': 'Lunch', 'recipe_count': 0},
+            {'id': tag1.id, 'name': 'Breakfast', 'recipe_count': 2},
+        ])
+
+        res = self.client.get(TAGS_URL, {'with_counts': 1,
+                                         'assigned_only': 1,
+                                         'fields': 'recipe_count'})
+
+        self.assertEqual(res.data['results'], [{'recipe_count': 2}])
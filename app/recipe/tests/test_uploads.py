@@ -0,0 +1,172 @@
+import io
+import os
+import shutil
+import struct
+import tempfile
+import zlib
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from PIL import Image
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.models import Recipe, StoredImage
+from recipe.uploads import SizeLimitedUploadHandler, UploadTooLarge
+
+
+def image_upload_url(recipe_id):
+    return reverse('recipe:recipe-upload-image', args=[recipe_id])
+
+
+def image_file(size=(10, 10), image_format='JPEG', name='photo.jpg'):
+    """return an in memory image file"""
+    file = io.BytesIO()
+    Image.new('RGB', size).save(file, image_format)
+    file.name = name
+    file.seek(0)
+    return file
+
+
+def png_header(width, height):
+    """return a PNG file that only has the header of a huge image"""
+    def chunk(kind, data):
+        return (struct.pack('>I', len(data)) + kind + data +
+                struct.pack('>I', zlib.crc32(kind + data)))
+
+    header = struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)
+    file = io.BytesIO(b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', header) +
+                      chunk(b'IDAT', zlib.compress(b'')) +
+                      chunk(b'IEND', b''))
+    file.name = 'bomb.png'
+    return file
+
+
+class ImageUploadTests(TestCase):
+    """Test the streamed and header checked image uploads"""
+
+    def setUp(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media)
+        settings = override_settings(MEDIA_ROOT=media)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+        self.user = get_user_model().objects.create_user('test@test.com',
+                                                         'testpass')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.recipe = Recipe.objects.create(user=self.user, title='Soup',
+                                            time_miniutes=5, price=1)
+
+    def upload(self, file):
+        return self.client.post(image_upload_url(self.recipe.id),
+                                {'image': file}, format='multipart')
+
+    # the pixels of an accepted image are never decoded
+    def test_upload_reads_header_only(self):
+        with patch('PIL.ImageFile.ImageFile.load') as load:
+            res = self.upload(image_file())
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        load.assert_not_called()
+        self.recipe.refresh_from_db()
+        self.assertTrue(self.recipe.image.name.endswith('.jpg'))
+
+    # a second upload of the same image only writes metadata
+    @patch('core.images.schedule')
+    def test_duplicate_upload_shares_file(self, schedule):
+        other = Recipe.objects.create(user=self.user, title='Stew',
+                                      time_miniutes=5, price=1)
+        self.upload(image_file())
+        StoredImage.objects.update(derivatives={'thumbnail': 't.jpg'})
+
+        # the file was hashed while it streamed in
+        with patch('core.images.file_digest') as file_digest:
+            res = self.client.post(image_upload_url(other.id),
+                                   {'image': image_file()},
+                                   format='multipart')
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        file_digest.assert_not_called()
+        self.recipe.refresh_from_db()
+        other.refresh_from_db()
+        self.assertEqual(other.image.name, self.recipe.image.name)
+        self.assertEqual(other.image_derivatives, {'thumbnail': 't.jpg'})
+        self.assertEqual(StoredImage.objects.get().ref_count, 2)
+        # the derivatives of the first upload are reused
+        self.assertEqual(schedule.call_count, 1)
+
+    def test_delete_image_keeps_shared_file(self):
+        self.upload(image_file())
+        other = Recipe.objects.create(user=self.user, title='Stew',
+                                      time_miniutes=5, price=1)
+        self.client.post(image_upload_url(other.id),
+                         {'image': image_file()}, format='multipart')
+        self.recipe.refresh_from_db()
+
+        res = self.client.delete(image_upload_url(self.recipe.id))
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertIsNone(res.data['image'])
+        self.assertTrue(os.path.exists(self.recipe.image.path))
+        self.assertEqual(StoredImage.objects.get().ref_count, 1)
+
+    @override_settings(RECIPE_IMAGE_MAX_SIZE=1000)
+    def test_upload_too_large(self):
+        res = self.upload(image_file(size=(200, 200)))
+
+        self.assertEqual(res.status_code,
+                         status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        self.recipe.refresh_from_db()
+        self.assertFalse(self.recipe.image)
+
+    def test_decompression_bomb_rejected(self):
+        res = self.upload(png_header(50000, 50000))
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(res.data['image'],
+                         ['The image has too many pixels.'])
+
+    @override_settings(RECIPE_IMAGE_MAX_PIXELS=99)
+    def test_too_many_pixels(self):
+        res = self.upload(image_file(size=(10, 10)))
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_format_not_allowed(self):
+        res = self.upload(image_file(image_format='BMP', name='photo.bmp'))
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(res.data['image'],
+                         ['BMP images are not supported.'])
+
+    def test_not_an_image(self):
+        file = io.BytesIO(b'not an image')
+        file.name = 'photo.jpg'
+
+        res = self.upload(file)
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class SizeLimitedUploadHandlerTests(TestCase):
+    """Test the upload handler capping the size of files"""
+
+    def test_refused_from_content_length(self):
+        handler = SizeLimitedUploadHandler(max_size=10)
+
+        with self.assertRaises(UploadTooLarge):
+            handler.handle_raw_input(None, {}, 10 ** 9, b'boundary')
+
+    # requests sent in chunks have no Content-Length
+    def test_refused_while_streaming(self):
+        handler = SizeLimitedUploadHandler(max_size=10)
+        handler.new_file('image', 'photo.jpg', 'image/jpeg', None)
+
+        handler.receive_data_chunk(b'x' * 10, 0)
+        with self.assertRaises(UploadTooLarge):
+            handler.receive_data_chunk(b'x', 10)
+        self.assertTrue(handler.file.closed)
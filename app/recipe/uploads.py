@@ -0,0 +1,99 @@
+import hashlib
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from django.utils.translation import gettext_lazy as _
+from PIL import Image
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+
+# The default upload handlers keep small files in memory, and the
+# ImageField of DRF opens and verifies the whole image. Image uploads
+# are streamed to a temporary file in chunks instead, and refused as
+# soon as they pass settings.RECIPE_IMAGE_MAX_SIZE. The format and the
+# pixel dimensions are then read from the header of the file, so an
+# image that would take gigabytes once decoded is refused without
+# decoding it. The SHA-256 of the file is computed from the same chunks,
+# core.images stores the file under it.
+
+# room for the multipart boundaries and headers around the file
+MULTIPART_OVERHEAD = 64 * 1024
+
+
+class UploadTooLarge(APIException):
+    status_code = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    default_detail = _('The uploaded file is too large.')
+    default_code = 'upload_too_large'
+
+
+class SizeLimitedUploadHandler(TemporaryFileUploadHandler):
+    """Stream uploaded files to temporary files of at most max_size,
+    and hash them on the way"""
+
+    def __init__(self, request=None, max_size=None):
+        super().__init__(request)
+        if max_size is None:
+            max_size = settings.RECIPE_IMAGE_MAX_SIZE
+        self.max_size = max_size
+        self.received = 0
+
+    # refuse before reading the body when its length is known
+    def handle_raw_input(self, input_data, META, content_length, boundary,
+                         encoding=None):
+        if content_length > self.max_size + MULTIPART_OVERHEAD:
+            raise UploadTooLarge()
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.received = 0
+        self.sha256 = hashlib.sha256()
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        if self.received > self.max_size:
+            # deletes the temporary file
+            self.file.close()
+            raise UploadTooLarge()
+        self.sha256.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        file = super().file_complete(file_size)
+        file.sha256 = self.sha256.hexdigest()
+        return file
+
+
+def check_image_header(file):
+    """return the format of an image file, read from its header only
+
+    Raises ValidationError for files that are not images, in formats
+    that are not allowed, or with too many pixels
+    """
+    try:
+        # open() reads the header, the pixels are decoded by load().
+        # Pillow raises above twice MAX_IMAGE_PIXELS and only warns
+        # below, the size check after this covers that range
+        image = Image.open(file)
+        image_format, (width, height) = image.format, image.size
+    except Image.DecompressionBombError:
+        raise ValidationError(_('The image has too many pixels.'),
+                              code='too_many_pixels')
+    except (OSError, SyntaxError, ValueError):
+        raise ValidationError(_('Upload a valid image. The file you '
+                                'uploaded was either not an image or a '
+                                'corrupted image.'), code='invalid_image')
+    finally:
+        file.seek(0)
+
+    if image_format not in settings.RECIPE_IMAGE_FORMATS:
+        raise ValidationError(
+            _('{format} images are not supported.').format(
+                format=image_format
+            ), code='invalid_format'
+        )
+    if width * height > settings.RECIPE_IMAGE_MAX_PIXELS:
+        raise ValidationError(_('The image has too many pixels.'),
+                              code='too_many_pixels')
+    return image_format
@@ -1,33 +1,85 @@
+from collections import Counter
+
 from rest_framework import viewsets, mixins, status
-from rest_framework.authentication import TokenAuthentication
+from rest_framework.views import APIView
 from rest_framework.permissions import IsAuthenticated
 
-from core.models import Tag, Ingredient, Recipe
-from recipe import serializers
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db.models import F, FloatField, OuterRef, Prefetch, \
+    Subquery, prefetch_related_objects
+from django.db.models.functions import Cast
+from django.http import StreamingHttpResponse
+from django.utils.translation import gettext as _
+
+from core import stats
+from core.models import Tag, Ingredient, Recipe, RecipeStatsCount, \
+    SEARCH_CONFIG
+from recipe import serializers, filters, bulk, export, facets, uploads
+from recipe.budget import QueryBudgetMixin
+from recipe.cache import CachedListMixin
+from recipe.conditional import ConditionalGetMixin
+from recipe.fields import resolve_related
+from recipe.fast import FastListMixin
+from recipe.pagination import KeysetPagination
+from recipe.sparse import SparseFieldsViewMixin
+from user.authentication import CachedTokenAuthentication
 
 # for image upload api view
 from rest_framework.decorators import action
 from rest_framework.response import Response
 
 
+def is_id(value):
+    """return True if value can be a recipe id of a bulk request"""
+    # True is an int too, and lists or dicts can not be looked up
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
 # viewset is used when dealing with multiple instances of a model.
 # viewset is used when we intend to query or filter model objects
 # /api/recepi/tags/ : mapped separately for each user
-class BaseRecepiAttr(viewsets.GenericViewSet,
+class BaseRecepiAttr(QueryBudgetMixin,
+                     ConditionalGetMixin,
+                     CachedListMixin,
+                     FastListMixin,
+                     SparseFieldsViewMixin,
+                     viewsets.GenericViewSet,
                      mixins.ListModelMixin,
                      mixins.RetrieveModelMixin,
                      mixins.DestroyModelMixin,
                      mixins.UpdateModelMixin,
                      mixins.CreateModelMixin):
 
-    authentication_classes = (TokenAuthentication,)
+    authentication_classes = (CachedTokenAuthentication,)
     permission_classes = (IsAuthenticated,)
 
+    # tags and ingredients have no relations to load
+    query_budget = {'list': 1, 'retrieve': 1}
+
+    # actions where ?with_counts=1 adds recipe_count. Counts change
+    # without the updated_at of the object, which validates details
+    counts_actions = ('list',)
+
+    # lists are paginated on the ordering keys.
+    # id breaks ties between equal names
+    pagination_class = KeysetPagination
+    ordering = ('-name', '-id')
+
     # abstract attributes
     @property
     def serializer_class(self):
         raise NotImplementedError
 
+    # serializer used with ?with_counts=1
+    @property
+    def count_serializer_class(self):
+        raise NotImplementedError
+
+    # name of the many to many field of Recipe pointing to this model
+    @property
+    def recipe_relation(self):
+        raise NotImplementedError
+
     # ListModelMixin returns a list of objects when GET is called
     @property
     def queryset(self):
@@ -39,9 +91,31 @@ class BaseRecepiAttr(viewsets.GenericViewSet,
         assigned_only = bool(self.request.query_params.get('assigned_only'))
         queryset = self.queryset
         if assigned_only:
-            # Django also allows access of reverse relation in foreign keys
-            queryset = queryset.filter(recipe__isnull=False)
-        return queryset.filter(user=self.request.user).order_by('-name')
+            # EXISTS on the through table returns every object once,
+            # where joining the recipes returned it once per recipe
+            queryset = filters.filter_assigned(queryset,
+                                               self.recipe_relation)
+        if self.with_counts():
+            # counted by a subquery in the same query
+            queryset = filters.annotate_recipe_count(queryset,
+                                                     self.recipe_relation)
+        queryset = queryset.filter(user=self.request.user)
+        queryset = queryset.order_by(*self.get_ordering())
+        return self.only_requested_columns(queryset)
+
+    def get_ordering(self):
+        """return the ordering keys used for sorting and pagination"""
+        return self.ordering
+
+    def with_counts(self):
+        """return True if recipe counts are requested"""
+        return (self.action in self.counts_actions and
+                bool(self.request.query_params.get('with_counts')))
+
+    def get_serializer_class(self):
+        if self.with_counts():
+            return self.count_serializer_class
+        return self.serializer_class
 
     # override this method for CreateModelMixin
     # create operation is done here (unlike in UserModelSerializer)
@@ -58,6 +132,8 @@ class TagViewSet(BaseRecepiAttr):
 
     queryset = Tag.objects.all()
     serializer_class = serializers.TagSerializer
+    count_serializer_class = serializers.TagCountSerializer
+    recipe_relation = 'tags'
 
 
 # This class looks almost similar to previous class.
@@ -66,20 +142,55 @@ class TagViewSet(BaseRecepiAttr):
 class IngredientViewSet(BaseRecepiAttr):
 
     serializer_class = serializers.IngredientSerializer
+    count_serializer_class = serializers.IngredientCountSerializer
     queryset = Ingredient.objects.all()
+    recipe_relation = 'ingredients'
 
 
 # Extend from 'ModelViewSet' has all request mixins
 # API CALL (recipe-list) : /api/recipe/recipes
 # API CALL (recipe-detail) : /api/recipe/recipes/<pk>/
-class RecipeViewSet(viewsets.ModelViewSet):
+class RecipeViewSet(QueryBudgetMixin,
+                    ConditionalGetMixin,
+                    CachedListMixin,
+                    FastListMixin,
+                    SparseFieldsViewMixin,
+                    viewsets.ModelViewSet):
     """Manage recipes in the database"""
-    authentication_classes = (TokenAuthentication,)
+    authentication_classes = (CachedTokenAuthentication,)
     permission_classes = (IsAuthenticated,)
 
     serializer_class = serializers.RecipeSerializer
     queryset = Recipe.objects.all()
 
+    # one query for the recipes and one per prefetched relation,
+    # whatever the number of recipes returned
+    query_budget = {'list': 3, 'retrieve': 3, 'facets': 2}
+
+    # newest recipes first
+    pagination_class = KeysetPagination
+    ordering = ('-id',)
+
+    # columns of the related objects rendered by each action.
+    # RecipeSerializer only renders primary keys,
+    # RecipeDetailSerializer nests the id and name of each object.
+    # Actions not listed here do not render relations
+    prefetch_plan = {
+        'list': ('id',),
+        'retrieve': ('id', 'name'),
+        'update': ('id',),
+        'partial_update': ('id',),
+        'bulk': ('id',),
+    }
+
+    # largest number of recipes accepted by one bulk request
+    bulk_max_items = 5000
+
+    # recipes read from the database at a time by the export
+    export_chunk_size = export.EXPORT_CHUNK_SIZE
+    # ?format= is taken by DRF to pick a renderer
+    export_query_param = 'as'
+
     # django allows to change serializers depending on action
     # we can have differernt serializer for list and detail views
     # for this, we have to override this function
@@ -91,28 +202,81 @@ class RecipeViewSet(viewsets.ModelViewSet):
 
         return self.serializer_class
 
-    # helper function
-    # _ prefix is used to indicate private function
-    def _params_to_int(self, qs):
-        """convert a list of string IDs to ints"""
-        return [int(str_id) for str_id in qs.split(',')]
-
     def get_queryset(self):
         # filtering based on params in payload
         # returns none if params are not available
-        tags = self.request.query_params.get('tags')
-        ingredients = self.request.query_params.get('ingredients')
+        params = self.request.query_params
+        tags = params.get('tags')
+        ingredients = params.get('ingredients')
         queryset = self.queryset
 
+        # match=any (default) keeps recipes with one of the ids,
+        # match=all keeps recipes with every one of them
+        match = filters.get_match(params)
         if tags:
-            tag_ids = self._params_to_int(tags)
-            # djangos filter for attrs
-            queryset = queryset.filter(tags__id__in=tag_ids)
+            tag_ids = filters.params_to_ints(tags)
+            queryset = filters.filter_related(queryset, 'tags',
+                                              tag_ids, match)
         if ingredients:
-            ingredient_ids = self._params_to_int(ingredients)
-            queryset = queryset.filter(ingredients__id__in=ingredient_ids)
+            ingredient_ids = filters.params_to_ints(ingredients)
+            queryset = filters.filter_related(queryset, 'ingredients',
+                                              ingredient_ids, match)
+
+        queryset = filters.filter_ranges(queryset, params)
+
+        # full text search on title, tag names and ingredient names.
+        # The rank is cast to double precision so that it can be
+        # compared exactly to the value stored in a pagination cursor
+        search = params.get('search')
+        if search:
+            query = SearchQuery(search, config=SEARCH_CONFIG)
+            queryset = queryset.filter(search_vector=query).annotate(
+                rank=Cast(SearchRank(F('search_vector'), query), FloatField())
+            )
 
-        return queryset.filter(user=self.request.user)
+        # the search document is never rendered
+        queryset = queryset.defer('search_vector')
+        queryset = queryset.filter(user=self.request.user)
+        queryset = queryset.order_by(*self.get_ordering())
+        queryset = self.only_requested_columns(queryset)
+        # a single recipe is checked against the conditional headers
+        # first, its relations are loaded by load_relations
+        if self.action == 'retrieve':
+            return queryset
+        return queryset.prefetch_related(*self.get_prefetches())
+
+    def get_ordering(self):
+        """return the ordering keys used for sorting and pagination"""
+        # search results are sorted by relevance unless asked otherwise
+        params = self.request.query_params
+        default = self.ordering
+        if params.get('search'):
+            default = ('-rank', '-id')
+        return filters.get_ordering(params, default)
+
+    # without prefetching, the serializer runs one query per recipe
+    # for tags and another one for ingredients
+    def get_prefetches(self):
+        """return the Prefetch objects needed by the current action"""
+        fields = self.prefetch_plan.get(self.action)
+        if fields is None:
+            return []
+        # related objects are listed by id, as in the fast list path
+        prefetches = [
+            Prefetch('tags',
+                     queryset=Tag.objects.only(*fields).order_by('id')),
+            Prefetch('ingredients',
+                     queryset=Ingredient.objects.only(*fields).order_by('id')),
+        ]
+        # relations left out of ?fields= are not loaded
+        requested = self.get_requested_fields()
+        if requested is None:
+            return prefetches
+        return [prefetch for prefetch in prefetches
+                if prefetch.prefetch_to in requested]
+
+    def load_relations(self, instance):
+        prefetch_related_objects([instance], *self.get_prefetches())
 
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
@@ -127,6 +291,142 @@ class RecipeViewSet(viewsets.ModelViewSet):
         # print("GET with id")
         return super().retrieve(request, pk)
 
+    # API CALL (recipe-bulk) : /api/recipe/recipes/bulk/
+    # POST a list of recipes to create them,
+    # PATCH a list of recipes with their id to update them,
+    # DELETE a list of ids to delete them.
+    # Every item is validated first. If one is invalid nothing is written
+    # and the errors are returned in a list matching the items
+    @action(methods=['POST', 'PATCH', 'DELETE'],
+            detail=False, url_path='bulk')
+    def bulk(self, request):
+        items = request.data
+        if not isinstance(items, list):
+            return Response({'detail': _('Expected a list of items')},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if len(items) > self.bulk_max_items:
+            msg = _('At most {count} items are accepted').format(
+                count=self.bulk_max_items
+            )
+            return Response({'detail': msg},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        if request.method == 'POST':
+            return self._bulk_create(items)
+        elif request.method == 'PATCH':
+            return self._bulk_update(items)
+        return self._bulk_delete(items)
+
+    def bulk_context(self, items):
+        """return a serializer context holding the tags and ingredients
+        of every item"""
+        context = self.get_serializer_context()
+        context['related_objects'] = resolve_related(
+            self.get_serializer().fields, items
+        )
+        return context
+
+    def _bulk_create(self, items):
+        serializer = self.get_serializer_class()(
+            data=items, many=True, context=self.bulk_context(items)
+        )
+        if not serializer.is_valid():
+            return Response({'errors': serializer.errors},
+                            status=status.HTTP_400_BAD_REQUEST)
+        recipes = bulk.bulk_create_recipes(self.request.user,
+                                           serializer.validated_data)
+        return Response(self._bulk_data(recipes),
+                        status=status.HTTP_201_CREATED)
+
+    def _bulk_update(self, items):
+        ids = [item.get('id') for item in items if isinstance(item, dict)]
+        ids = [pk for pk in ids if is_id(pk)]
+        instances = self.queryset.filter(user=self.request.user) \
+            .defer('search_vector').in_bulk(ids)
+        counts = Counter(ids)
+        context = self.bulk_context(items)
+
+        pairs, errors = [], []
+        for item in items:
+            pk = item.get('id') if isinstance(item, dict) else None
+            if not is_id(pk) or pk not in instances:
+                errors.append({'id': [_('Not found.')]})
+                continue
+            # the later item would silently overwrite the earlier one
+            if counts[pk] > 1:
+                errors.append({'id': [_('Duplicate id.')]})
+                continue
+            serializer = self.get_serializer_class()(
+                instances[pk], data=item, partial=True, context=context
+            )
+            if serializer.is_valid():
+                pairs.append((instances[pk], serializer.validated_data))
+                errors.append({})
+            else:
+                errors.append(serializer.errors)
+
+        if any(errors):
+            return Response({'errors': errors},
+                            status=status.HTTP_400_BAD_REQUEST)
+        recipes = bulk.bulk_update_recipes(self.request.user, pairs)
+        return Response(self._bulk_data(recipes), status=status.HTTP_200_OK)
+
+    def _bulk_delete(self, ids):
+        existing = set(
+            self.queryset.filter(user=self.request.user, pk__in=[
+                pk for pk in ids if is_id(pk)
+            ]).values_list('pk', flat=True)
+        )
+        errors = [{} if is_id(pk) and pk in existing
+                  else {'id': [_('Not found.')]} for pk in ids]
+        if any(errors):
+            return Response({'errors': errors},
+                            status=status.HTTP_400_BAD_REQUEST)
+        bulk.bulk_delete_recipes(self.request.user, ids)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    def _bulk_data(self, recipes):
+        """serialize written recipes in the order they were given"""
+        fresh = Recipe.objects.defer('search_vector') \
+            .prefetch_related(*self.get_prefetches()) \
+            .in_bulk([recipe.pk for recipe in recipes])
+        serializer = self.get_serializer(
+            [fresh[recipe.pk] for recipe in recipes], many=True
+        )
+        return serializer.data
+
+    # API CALL (recipe-facets) : /api/recipe/recipes/facets/
+    # takes the tags, ingredients, match and search params of the list
+    # and returns the number of matching recipes using each tag and
+    # each ingredient
+    @action(methods=['GET'], detail=False, url_path='facets')
+    def facets(self, request):
+        recipes = self.filter_queryset(self.get_queryset())
+        return Response(facets.facet_counts(recipes))
+
+    # API CALL (recipe-export) : /api/recipe/recipes/export/
+    # streams every recipe of the user with its tags and ingredients,
+    # one JSON document per line, or as one array with ?as=json.
+    # The filters and search of the list apply, pagination does not
+    @action(methods=['GET'], detail=False, url_path='export')
+    def export(self, request):
+        layout = request.query_params.get(self.export_query_param,
+                                          export.NDJSON)
+        if layout not in export.STREAMS:
+            msg = _('Unknown export format: {name}').format(name=layout)
+            return Response({self.export_query_param: [msg]},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        queryset = self.filter_queryset(self.get_queryset())
+        recipes = export.export_recipes(queryset, self.export_chunk_size)
+        response = StreamingHttpResponse(
+            export.STREAMS[layout](recipes),
+            content_type=export.CONTENT_TYPES[layout],
+        )
+        response['Content-Disposition'] = \
+            f'attachment; filename="recipes.{layout}"'
+        return response
+
     # writing custom function on call to specific api with specific request
     # POST request to url to this appened with upload-image with pk arg(detail)
     # This function becomes a custom action = upload_image
@@ -138,6 +438,11 @@ class RecipeViewSet(viewsets.ModelViewSet):
         # ie, we have to manually serialize our objects
         recipe = self.get_object()
         if(request.method == 'POST'):
+            # the file is streamed to disk, up to the size cap,
+            # when request.data is first read
+            request.upload_handlers = [
+                uploads.SizeLimitedUploadHandler(request)
+            ]
             # modify get_serializer_class to consider this action
             serializer = self.get_serializer(recipe, data=request.data)
 
@@ -149,9 +454,67 @@ class RecipeViewSet(viewsets.ModelViewSet):
                                 status=status.HTTP_400_BAD_REQUEST)
         elif(request.method == 'DELETE'):
             if recipe.image:
-                recipe.image.delete()
+                # the file may be used by other recipes, save() drops
+                # the reference of this one (see core.images)
+                recipe.image = None
+                recipe.save()
                 serializer = self.get_serializer(recipe)
                 return Response(serializer.data, status=status.HTTP_200_OK)
         else:
             serializer = self.get_serializer(recipe)
             return Response(serializer.data, status=status.HTTP_200_OK)
+
+
+# API CALL (recipe-stats) : /api/recipe/stats/
+# reads the summary kept up to date by core.stats, so the cost does not
+# depend on the number of recipes of the user
+class RecipeStatsView(APIView):
+    """Statistics of the recipes of the user"""
+    authentication_classes = (CachedTokenAuthentication,)
+    permission_classes = (IsAuthenticated,)
+
+    # number of tags and ingredients listed
+    top_count = 5
+
+    def get(self, request):
+        summary = stats.get_stats(request.user.pk)
+        counts = RecipeStatsCount.objects.filter(user=request.user)
+        buckets = dict(counts.filter(kind=RecipeStatsCount.TIME)
+                       .values_list('key', 'count'))
+
+        average = None
+        if summary.recipe_count:
+            average = summary.price_total / summary.recipe_count
+        data = {
+            'count': summary.recipe_count,
+            'price_min': summary.price_min,
+            'price_avg': average,
+            'price_max': summary.price_max,
+            'time_miniutes': self.time_buckets(buckets),
+            'top_tags': self.top(
+                Tag, counts.filter(kind=RecipeStatsCount.TAG)
+            ),
+            'top_ingredients': self.top(
+                Ingredient, counts.filter(kind=RecipeStatsCount.INGREDIENT)
+            ),
+        }
+        return Response(serializers.RecipeStatsSerializer(data).data)
+
+    def time_buckets(self, counts):
+        bounds = stats.TIME_BUCKETS
+        return [
+            {'min': bound,
+             'max': bounds[index + 1] - 1 if index + 1 < len(bounds) else None,
+             'count': counts.get(index, 0)}
+            for index, bound in enumerate(bounds)
+        ]
+
+    def top(self, model, counts):
+        """return the most used objects, by decreasing count"""
+        names = model.objects.filter(pk=OuterRef('key')).values('name')
+        rows = counts.filter(count__gt=0) \
+            .annotate(name=Subquery(names)) \
+            .order_by('-count', 'key')[:self.top_count] \
+            .values_list('key', 'name', 'count')
+        return [{'id': pk, 'name': name, 'count': count}
+                for pk, name, count in rows if name is not None]
@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class UserConfig(AppConfig):
     name = 'user'
+
+    # connect the signal handlers once the models are loaded
+    def ready(self):
+        from user import signals  # noqa: F401
@@ -0,0 +1,111 @@
+import copy
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from django.conf import settings
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+
+
+CacheInfo = namedtuple('CacheInfo', ['hits', 'misses', 'size', 'max_size'])
+
+
+# TokenAuthentication loads the token and its user with a join on every
+# request. The cache below keeps token key -> (user, token) for a few
+# seconds in each process. Entries are dropped by user.signals when the
+# token is deleted or the user is saved (which includes deactivation);
+# the TTL bounds how long another process may serve a stale entry.
+class TokenCache:
+    """Thread safe LRU cache of authenticated tokens with a TTL"""
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        # key -> (expiry, user, token), least recently used first
+        self._entries = OrderedDict()
+        # user id -> keys of the tokens of the user
+        self._user_keys = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """return (user, token) for a key, or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= time.monotonic():
+                if entry is not None:
+                    self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1], entry[2]
+
+    def set(self, key, user, token):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic() + self.ttl, user, token)
+            self._user_keys.setdefault(user.pk, set()).add(key)
+            while len(self._entries) > self.max_size:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def invalidate_user(self, user_id):
+        with self._lock:
+            for key in list(self._user_keys.get(user_id, ())):
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._user_keys.clear()
+            self.hits = self.misses = 0
+
+    def info(self):
+        """return the hit and miss counters, like functools.lru_cache"""
+        with self._lock:
+            return CacheInfo(self.hits, self.misses, len(self._entries),
+                             self.max_size)
+
+    # callers hold the lock
+    def _remove(self, key):
+        expiry, user, token = self._entries.pop(key)
+        keys = self._user_keys.get(user.pk)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._user_keys[user.pk]
+
+
+token_cache = TokenCache(
+    max_size=getattr(settings, 'TOKEN_CACHE_SIZE', 10000),
+    ttl=getattr(settings, 'TOKEN_CACHE_TTL', 60),
+)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """TokenAuthentication that keeps recently used tokens in memory"""
+
+    cache = token_cache
+
+    def authenticate_credentials(self, key):
+        cached = self.cache.get(key)
+        if cached is None:
+            user, token = super().authenticate_credentials(key)
+            self.cache.set(key, user, token)
+        else:
+            user, token = cached
+            if not user.is_active:
+                raise exceptions.AuthenticationFailed(
+                    _('User inactive or deleted.')
+                )
+        # every request gets its own copy, views may change request.user
+        return copy.copy(user), token
@@ -0,0 +1,208 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+from django.conf import settings
+from django.contrib.auth import authenticate, get_user_model
+from django.contrib.auth.hashers import get_hasher, identify_hasher, \
+    make_password
+from django.db import close_old_connections
+from django.utils.translation import gettext_lazy as _
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from core.models import rehash_deferred
+
+
+logger = logging.getLogger(__name__)
+
+
+# authenticate() hashes the submitted password on the request worker,
+# and PBKDF2 is slow on purpose. During a burst of logins every worker
+# ends up hashing. Here authenticate() runs on a fixed number of threads
+# (hashlib releases the GIL while hashing), at most queue_size more wait
+# for one, and any further login is answered with 503 at once.
+# The authentication backends run unchanged: they look the user up,
+# refuse inactive users and send user_login_failed. A hash made with
+# other hasher settings is replaced after the response, on the pool too.
+
+class VerifierBusy(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = _('Too many logins in progress, try again later.')
+    default_code = 'verifier_busy'
+
+
+class Timer:
+    """count, total and max of durations, in seconds"""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def as_dict(self):
+        return {
+            'count': self.count,
+            'avg': self.total / self.count if self.count else 0.0,
+            'max': self.max,
+        }
+
+
+class PasswordVerifier:
+    """Check passwords on a bounded pool of threads"""
+
+    def __init__(self, workers, queue_size, timeout):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix='password'
+        )
+        self._slots = threading.BoundedSemaphore(workers + queue_size)
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.verified = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.rehashed = 0
+        self.wait_time = Timer()
+        self.hash_time = Timer()
+
+    def _run(self, function, *args, **kwargs):
+        """run function on the pool and return its result"""
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise VerifierBusy()
+        with self._lock:
+            self.in_flight += 1
+        queued = time.monotonic()
+
+        def task():
+            started = time.monotonic()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                finished = time.monotonic()
+                # the thread has its own database connection
+                close_old_connections()
+                with self._lock:
+                    self.wait_time.add(started - queued)
+                    self.hash_time.add(finished - started)
+                    self.in_flight -= 1
+                self._slots.release()
+
+        future = self._executor.submit(task)
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            # the hash keeps its slot until it finishes
+            with self._lock:
+                self.timed_out += 1
+            raise VerifierBusy()
+
+    def authenticate(self, request, **credentials):
+        """return the user authenticate() finds for credentials, or None"""
+        user = self._run(self._authenticate, request, credentials)
+        with self._lock:
+            self.verified += 1
+        return user
+
+    @staticmethod
+    def _authenticate(request, credentials):
+        # the hash is replaced by rehash_later, after the response
+        with rehash_deferred():
+            return authenticate(request, **credentials)
+
+    def rehash_later(self, user_id, password, encoded):
+        """store a hash with the current hasher settings, off the
+        request path. Skipped when the pool is busy; the next login
+        tries again"""
+        if not self._slots.acquire(blocking=False):
+            return
+
+        def task():
+            try:
+                self.rehash(user_id, password, encoded)
+            except Exception:
+                logger.exception('rehashing the password of user %s failed',
+                                 user_id)
+            finally:
+                close_old_connections()
+                self._slots.release()
+
+        self._executor.submit(task)
+
+    def rehash(self, user_id, password, encoded):
+        """replace the hash of a user, unless it changed meanwhile"""
+        updated = get_user_model().objects \
+            .filter(pk=user_id, password=encoded) \
+            .update(password=make_password(password))
+        with self._lock:
+            self.rehashed += updated
+
+    def metrics(self):
+        hasher = get_hasher()
+        with self._lock:
+            return {
+                'hasher': {
+                    'algorithm': hasher.algorithm,
+                    'iterations': getattr(hasher, 'iterations', None),
+                },
+                'workers': self.workers,
+                'queue_size': self.queue_size,
+                'in_flight': self.in_flight,
+                'verified': self.verified,
+                'rejected': self.rejected,
+                'timed_out': self.timed_out,
+                'rehashed': self.rehashed,
+                'wait_seconds': self.wait_time.as_dict(),
+                'hash_seconds': self.hash_time.as_dict(),
+            }
+
+
+_verifier = None
+_verifier_lock = threading.Lock()
+
+
+def get_verifier():
+    """return the verifier of this process, created on first use so
+    that forked worker processes do not share its threads"""
+    global _verifier
+    with _verifier_lock:
+        if _verifier is None:
+            _verifier = PasswordVerifier(
+                workers=settings.PASSWORD_WORKERS,
+                queue_size=settings.PASSWORD_QUEUE_SIZE,
+                timeout=settings.PASSWORD_VERIFY_TIMEOUT,
+            )
+        return _verifier
+
+
+def must_update(encoded):
+    """return True if a hash was made with other hasher settings"""
+    try:
+        hasher = identify_hasher(encoded)
+    except ValueError:
+        return False
+    preferred = get_hasher()
+    return (hasher.algorithm != preferred.algorithm or
+            preferred.must_update(encoded))
+
+
+def verify_credentials(request, email, password):
+    """return the active user with these credentials, or None
+
+    authenticate() with the hash computed on the verifier pool
+    """
+    verifier = get_verifier()
+    user = verifier.authenticate(request, username=email, password=password)
+    if user is not None and must_update(user.password):
+        verifier.rehash_later(user.pk, password, user.password)
+    return user
@@ -1,7 +1,9 @@
-from django.contrib.auth import get_user_model, authenticate
+from django.contrib.auth import get_user_model
 from django.utils.translation import ugettext_lazy as _
 from rest_framework import serializers
 
+from user.passwords import verify_credentials
+
 
 # This serializer is for for an API that will add data to a model
 class UserSerializer(serializers.ModelSerializer):
@@ -19,6 +21,16 @@ class UserSerializer(serializers.ModelSerializer):
         # for password field, args under serializer.CharField are also valid
         extra_kwargs = {'password': {'write_only': True, 'min_length': 5}}
 
+    # the unique validator of the model field is case sensitive
+    def validate_email(self, value):
+        pk = self.instance.pk if self.instance is not None else None
+        if get_user_model().objects.email_taken(value, exclude_pk=pk):
+            raise serializers.ValidationError(
+                _('user with this email already exists.'),
+                code='unique'
+            )
+        return value
+
     # create is called when we use the CreateAPI view
     # which takes a POST request to create a user
     def create(self, validated_data):
@@ -58,11 +70,10 @@ class AuthTokenSerializer(serializers.Serializer):
         email = attrs.get('email')
         password = attrs.get('password')
 
-        user = authenticate(
-                request=self.context.get('request'),
-                username=email,
-                password=password
-            )
+        # the password is hashed on a bounded pool of threads,
+        # see user.passwords
+        user = verify_credentials(self.context.get('request'), email,
+                                  password)
         if not user:
             # we use gettext to enable language tranlation for this text
             msg = _("Unable to authenticate with credentials provided")
@@ -0,0 +1,132 @@
+from unittest.mock import Mock, patch
+
+from django.test import TransactionTestCase, override_settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.signals import user_login_failed
+from django.contrib.auth.hashers import make_password
+from django.urls import reverse
+from rest_framework.test import APIClient
+from rest_framework import status
+
+from user.passwords import PasswordVerifier, get_verifier
+
+TOKEN_URL = reverse("user:token")
+METRICS_URL = reverse("user:token-metrics")
+
+
+# logins query the database from the threads of the verifier
+class PasswordVerifierTests(TransactionTestCase):
+    """Test the bounded pool hashing login passwords"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            email='test@test.com',
+            password='testpass'
+        )
+        self.payload = {'email': 'test@test.com', 'password': 'testpass'}
+
+    def test_login_through_pool(self):
+        verified = get_verifier().verified
+
+        res = self.client.post(TOKEN_URL, self.payload)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(get_verifier().verified, verified + 1)
+
+    def test_wrong_password_and_unknown_email(self):
+        res = self.client.post(TOKEN_URL, {'email': 'test@test.com',
+                                           'password': 'wrong'})
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+        res = self.client.post(TOKEN_URL, {'email': 'other@test.com',
+                                           'password': 'testpass'})
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_inactive_user_rejected(self):
+        self.user.is_active = False
+        self.user.save()
+
+        res = self.client.post(TOKEN_URL, self.payload)
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    # with every worker and queue slot taken, logins fail fast
+    def test_busy_pool_answers_503(self):
+        verifier = PasswordVerifier(workers=1, queue_size=0, timeout=1)
+        verifier._slots.acquire()
+
+        with patch('user.passwords.get_verifier', return_value=verifier):
+            res = self.client.post(TOKEN_URL, self.payload)
+
+        self.assertEqual(res.status_code,
+                         status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(res['Retry-After'], '1')
+        self.assertEqual(verifier.metrics()['rejected'], 1)
+
+    # a hash made with other settings is replaced after the login
+    def test_outdated_hash_replaced(self):
+        old = make_password('testpass', hasher='pbkdf2_sha1')
+        get_user_model().objects.filter(pk=self.user.pk).update(password=old)
+
+        with patch.object(PasswordVerifier, 'rehash_later') as rehash_later:
+            res = self.client.post(TOKEN_URL, self.payload)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        # the login itself leaves the hash alone
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.password, old)
+        rehash_later.assert_called_once_with(self.user.pk, 'testpass', old)
+
+        verifier = PasswordVerifier(workers=1, queue_size=0, timeout=1)
+        verifier.rehash(self.user.pk, 'testpass', old)
+
+        self.assertEqual(verifier.metrics()['rehashed'], 1)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.password.startswith('pbkdf2_sha256$'))
+        self.assertTrue(self.user.check_password('testpass'))
+
+    def test_rehash_skipped_if_password_changed(self):
+        verifier = PasswordVerifier(workers=1, queue_size=0, timeout=1)
+
+        verifier.rehash(self.user.pk, 'testpass', 'outdated hash')
+
+        self.assertEqual(verifier.rehashed, 0)
+
+    def test_login_failed_signal_sent(self):
+        handler = Mock()
+        user_login_failed.connect(handler)
+        self.addCleanup(user_login_failed.disconnect, handler)
+
+        self.client.post(TOKEN_URL, {'email': 'test@test.com',
+                                     'password': 'wrong'})
+
+        handler.assert_called_once()
+        self.assertEqual(handler.call_args[1]['credentials']['username'],
+                         'test@test.com')
+
+    @override_settings(AUTHENTICATION_BACKENDS=[
+        'django.contrib.auth.backends.AllowAllUsersModelBackend'
+    ])
+    def test_authentication_backends_used(self):
+        self.user.is_active = False
+        self.user.save()
+
+        res = self.client.post(TOKEN_URL, self.payload)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+    def test_metrics_for_admins_only(self):
+        self.client.force_authenticate(self.user)
+        res = self.client.get(METRICS_URL)
+        self.assertEqual(res.status_code, status.HTTP_403_FORBIDDEN)
+
+        admin = get_user_model().objects.create_superuser('admin@test.com',
+                                                          'testpass')
+        self.client.force_authenticate(admin)
+        res = self.client.get(METRICS_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['hasher']['algorithm'], 'pbkdf2_sha256')
+        self.assertGreater(res.data['hasher']['iterations'], 0)
+        self.assertIn('avg', res.data['hash_seconds'])
@@ -0,0 +1,115 @@
+from unittest.mock import patch
+
+from django.test import TestCase
+from django.contrib.auth import get_user_model
+from django.urls import reverse
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+from rest_framework import status
+
+from user.authentication import TokenCache, token_cache
+
+ME_URL = reverse("user:me")
+
+
+class TokenCacheApiTests(TestCase):
+    """Test the in memory cache of authenticated tokens"""
+
+    def setUp(self):
+        token_cache.clear()
+        self.user = get_user_model().objects.create_user(
+            email='test@test.com',
+            password='testpass',
+            name='name'
+        )
+        self.token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    # the second request does not load the token and the user
+    def test_repeated_requests_hit_cache(self):
+        self.client.get(ME_URL)
+
+        with self.assertNumQueries(0):
+            res = self.client.get(ME_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['email'], 'test@test.com')
+        info = token_cache.info()
+        self.assertEqual((info.hits, info.misses, info.size), (1, 1, 1))
+
+    def test_token_deletion_invalidates(self):
+        self.client.get(ME_URL)
+
+        self.token.delete()
+        res = self.client.get(ME_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_user_deactivation_invalidates(self):
+        self.client.get(ME_URL)
+
+        self.user.is_active = False
+        self.user.save()
+        res = self.client.get(ME_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_user_update_invalidates(self):
+        self.client.get(ME_URL)
+
+        self.client.patch(ME_URL, {'name': 'new name'})
+        res = self.client.get(ME_URL)
+
+        self.assertEqual(res.data['name'], 'new name')
+
+    def test_invalid_token_not_cached(self):
+        self.client.credentials(HTTP_AUTHORIZATION='Token wrong')
+
+        res = self.client.get(ME_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(token_cache.info().size, 0)
+
+
+class TokenCacheTests(TestCase):
+    """Test the bounds of the token cache"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('test@test.com')
+
+    def test_least_recently_used_evicted(self):
+        cache = TokenCache(max_size=2, ttl=60)
+        cache.set('a', self.user, 'token a')
+        cache.set('b', self.user, 'token b')
+        cache.get('a')
+
+        cache.set('c', self.user, 'token c')
+
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), (self.user, 'token a'))
+        self.assertEqual(cache.info().size, 2)
+
+    @patch('user.authentication.time.monotonic')
+    def test_entries_expire(self, monotonic):
+        cache = TokenCache(max_size=2, ttl=60)
+        monotonic.return_value = 100
+        cache.set('a', self.user, 'token a')
+
+        monotonic.return_value = 159
+        self.assertIsNotNone(cache.get('a'))
+        monotonic.return_value = 160
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.info().size, 0)
+
+    def test_invalidate_user(self):
+        cache = TokenCache(max_size=10, ttl=60)
+        other = get_user_model().objects.create_user('other@test.com')
+        cache.set('a', self.user, 'token a')
+        cache.set('b', self.user, 'token b')
+        cache.set('c', other, 'token c')
+
+        cache.invalidate_user(self.user.pk)
+
+        self.assertEqual(cache.info().size, 1)
+        self.assertIsNotNone(cache.get('c'))
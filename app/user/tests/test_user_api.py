@@ -1,4 +1,4 @@
-from django.test import TestCase
+from django.test import TransactionTestCase
 from django.contrib.auth import get_user_model
 from django.urls import reverse
 from rest_framework.test import APIClient
@@ -6,14 +6,16 @@ from rest_framework import status
 
 
 CREATE_USER_URL = reverse("user:create")
+TOKEN_URL = reverse("user:token")
 
 
 def create_user(**kwargs):
     return get_user_model().objects.create_user(**kwargs)
 
 
-# 'Public' because we dont check for authentication
-class PublicUserApiTests(TestCase):
+# 'Public' because we dont check for authentication.
+# Logins query the database from the threads of user.passwords
+class PublicUserApiTests(TransactionTestCase):
     """Test the users API (public)"""
 
     def setUp(self):
@@ -66,3 +68,23 @@ class PublicUserApiTests(TestCase):
             email=payload['email']
         ).exists()
         self.assertFalse(user_exists)
+
+    # emails differing only by case belong to the same user
+    def test_user_exists_other_case(self):
+        create_user(email='test@test.com', password='testpass')
+
+        res = self.client.post(CREATE_USER_URL, {
+            'email': 'TEST@test.com',
+            'password': 'testpass',
+            'name': 'Test',
+        })
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_create_token_other_case(self):
+        create_user(email='test@test.com', password='testpass')
+
+        res = self.client.post(TOKEN_URL, {'email': 'Test@Test.com',
+                                           'password': 'testpass'})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
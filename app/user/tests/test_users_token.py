@@ -1,4 +1,4 @@
-from django.test import TestCase
+from django.test import TransactionTestCase
 from django.contrib.auth import get_user_model
 from django.urls import reverse
 from rest_framework.test import APIClient
@@ -11,7 +11,8 @@ def create_user(**kwargs):
     return get_user_model().objects.create_user(**kwargs)
 
 
-class UserTokenTests(TestCase):
+# logins query the database from the threads of user.passwords
+class UserTokenTests(TransactionTestCase):
     """The API client may not want to send users ID and password
         for every request. In such cases, the user may generate a token
         which will be used for authentication"""
@@ -6,5 +6,7 @@ app_name = 'user'
 urlpatterns = [
     path('create/', views.CreateUserView.as_view(), name='create'),
     path('token/', views.CreateTokenView.as_view(), name='token'),
+    path('token/metrics/', views.TokenMetricsView.as_view(),
+         name='token-metrics'),
     path('me/', views.ManageUserView.as_view(), name='me'),
 ]
@@ -1,6 +1,10 @@
-from rest_framework import generics, authentication, permissions
+from rest_framework import generics, permissions
+from rest_framework.response import Response
+from rest_framework.views import APIView
 from rest_framework.authtoken.views import ObtainAuthToken
 from rest_framework.settings import api_settings
+from user.authentication import CachedTokenAuthentication
+from user.passwords import VerifierBusy, get_verifier
 from user.serializers import UserSerializer, AuthTokenSerializer
 
 
@@ -18,11 +22,29 @@ class CreateTokenView(ObtainAuthToken):
     # as it did when extended from generic views
     renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES
 
+    # seconds a client should wait when every password worker is busy
+    retry_after = 1
+
+    def handle_exception(self, exc):
+        response = super().handle_exception(exc)
+        if isinstance(exc, VerifierBusy):
+            response['Retry-After'] = str(self.retry_after)
+        return response
+
+
+# view for API reporting the load of the password workers
+class TokenMetricsView(APIView):
+    authentication_classes = (CachedTokenAuthentication,)
+    permission_classes = (permissions.IsAdminUser,)
+
+    def get(self, request):
+        return Response(get_verifier().metrics())
+
 
 # view for API retrieving and updating user info
 class ManageUserView(generics.RetrieveUpdateAPIView):
     serializer_class = UserSerializer
-    authentication_classes = (authentication.TokenAuthentication,)
+    authentication_classes = (CachedTokenAuthentication,)
     permission_classes = (permissions.IsAuthenticated,)
 
     # retrieve and return authenticated user